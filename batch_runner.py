@@ -0,0 +1,274 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+import numpy as np
+import yaml
+
+from parsed_files_cache import ParsedFilesCache
+from results_tables import EXPORT_FORMATS
+from rfid_pollinators_pipeline import Pipeline, Plot
+
+BATCH_DEFAULT_PARAMETERS = {"max_time_between_signals": 7, "round_or_truncate": "round", "pollinators_to_remove": [],
+                            "filter_tags_by_visited_genotypes": False, "visited_genotypes_required": [],
+                            "filter_start_datetime": "", "filter_end_datetime": "", "visited_genotypes_mode": "all",
+                            "min_visited_genotypes": 1, "ttest_method": "student", "ttest_correction": "none"}
+BATCH_DEFAULT_EXPORT_FORMATS = ["xlsx"]
+BATCH_RUN_FILE = "batch_run.json"  # written when an experiment finishes, so the next batch skips it
+BATCH_PARSED_FILES_FOLDER = "parsed_files"
+EXPERIMENT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def load_batch_config(config_path: str) -> dict:
+    """
+    Reads a batch of experiments from a YAML (or JSON) config, and returns its output folder and the experiments
+    with their files resolved and the default parameters filled in. Each experiment has:
+    - name: the folder of its outputs, unique in the batch
+    - files: paths (or glob patterns) of its reader files, relative to the config file
+    - genotypes: the genotypes of the antennas, a map for all the files or a list with a map for each file
+    - parameters: those of Pipeline.input_parameters_of_run, over the "defaults" of the config
+    - export_formats and charts: the exports of the results and whether the charts are rendered to HTML
+    Raises ValueError with every problem of the config, so a batch of hours doesn't fail on its last experiment.
+    """
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file) or {}  # JSON is valid YAML
+    config_folder = os.path.dirname(os.path.abspath(config_path))
+    defaults = config.get("defaults") or {}
+    experiments, errors = [], []
+    for number, experiment in enumerate(config.get("experiments") or [], start=1):
+        try:
+            experiments.append(_resolve_experiment(experiment, defaults, config_folder))
+        except (KeyError, TypeError, ValueError) as error:
+            errors.append(f"experiment {experiment.get('name', number) if isinstance(experiment, dict) else number}:"
+                          f" {error}")
+    names = [experiment["name"] for experiment in experiments]
+    errors.extend(f"experiment {name}: the name is repeated" for name in sorted(set(names))
+                  if names.count(name) > 1)
+    if not experiments and not errors:
+        errors.append("there are no experiments")
+    if errors:
+        raise ValueError(f"Invalid batch config {config_path}:\n" + "\n".join(errors))
+    output_folder = config.get("output_folder")
+    return {"output_folder": os.path.join(config_folder, output_folder) if output_folder else None,
+            "experiments": experiments}
+
+
+def run_batch(experiments: List[dict], output_folder: str, workers: int = None, force: bool = False,
+              progress_callback=None) -> List[dict]:
+    """
+    Runs the experiments in parallel, each on a process of a pool of workers (all the CPUs by default), writing
+    the outputs of each one to its folder of output_folder. Experiments finished by a previous batch with the same
+    files and parameters are skipped unless force is set, so an interrupted batch resumes where it stopped.
+    An experiment that fails doesn't stop the others. Returns the summary of each experiment, in order, and calls
+    progress_callback with each summary as soon as its experiment ends.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    summaries = {}
+    pending = []
+    for experiment in experiments:
+        finished_run = None if force else read_finished_run(experiment, output_folder)
+        if finished_run is not None:
+            summaries[experiment["name"]] = dict(finished_run, status="skipped")
+            if progress_callback:
+                progress_callback(summaries[experiment["name"]])
+        else:
+            pending.append(experiment)
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(pending))) as executor:
+            futures = {executor.submit(run_experiment, experiment, output_folder): experiment["name"]
+                       for experiment in pending}
+            for future in as_completed(futures):
+                summaries[futures[future]] = future.result()
+                if progress_callback:
+                    progress_callback(summaries[futures[future]])
+    return [summaries[experiment["name"]] for experiment in experiments]
+
+
+def run_experiment(experiment: dict, output_folder: str) -> dict:
+    """
+    Runs the pipeline for an experiment, without the web app or the cloud storage, and writes to its folder the
+    results tables and the exports of the results, the statistics, the charts and BATCH_RUN_FILE.
+    Returns the summary of the run, with status "finished" or "failed" (and the error).
+    """
+    experiment_folder = os.path.join(output_folder, experiment["name"])
+    started_at = time.time()
+    summary = {"name": experiment["name"], "fingerprint": experiment_fingerprint(experiment)}
+    try:
+        os.remove(os.path.join(experiment_folder, BATCH_RUN_FILE))  # a failed run must not look finished
+    except FileNotFoundError:
+        pass
+    try:
+        upload_folder, exports_folder, charts_folder = (os.path.join(experiment_folder, name)
+                                                        for name in ("uploads", "exports", "charts"))
+        for folder in (upload_folder, exports_folder):
+            os.makedirs(folder, exist_ok=True)
+        # The pipeline removes the files of its upload folder that are not its inputs, so the reader files are
+        # linked into a folder of the experiment instead of reading them from the folders of the archive
+        file_names = _link_reader_files(experiment["files"], upload_folder)
+        pipeline = Pipeline(file_names, upload_folder=upload_folder, exports_folder=exports_folder)
+        pipeline.preprocessing_of_data(ParsedFilesCache(os.path.join(output_folder, BATCH_PARSED_FILES_FOLDER)))
+        pipeline.input_genotypes_data(experiment["genotypes"])
+        parameters = experiment["parameters"]
+        pipeline.input_parameters_of_run(str(parameters["max_time_between_signals"]),
+                                         parameters["round_or_truncate"], parameters["pollinators_to_remove"],
+                                         parameters["filter_tags_by_visited_genotypes"],
+                                         parameters["visited_genotypes_required"],
+                                         parameters["filter_start_datetime"], parameters["filter_end_datetime"],
+                                         parameters["visited_genotypes_mode"], parameters["min_visited_genotypes"],
+                                         parameters["ttest_method"], parameters["ttest_correction"])
+        pipeline.run_pipeline()
+        exports = {}
+        for export_format in experiment["export_formats"]:
+            file_name, _ = EXPORT_FORMATS[export_format]
+            exports[export_format] = os.path.join(experiment_folder, f"{experiment['name']}_{file_name}")
+            # The exports folder is emptied by every run, the exports are kept next to the statistics
+            shutil.move(pipeline.export_results(export_format), exports[export_format])
+        if experiment["charts"] and pipeline.statistics["visits_count"]:
+            os.makedirs(charts_folder, exist_ok=True)
+            Plot(pipeline.genotypes_dfs, charts_folder, pipeline.visits_timeline, None,
+                 pipeline.genotypes_t_tests).lay_out_plots_to_html()
+        _write_json(os.path.join(experiment_folder, "statistics.json"), pipeline.statistics)
+        summary.update(status="finished", visits=pipeline.statistics["visits_count"], genotypes=pipeline.genotypes_names,
+                       exports=exports, seconds=round(time.time() - started_at, 3),
+                       metrics=pipeline.ingestion_metrics + pipeline.run_metrics)
+        _write_json(os.path.join(experiment_folder, BATCH_RUN_FILE), summary)  # last, once everything is written
+    except Exception as error:  # reported in the summary, the rest of the batch goes on
+        summary.update(status="failed", error=f"{type(error).__name__}: {error}", traceback=traceback.format_exc(),
+                       seconds=round(time.time() - started_at, 3))
+    return summary
+
+
+def read_finished_run(experiment: dict, output_folder: str) -> dict:
+    """ Returns the summary of the finished run of the experiment, or None if it must run (again) """
+    try:
+        with open(os.path.join(output_folder, experiment["name"], BATCH_RUN_FILE)) as run_file:
+            finished_run = json.load(run_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return finished_run if finished_run.get("fingerprint") == experiment_fingerprint(experiment) else None
+
+
+def experiment_fingerprint(experiment: dict) -> str:
+    """
+    Hash of the inputs of an experiment: its parameters, genotypes and outputs, and the path, size and modification
+    time of its files (hashing the contents of a whole archive again on each batch would take too long)
+    """
+    files = []
+    for file_path in experiment["files"]:
+        status = os.stat(file_path)
+        files.append([file_path, status.st_size, status.st_mtime_ns])
+    inputs = {"files": files, "genotypes": [sorted(genotypes.items()) for genotypes in experiment["genotypes"]],
+              **{key: experiment[key] for key in ("parameters", "export_formats", "charts")}}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _resolve_experiment(experiment: dict, defaults: dict, config_folder: str) -> dict:
+    """ Validates an experiment of the config and returns it with its files and parameters resolved """
+    name = str(experiment["name"])
+    if not EXPERIMENT_NAME_PATTERN.match(name):
+        raise ValueError(f"the name {name} can only have letters, digits, dots, hyphens and underscores")
+    files = []
+    for pattern in experiment["files"]:
+        path = os.path.join(config_folder, os.path.expanduser(str(pattern)))
+        matches = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+        missing = [match for match in matches if not os.path.isfile(match)]
+        if missing or not matches:
+            raise ValueError(f"file not found: {', '.join(missing) or pattern}")
+        files.extend(os.path.abspath(match) for match in matches)
+    if len(files) != len(set(files)):
+        raise ValueError("a file is repeated")
+    genotypes = experiment["genotypes"]
+    genotypes = [genotypes] * len(files) if isinstance(genotypes, dict) else list(genotypes)
+    if len(genotypes) != len(files):
+        raise ValueError(f"there are {len(genotypes)} genotype maps for {len(files)} files")
+    genotypes = [{int(antenna): str(genotype) for antenna, genotype in file_genotypes.items()}
+                 for file_genotypes in genotypes]
+    parameters = {**BATCH_DEFAULT_PARAMETERS, **defaults.get("parameters", {}), **experiment.get("parameters", {})}
+    unknown_parameters = sorted(set(parameters) - set(BATCH_DEFAULT_PARAMETERS))
+    if unknown_parameters:
+        raise ValueError(f"unknown parameters: {', '.join(unknown_parameters)}")
+    # The pipeline takes the parameters as the web form sends them
+    parameters["filter_tags_by_visited_genotypes"] = str(str(parameters["filter_tags_by_visited_genotypes"]).lower()
+                                                         in ("true", "yes", "1"))
+    for key in ("filter_start_datetime", "filter_end_datetime"):  # YAML reads unquoted dates as datetimes
+        parameters[key] = str(parameters[key] or "")
+    export_formats = experiment.get("export_formats", defaults.get("export_formats", BATCH_DEFAULT_EXPORT_FORMATS))
+    unknown_formats = sorted(set(export_formats) - set(EXPORT_FORMATS))
+    if unknown_formats:
+        raise ValueError(f"unknown export formats: {', '.join(unknown_formats)}")
+    return {"name": name, "files": files, "genotypes": genotypes, "parameters": parameters,
+            "export_formats": list(export_formats), "charts": bool(experiment.get("charts", defaults.get("charts",
+                                                                                                        True)))}
+
+
+def _link_reader_files(file_paths: List[str], upload_folder: str) -> List[str]:
+    """
+    Links (or copies, where links are not supported) the reader files into the upload folder, and returns their
+    names there. Files of different folders of the archive can have the same name, so names are made unique.
+    """
+    file_names = []
+    for file_path in file_paths:
+        file_name = os.path.basename(file_path)
+        if file_name in file_names:
+            file_name = f"{len(file_names) + 1}_{file_name}"
+        link_path = os.path.join(upload_folder, file_name)
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        try:
+            os.symlink(file_path, link_path)
+        except OSError:
+            shutil.copyfile(file_path, link_path)
+        file_names.append(file_name)
+    return file_names
+
+
+def _write_json(path: str, value: dict):
+    """ Writes a JSON file atomically, so an interrupted batch never leaves half of one """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as json_file:
+        json.dump(value, json_file, indent=2, default=_json_default)
+    os.replace(temporary_path, path)
+
+
+def _json_default(value):
+    """ NumPy scalars and arrays of the statistics as JSON values, anything else as a string """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return str(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the pipeline for a batch of experiments described in a YAML "
+                                                 "or JSON config, in parallel and without the web app")
+    parser.add_argument("config", help="YAML or JSON file with the experiments")
+    parser.add_argument("--output", help="folder of the outputs of the experiments (default: output_folder of the "
+                                         "config)")
+    parser.add_argument("--workers", type=int, default=None, help="experiments run at once (default: all the CPUs)")
+    parser.add_argument("--force", action="store_true", help="run again the experiments already finished")
+    arguments = parser.parse_args()
+
+    batch_config = load_batch_config(arguments.config)
+    batch_output_folder = arguments.output or batch_config["output_folder"]
+    if not batch_output_folder:
+        parser.error("the config has no output_folder, use --output")
+
+    def print_summary(experiment_summary: dict):
+        details = experiment_summary.get("error") or f"{experiment_summary.get('visits')} visits"
+        print(f"{experiment_summary['status']:>8} {experiment_summary['name']:<40} "
+              f"{experiment_summary.get('seconds', 0):>9.1f} s  {details}", flush=True)
+
+    batch_summaries = run_batch(batch_config["experiments"], batch_output_folder, arguments.workers, arguments.force,
+                                print_summary)
+    failed_experiments = [summary for summary in batch_summaries if summary["status"] == "failed"]
+    print(f"{len(batch_summaries) - len(failed_experiments)} of {len(batch_summaries)} experiments finished, "
+          f"outputs in {batch_output_folder}")
+    sys.exit(1 if failed_experiments else 0)
@@ -0,0 +1,240 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from instrumentation import max_rss_bytes
+from parsed_files_cache import ParsedFilesCache
+from results_tables import EXPORT_FORMATS
+from rfid_pollinators_pipeline import CHART_GROUPS_FILES, Pipeline, Plot
+from synthetic_reads import generate_reader_exports, write_reader_exports
+
+BENCHMARK_SCALES = [10000, 100000, 1000000, 10000000]
+BENCHMARK_EXCEL_MAX_READS = 100000  # bigger exports are benchmarked as text logs, workbooks take too long to write
+BENCHMARK_PARAMETERS = ["7", "round", [], "False", [], "", ""]
+BENCHMARK_RESULTS_FOLDER = "benchmark_results"
+BENCHMARK_COLUMNS = ["reads", "file_format", "group", "step", "rows", "seconds", "cpu_seconds", "peak_memory_mb",
+                     "max_rss_mb"]
+REGRESSION_TOLERANCE = 1.25
+REGRESSION_MIN_SECONDS = 0.1  # shorter steps are too noisy to be compared
+BENCHMARK_SWEEP_MAX_TIMES = [3, 5, 7, 10, 15]
+# Charts of the visits of a run, the chart of the sweep is benchmarked through sweep_plot_to_json
+PLOT_METHODS = sorted(name for name in vars(Plot)
+                      if name.startswith("_plot_") and name != "_plot_max_time_between_signals_sweep")
+
+
+class StepProfiler:
+    """
+    Measures the steps of a benchmark: wall and CPU time, peak memory allocated during the step (traced with
+    tracemalloc, which NumPy and pandas buffers report to) and the peak resident memory of the process so far.
+    Stages of the pipeline are measured through its progress callback, report_stage.
+    """
+
+    def __init__(self, reads: int, file_format: str, profile_memory: bool = True):
+        self.reads = reads
+        self.file_format = file_format
+        self.profile_memory = profile_memory
+        self.results = []
+        self._started = {}
+
+    @contextmanager
+    def measure(self, group: str, step: str):
+        """ Measures the block of code as a step, the rows it produced can be set in the yielded dict """
+        measurement = {"rows": None}
+        self._start(step)
+        yield measurement
+        self._finish(group, step, measurement["rows"])
+
+    def report_stage(self, stage_name: str, event: str):
+        """ Progress callback of the pipeline, measures each stage that runs """
+        if event == "started":
+            self._start(stage_name)
+        elif event == "finished":
+            self._finish("pipeline", stage_name)
+
+    def _start(self, step: str):
+        if self.profile_memory:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        else:
+            memory = None
+        self._started[step] = (time.perf_counter(), time.process_time(), memory)
+
+    def _finish(self, group: str, step: str, rows: int = None):
+        wall_start, cpu_start, memory_start = self._started.pop(step)
+        seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        peak_memory = tracemalloc.get_traced_memory()[1] - memory_start if self.profile_memory else None
+        self.results.append({"reads": self.reads, "file_format": self.file_format, "group": group, "step": step,
+                             "rows": rows, "seconds": round(seconds, 4), "cpu_seconds": round(cpu_seconds, 4),
+                             "peak_memory_mb": None if peak_memory is None else round(peak_memory / 2 ** 20, 2),
+                             "max_rss_mb": round(max_rss_bytes() / 2 ** 20, 2)})
+
+
+def benchmark_scale(reads: int, folder: str, file_format: str = None, profile_memory: bool = True,
+                    seed: int = 0) -> List[dict]:
+    """
+    Runs the whole pipeline on synthetic reader exports of a number of reads, written to folder, measuring every
+    stage of the pipeline, every export of the results, the sweep of max times between signals and every chart of
+    Plot. Returns a row for each step.
+    Exports are Excel workbooks up to BENCHMARK_EXCEL_MAX_READS reads, and CSV text logs above, where the results
+    aren't exported to Excel either (openpyxl writes a few thousand rows per second).
+    """
+    file_format = file_format or ("xlsx" if reads <= BENCHMARK_EXCEL_MAX_READS else "csv")
+    profiler = StepProfiler(reads, file_format, profile_memory)
+    upload_folder, exports_folder, plots_folder = (os.path.join(folder, name)
+                                                   for name in ("uploads", "exports", "plots"))
+    for path in (upload_folder, exports_folder, plots_folder):
+        os.makedirs(path, exist_ok=True)
+    if profile_memory:
+        tracemalloc.start()
+    try:
+        with profiler.measure("data", "generation") as measurement:
+            exports, genotypes_of_each_experiment = generate_reader_exports(reads, experiments=2, seed=seed)
+            measurement["rows"] = reads
+        with profiler.measure("data", f"write_{file_format}"):
+            file_names = write_reader_exports(exports, upload_folder, file_format)
+        del exports
+
+        pipeline = Pipeline(file_names, upload_folder=upload_folder, exports_folder=exports_folder)
+        parsed_files_cache = ParsedFilesCache(os.path.join(folder, "parsed_files"))  # empty, the files are parsed
+        with profiler.measure("pipeline", "ingestion") as measurement:
+            pipeline.preprocessing_of_data(parsed_files_cache)
+            measurement["rows"] = sum(len(dataframe) for dataframe in pipeline.parsed_dataframes.values())
+        with profiler.measure("pipeline", "ingestion_cached") as measurement:
+            pipeline.preprocessing_of_data(parsed_files_cache)
+            measurement["rows"] = sum(len(dataframe) for dataframe in pipeline.parsed_dataframes.values())
+        pipeline.input_genotypes_data(genotypes_of_each_experiment)
+        pipeline.input_parameters_of_run(*BENCHMARK_PARAMETERS)
+        pipeline.run_pipeline(progress_callback=profiler.report_stage)
+        for export_format in EXPORT_FORMATS:
+            if export_format == "xlsx" and reads > BENCHMARK_EXCEL_MAX_READS:
+                continue
+            with profiler.measure("export", export_format):
+                pipeline.export_results(export_format)
+        with profiler.measure("pipeline", "sweep_max_time_between_signals") as measurement:
+            sweep_table = pipeline.sweep_max_time_between_signals(BENCHMARK_SWEEP_MAX_TIMES)
+            measurement["rows"] = int(sweep_table.loc[sweep_table["Genotype"] == "All genotypes",
+                                                      "Visits Count"].sum())
+
+        visits = pipeline.statistics["visits_count"]
+        with profiler.measure("plot", "__init__") as measurement:
+            plots = Plot(pipeline.genotypes_dfs, plots_folder, pipeline.visits_timeline, None,
+                         pipeline.genotypes_t_tests)
+            measurement["rows"] = visits
+        for method in PLOT_METHODS:
+            with profiler.measure("plot", method):
+                getattr(plots, method)()
+        for group in CHART_GROUPS_FILES:
+            with profiler.measure("plot", f"chart_group_to_json[{group}]"):
+                plots.chart_group_to_json(group)
+        with profiler.measure("plot", "lay_out_plots_to_html"):
+            plots.lay_out_plots_to_html()
+        with profiler.measure("plot", "sweep_plot_to_json"):
+            Plot.sweep_plot_to_json(sweep_table)
+    finally:
+        if profile_memory:
+            tracemalloc.stop()
+    for result in profiler.results:  # rows of the stages, known once the pipeline has run
+        if result["rows"] is None and result["group"] == "pipeline":
+            result["rows"] = {"join": len(pipeline.df_with_genotypes), "selection": len(pipeline.df),
+                              "sorting": len(pipeline.sorted_reads)}.get(result["step"], visits)
+    return profiler.results
+
+
+def find_regressions(results: List[dict], baseline: List[dict], tolerance: float = REGRESSION_TOLERANCE,
+                     min_seconds: float = REGRESSION_MIN_SECONDS) -> List[dict]:
+    """
+    Returns the steps that took more than tolerance times their time in the baseline (a previous benchmark of the
+    same scale and file format, with memory profiling or without it as the results), ignoring the steps that took
+    less than min_seconds in both
+    """
+    def step_key(result: dict) -> tuple:
+        return (result["reads"], result["file_format"], result["group"], result["step"],
+                result["peak_memory_mb"] is None)
+
+    baseline_seconds = {step_key(result): result["seconds"] for result in baseline}
+    regressions = []
+    for result in results:
+        previous_seconds = baseline_seconds.get(step_key(result))
+        if previous_seconds is None or max(result["seconds"], previous_seconds) < min_seconds:
+            continue
+        if result["seconds"] > previous_seconds * tolerance:
+            regressions.append(dict(result, baseline_seconds=previous_seconds,
+                                    ratio=round(result["seconds"] / max(previous_seconds, 1e-9), 2)))
+    return regressions
+
+
+def write_benchmark_results(results: List[dict], folder: str) -> Dict[str, str]:
+    """
+    Writes the results as JSON, with the environment where they were measured, and as CSV, with a row per step.
+    Returns the paths of both files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    name = time.strftime("benchmark_%Y%m%d_%H%M%S")
+    paths = {"json": os.path.join(folder, f"{name}.json"), "csv": os.path.join(folder, f"{name}.csv")}
+    environment = {"python": platform.python_version(), "platform": platform.platform(),
+                   "cpu_count": os.cpu_count(), "numpy": np.__version__, "pandas": pd.__version__,
+                   "pyarrow": pa.__version__}
+    with open(paths["json"], "w") as file_handler:
+        json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment,
+                   "results": results}, file_handler, indent=2)
+    with open(paths["csv"], "w", newline="") as file_handler:
+        writer = csv.DictWriter(file_handler, fieldnames=BENCHMARK_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    return paths
+
+
+def _parse_scale(scale: str) -> int:
+    """ Number of reads of a scale, which can be abbreviated as 10k or 10M """
+    multipliers = {"k": 1000, "m": 1000000}
+    scale = scale.strip().lower()
+    return int(float(scale[:-1]) * multipliers[scale[-1]]) if scale[-1] in multipliers else int(scale)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times and memory-profiles every stage of the pipeline and every "
+                                                 "chart with synthetic reader exports of several sizes")
+    parser.add_argument("--scales", default=",".join(str(scale) for scale in BENCHMARK_SCALES),
+                        help="reads of each benchmark, separated by commas (10k, 1M...)")
+    parser.add_argument("--file-format", choices=["xlsx", "csv"], default=None,
+                        help=f"format of the reader exports (default: xlsx up to {BENCHMARK_EXCEL_MAX_READS} reads)")
+    parser.add_argument("--output", default=BENCHMARK_RESULTS_FOLDER, help="folder of the results files")
+    parser.add_argument("--baseline", help="JSON results of a previous benchmark, to fail on slower steps")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="times slower than the baseline a step must be to be a regression")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="don't trace memory, which slows down the steps that allocate many Python objects")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    benchmark_results = []
+    for scale_reads in (_parse_scale(scale) for scale in arguments.scales.split(",")):
+        with tempfile.TemporaryDirectory() as scale_folder:
+            scale_results = benchmark_scale(scale_reads, scale_folder, arguments.file_format,
+                                            not arguments.no_memory, arguments.seed)
+        benchmark_results.extend(scale_results)
+        for step_result in scale_results:
+            print(f"{step_result['reads']:>10} {step_result['group']:>8} {step_result['step']:<45} "
+                  f"{step_result['seconds']:>9.3f} s {step_result['peak_memory_mb'] or 0:>9.1f} MB")
+    results_paths = write_benchmark_results(benchmark_results, arguments.output)
+    print(f"Results written to {results_paths['json']} and {results_paths['csv']}")
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            slower_steps = find_regressions(benchmark_results, json.load(baseline_file)["results"],
+                                            arguments.tolerance)
+        for slower_step in slower_steps:
+            print(f"Regression: {slower_step['group']} {slower_step['step']} with {slower_step['reads']} reads took "
+                  f"{slower_step['seconds']} s instead of {slower_step['baseline_seconds']} s")
+        sys.exit(1 if slower_steps else 0)
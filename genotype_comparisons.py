@@ -0,0 +1,98 @@
+import itertools
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+from visit_statistics import DurationsSummary
+
+TTEST_METHODS = ["student", "welch"]
+TTEST_CORRECTIONS = ["none", "bonferroni", "holm", "fdr_bh"]
+
+
+def summaries_statistics(summaries: Dict[str, DurationsSummary]) -> pd.DataFrame:
+    """
+    Returns the count, mean and variance (with 1 degree of freedom) of the durations of each genotype from its
+    DurationsSummary, so the tests of the visits of a run don't go through the visits again. The summaries can be
+    merged, and the variance is computed as scipy.stats.ttest_ind does, so the tests give the same results.
+    """
+    statistics = [(summary.count, summary.mean, summary.m2 / (summary.count - 1) if summary.count > 1 else np.nan)
+                  for summary in summaries.values()]
+    return pd.DataFrame(statistics, index=list(summaries), columns=["n", "mean", "variance"])
+
+
+def pairwise_t_tests(statistics: pd.DataFrame, method: str = "student",
+                     correction: str = "none") -> Dict[str, pd.DataFrame]:
+    """
+    Computes the t-test of the difference between the means of every pair of genotypes from their sufficient
+    statistics, as genotype × genotype matrices: "t" (the statistic of the row genotype against the column one)
+    and "p" (two-sided p-value, adjusted for multiple comparisons with the chosen correction).
+    method is "student" (equal variances, as scipy.stats.ttest_ind) or "welch" (unequal variances).
+    The diagonal and the pairs that can't be tested (not enough visits) are NaN.
+    """
+    if method not in TTEST_METHODS:
+        raise ValueError(f"Unknown t-test method {method}, it must be one of {TTEST_METHODS}")
+    counts, means, variances = (statistics[column].values.astype(np.float64)[:, np.newaxis]
+                                for column in ("n", "mean", "variance"))
+    n1, n2, v1, v2 = counts, counts.T, variances, variances.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if method == "student":
+            # A single visit has no variance, but then its squared deviations are 0 for the pooled variance
+            v1, v2 = np.where(n1 == 1, 0, v1), np.where(n2 == 1, 0, v2)
+            degrees_of_freedom = n1 + n2 - 2.0
+            pooled_variance = ((n1 - 1) * v1 + (n2 - 1) * v2) / degrees_of_freedom
+            standard_error = np.sqrt(pooled_variance * (1.0 / n1 + 1.0 / n2))
+        else:
+            vn1, vn2 = v1 / n1, v2 / n2
+            degrees_of_freedom = (vn1 + vn2) ** 2 / (vn1 ** 2 / (n1 - 1) + vn2 ** 2 / (n2 - 1))
+            degrees_of_freedom = np.where(np.isnan(degrees_of_freedom), 1, degrees_of_freedom)  # both variances 0
+            standard_error = np.sqrt(vn1 + vn2)
+        t = np.divide(means - means.T, standard_error)
+        t[(n1 == 0) | (n2 == 0)] = np.nan
+        np.fill_diagonal(t, np.nan)
+        p = special.stdtr(degrees_of_freedom, -np.abs(t)) * 2
+    genotypes = statistics.index
+    return {"t": pd.DataFrame(t, index=genotypes, columns=genotypes),
+            "p": pd.DataFrame(_correct_p_values(p, correction), index=genotypes, columns=genotypes)}
+
+
+def t_tests_to_dict(t_tests: Dict[str, pd.DataFrame]) -> Dict[str, List[float]]:
+    """
+    Returns the tests of each pair of genotypes as {"<genotype> and <genotype 2>": [t, p]}, rounded to 3 decimals,
+    in the order of the genotypes and without the pairs that couldn't be tested
+    """
+    t_tests_dict = {}
+    for genotype, genotype2 in itertools.combinations(t_tests["t"].index, 2):
+        t, p = t_tests["t"].at[genotype, genotype2], t_tests["p"].at[genotype, genotype2]
+        if not np.isnan(t):
+            t_tests_dict[f"{genotype} and {genotype2}"] = [round(float(t), 3), round(float(p), 3)]
+    return t_tests_dict
+
+
+def _correct_p_values(p: np.ndarray, correction: str) -> np.ndarray:
+    """ Adjusts the p-values of a symmetric matrix for the multiple comparisons of all the pairs it includes """
+    if correction not in TTEST_CORRECTIONS:
+        raise ValueError(f"Unknown correction {correction}, it must be one of {TTEST_CORRECTIONS}")
+    if correction == "none":
+        return p
+    pairs = np.triu_indices_from(p, k=1)
+    pair_p_values = p[pairs]
+    tested = ~np.isnan(pair_p_values)
+    tests_count = tested.sum()
+    ranked = pair_p_values[tested]
+    order = np.argsort(ranked, kind='stable')
+    if correction == "bonferroni":
+        adjusted = ranked * tests_count
+    elif correction == "holm":
+        adjusted = np.empty_like(ranked)
+        adjusted[order] = np.maximum.accumulate(ranked[order] * (tests_count - np.arange(tests_count)))
+    else:  # Benjamini-Hochberg false discovery rate
+        adjusted = np.empty_like(ranked)
+        steps = ranked[order] * tests_count / np.arange(1, tests_count + 1)
+        adjusted[order] = np.minimum.accumulate(steps[::-1])[::-1]
+    pair_p_values[tested] = np.minimum(adjusted, 1)
+    corrected = np.full_like(p, np.nan)
+    corrected[pairs] = pair_p_values
+    corrected.T[pairs] = pair_p_values
+    return corrected
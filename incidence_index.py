@@ -0,0 +1,46 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+VISITED_GENOTYPES_MODES = ["all", "any", "at_least"]
+
+
+def build_incidence_index(genotypes_dfs: Dict[str, pd.DataFrame], tag_column: str = 'DEC Tag ID') -> pd.DataFrame:
+    """
+    Counts the rows (reads or visits) of each tag on each genotype, with a single pass over all the dataframes.
+    Returns a tag × genotype matrix of counts: a row for each tag and a column for each genotype, in order of
+    appearance. A tag visited a genotype when its count is more than 0, so the same index answers any question about
+    the genotypes visited by each pollinator, or the pollinators of each genotype. Rows without a tag are not counted.
+    """
+    genotypes = list(genotypes_dfs)
+    if not genotypes:
+        return pd.DataFrame(dtype=np.int64)
+    tag_ids = pd.concat([dataframe[tag_column] for dataframe in genotypes_dfs.values()], ignore_index=True)
+    tag_codes, tags = pd.factorize(tag_ids)
+    genotype_codes = np.repeat(np.arange(len(genotypes)), [len(dataframe) for dataframe in genotypes_dfs.values()])
+    with_tag = tag_codes >= 0  # factorize codes the missing tags as -1
+    counts = np.bincount(tag_codes[with_tag] * len(genotypes) + genotype_codes[with_tag],
+                         minlength=len(tags) * len(genotypes)).reshape(len(tags), len(genotypes))
+    return pd.DataFrame(counts, index=pd.Index(np.asarray(tags), name=tag_column), columns=genotypes)
+
+
+def select_visitors(incidence_index: pd.DataFrame, genotypes_required: List[str], mode: str = "all",
+                    min_genotypes: int = 1) -> set:
+    """
+    Returns the tags that visited all, any, or at least min_genotypes of the required genotypes ("all", "any" or
+    "at_least" mode), with a vectorized reduction of the rows of the incidence index.
+    """
+    unknown_genotypes = [genotype for genotype in genotypes_required if genotype not in incidence_index.columns]
+    if unknown_genotypes:
+        raise ValueError(f"Unknown genotypes in the visited genotypes filter: {', '.join(unknown_genotypes)}")
+    visited = incidence_index[genotypes_required].values > 0
+    if mode == "all":
+        selected = visited.all(axis=1)
+    elif mode == "any":
+        selected = visited.any(axis=1)
+    elif mode == "at_least":
+        selected = visited.sum(axis=1) >= min_genotypes
+    else:
+        raise ValueError(f"Unknown visited genotypes mode {mode}, it must be one of {VISITED_GENOTYPES_MODES}")
+    return set(incidence_index.index[selected])
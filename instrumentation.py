@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List
+
+METRICS_LOGGER = logging.getLogger("pollinators.metrics")
+RECENT_MEASUREMENTS = 200
+INSTRUMENTATION_ENABLED = os.environ.get("PIPELINE_INSTRUMENTATION", "on").lower() not in ("off", "false", "0")
+
+
+class Metrics:
+    """
+    Measurements of the steps of the pipeline, the charts and the storage of the states: wall time, CPU time of the
+    thread that ran the step, peak resident memory of the process (and how much the step raised it) and the rows or
+    bytes it processed. Each measurement is logged as a JSON line on the "pollinators.metrics" logger, and added up
+    by step, so the slow steps of the server can be seen without a profiler.
+    The CPU time is only that of the thread: the reader files parsed by the pool of processes of the ingestion are
+    not included, and neither is their memory, so for those steps the wall time is the one to look at.
+    A measurement costs a few system calls, and nothing at all when the metrics are disabled.
+    """
+
+    def __init__(self, enabled: bool = INSTRUMENTATION_ENABLED, recent_measurements: int = RECENT_MEASUREMENTS):
+        self.enabled = enabled
+        self._steps = {}
+        self._recent = deque(maxlen=recent_measurements)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, step: str, sink: List[dict] = None):
+        """
+        Measures the block of code as a step. The block can add the rows (or bytes) it processed, or any other
+        value, to the yielded dict. If given, the measurement is also appended to sink (the metrics of a run).
+        """
+        measurement = {}
+        if not self.enabled:
+            yield measurement
+            return
+        max_rss_before = max_rss_bytes()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        failed = True
+        try:
+            yield measurement
+            failed = False
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            max_rss = max_rss_bytes()
+            measurement = {"step": step, "seconds": round(seconds, 4), "cpu_seconds": round(cpu_seconds, 4),
+                           "max_rss_mb": round(max_rss / 2 ** 20, 1),
+                           "rss_growth_mb": round((max_rss - max_rss_before) / 2 ** 20, 1),
+                           **measurement, "failed": failed, "finished_at": round(time.time(), 3)}
+            self._add(measurement)
+            if sink is not None:
+                sink.append(measurement)
+            if METRICS_LOGGER.isEnabledFor(logging.INFO):
+                METRICS_LOGGER.info(json.dumps(measurement, default=str))
+
+    def to_dict(self) -> dict:
+        """ Returns the totals of each step and the latest measurements as a JSON serializable dict """
+        with self._lock:
+            return {"enabled": self.enabled,
+                    "steps": {step: dict(totals, mean_seconds=round(totals["seconds"] / totals["count"], 4))
+                              for step, totals in self._steps.items()},
+                    "recent": list(self._recent)}
+
+    def reset(self):
+        with self._lock:
+            self._steps.clear()
+            self._recent.clear()
+
+    def _add(self, measurement: dict):
+        with self._lock:
+            self._recent.append(measurement)
+            totals = self._steps.setdefault(measurement["step"], {"count": 0, "failed": 0, "seconds": 0.0,
+                                                                  "cpu_seconds": 0.0, "max_seconds": 0.0})
+            totals["count"] += 1
+            totals["failed"] += measurement["failed"]
+            totals["seconds"] = round(totals["seconds"] + measurement["seconds"], 4)
+            totals["cpu_seconds"] = round(totals["cpu_seconds"] + measurement["cpu_seconds"], 4)
+            totals["max_seconds"] = max(totals["max_seconds"], measurement["seconds"])
+
+
+METRICS = Metrics()
+
+
+def measure(step: str, sink: List[dict] = None):
+    """ Measures a step with the metrics of the process, see Metrics.measure """
+    return METRICS.measure(step, sink)
+
+
+def max_rss_bytes() -> int:
+    """ Peak resident memory of the process, which getrusage reports in kilobytes (bytes on macOS) """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from reader_files import detect_reader_file_format, parse_scan_timestamps, read_reader_file, read_text_log_from
+from rfid_pollinators_pipeline import Pipeline
+from visit_segmentation import continue_visits
+from visit_statistics import DurationsSummary
+
+LIVE_POLL_INTERVAL_SECONDS = 2.0
+LIVE_RECENT_VISITS = 50
+
+
+class LiveIngestion:
+    """
+    Follows a folder where the readers export their logs while an experiment is running.
+    Every poll, the new files and the rows appended to the known ones are read (text logs from the byte offset
+    where the previous poll stopped, so the history is never read again) and segmented into visits, continuing the
+    visits left open by the previous polls. The visits update running aggregates of each genotype in memory.
+    Excel workbooks can't be read from an offset, so they are read again when they change, keeping only their new rows.
+    """
+
+    def __init__(self, folder: str, genotypes: Dict[int, str], max_time_between_signals: int,
+                 round_or_truncate: str = "round", pollinators_to_remove: List[str] = None,
+                 poll_interval_seconds: float = LIVE_POLL_INTERVAL_SECONDS):
+        self.folder = folder
+        self.genotypes = {int(antenna): genotype for antenna, genotype in genotypes.items()}
+        self.max_time_between_signals = int(max_time_between_signals)
+        self.round_or_truncate = round_or_truncate
+        self.pollinators_to_remove = [tag for tag in pollinators_to_remove or [] if tag]
+        self.poll_interval_seconds = poll_interval_seconds
+        self.files = {}  # position reached in each file: byte offset of text logs, rows of workbooks
+        self.errors = {}  # files that couldn't be read in the last poll, retried in the next one
+        self.reads_count = 0
+        self.latest_read = None
+        self.last_poll_at = None
+        self.open_visits = pd.DataFrame({"Genotype": pd.Series(dtype=object), "DEC Tag ID": pd.Series(dtype=object),
+                                         "Timestamp": pd.Series(dtype=np.int64),
+                                         "Antenna ID": pd.Series(dtype=np.int64),
+                                         "Visit Duration": pd.Series(dtype=np.float64)})
+        self.summaries: Dict[str, DurationsSummary] = {genotype: DurationsSummary()
+                                                       for genotype in dict.fromkeys(self.genotypes.values())}
+        self.pollinators: Dict[str, set] = {genotype: set() for genotype in self.summaries}
+        self.recent_visits = deque(maxlen=LIVE_RECENT_VISITS)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_pipeline(cls, pipeline: Pipeline, folder: str, genotypes: Dict[int, str] = None,
+                      poll_interval_seconds: float = LIVE_POLL_INTERVAL_SECONDS) -> 'LiveIngestion':
+        """
+        Follows the logs of an experiment with the parameters of the last run of a pipeline, and the genotypes of its
+        last experiment unless others are given
+        """
+        return cls(folder, genotypes or pipeline.genotypes_of_each_experiment[-1], pipeline.max_time_between_signals,
+                   pipeline.round_or_truncate, pipeline.pollinators_to_remove, poll_interval_seconds)
+
+    def start(self):
+        """ Polls the folder in a background thread until stop is called """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._poll_until_stopped, daemon=True, name="live-ingestion")
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def poll(self) -> int:
+        """ Reads the new rows of the files of the folder and segments them. Returns the number of new reads """
+        with self._lock:
+            new_reads = []
+            for entry in sorted(os.scandir(self.folder), key=lambda entry: entry.name):
+                if entry.is_file() and not entry.name.startswith("."):
+                    try:  # the position reached in a file only moves once its new rows were parsed
+                        rows, state = self._read_new_rows(entry)
+                        reads = self._rows_to_reads(rows) if rows is not None and len(rows) else None
+                    except Exception as error:  # a workbook still being written, or rows that can't be parsed
+                        self.errors[entry.name] = str(error)
+                        continue
+                    if state is not None:
+                        self.files[entry.name] = state
+                    self.errors.pop(entry.name, None)
+                    if reads is not None and len(reads):
+                        new_reads.append(reads)
+            reads = pd.concat(new_reads, ignore_index=True) if new_reads else None
+            if reads is not None and len(reads):
+                self._segment(reads)
+            self.last_poll_at = time.time()
+            return 0 if reads is None else len(reads)
+
+    def to_dict(self) -> dict:
+        """ Returns the running aggregates of each genotype and the state of the ingestion, JSON serializable """
+        with self._lock:
+            open_visits = self.open_visits[self.open_visits["Visit Duration"] != 0]
+            open_counts = open_visits["Genotype"].value_counts()
+            genotypes = {}
+            for genotype, summary in self.summaries.items():
+                genotypes[genotype] = {"visits": summary.count,
+                                       "total_duration": _json_number(summary.mean * summary.count),
+                                       "mean_duration": _json_number(summary.mean),
+                                       "median_duration": _json_number(summary.median),
+                                       "std_duration": _json_number(summary.std),
+                                       "pollinators": len(self.pollinators[genotype]),
+                                       "open_visits": int(open_counts.get(genotype, 0))}
+            return {"folder": self.folder,
+                    "running": self._thread is not None and self._thread.is_alive(),
+                    "files": {name: state["position"] for name, state in self.files.items()},
+                    "errors": dict(self.errors),
+                    "reads": self.reads_count,
+                    "latest_read": _format_timestamp(self.latest_read),
+                    "last_poll_at": self.last_poll_at,
+                    "genotypes": genotypes,
+                    "recent_visits": list(self.recent_visits)}
+
+    def _poll_until_stopped(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+                self.errors.pop(self.folder, None)
+            except Exception as error:  # a missing folder or rows that can't be parsed, the thread keeps polling
+                self.errors[self.folder] = str(error)
+            self._stopped.wait(self.poll_interval_seconds)
+
+    def _read_new_rows(self, entry: os.DirEntry) -> Tuple[pd.DataFrame, dict]:
+        """
+        Returns the rows of a file not read by the previous polls (None if it didn't change), reading it from the
+        start again if it was replaced or truncated, and the position reached in the file after them
+        """
+        status = entry.stat()
+        state = self.files.get(entry.name)
+        if not status.st_size:  # just created, its format can't be detected yet
+            return None, state
+        if state is not None:
+            state = dict(state)
+        if state is None or state["inode"] != status.st_ino or state["size"] > status.st_size:
+            state = {"format": detect_reader_file_format(entry.path), "inode": status.st_ino, "size": 0,
+                     "modified": None, "position": 0}
+        rows = None
+        if state["format"] == "text":
+            rows, state["position"] = read_text_log_from(entry.path, state["position"])
+        elif state["modified"] != status.st_mtime_ns:
+            rows = read_reader_file(entry.path)
+            rows, state["position"] = rows.iloc[state["position"]:], len(rows)
+        state["size"], state["modified"] = status.st_size, status.st_mtime_ns
+        return rows, state
+
+    def _rows_to_reads(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """ Turns the rows of the reader into reads of the genotypes of the antennas, as in the pipeline """
+        rows = rows.dropna(subset=["Scan Date", "Scan Time", "Antenna ID", "DEC Tag ID"])
+        timestamps = pd.DataFrame({"Scan Timestamp": parse_scan_timestamps(rows["Scan Date"].values,
+                                                                           rows["Scan Time"].values)})
+        if self.round_or_truncate == "round":
+            Pipeline._round_milliseconds("Scan Timestamp", timestamps)
+        elif self.round_or_truncate == "truncate":
+            Pipeline._truncate_milliseconds("Scan Timestamp", timestamps)
+        reads = pd.DataFrame({"Genotype": rows["Antenna ID"].astype(np.int64).map(self.genotypes).values,
+                              "DEC Tag ID": rows["DEC Tag ID"].astype(str).values,
+                              "Timestamp": timestamps["Scan Timestamp"].values,
+                              "Antenna ID": rows["Antenna ID"].values.astype(np.int64)})
+        return reads[reads["Genotype"].notna().values & ~reads["DEC Tag ID"].isin(self.pollinators_to_remove).values]
+
+    def _segment(self, reads: pd.DataFrame):
+        """ Continues the open visits with the new reads, and adds the visits they close to the aggregates """
+        self.reads_count += len(reads)
+        latest_read = int(reads["Timestamp"].max())
+        self.latest_read = latest_read if self.latest_read is None else max(self.latest_read, latest_read)
+        closed_visits, self.open_visits = continue_visits(self.open_visits, reads, self.max_time_between_signals)
+        for genotype, visits in closed_visits.groupby("Genotype", sort=False):
+            self.summaries[genotype] = self.summaries[genotype].merge(DurationsSummary(visits["Visit Duration"].values))
+            self.pollinators[genotype].update(visits["DEC Tag ID"])
+        for visit in closed_visits.sort_values("Timestamp", kind="stable").itertuples(index=False):
+            self.recent_visits.appendleft({"genotype": visit.Genotype, "tag": visit[1],
+                                           "scan_date_and_time": _format_timestamp(visit.Timestamp),
+                                           "visit_duration": float(visit[4])})
+
+
+def _format_timestamp(timestamp) -> str:
+    """ Formats epoch milliseconds as the scan times of the results tables """
+    return None if timestamp is None else pd.Timestamp(int(timestamp), unit="ms").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _json_number(value: float) -> float:
+    """ NaN is not valid JSON, so statistics without visits are None """
+    return None if np.isnan(value) else round(float(value), 3)
@@ -1,15 +1,44 @@
+import hashlib
+import json
+import logging
 import os
+import re
+import threading
+import time
+from functools import lru_cache
 from shutil import copy
 from typing import List, Dict
 
-from flask import Flask, render_template, request, send_file
+import pandas as pd
+from bokeh.resources import CDN
+from flask import Flask, abort, g, jsonify, redirect, render_template, request, send_from_directory, url_for
 from werkzeug.utils import secure_filename
 
-from pipeline_utilities import download_and_deserialize_pipeline_from_gcs, is_pipeline_present, are_plots_files_present, \
-    serialize_and_upload_pipeline_to_gcs, delete_pipeline_file
-from rfid_pollinators_pipeline import Pipeline, Plot
+from pipeline_utilities import download_and_deserialize_pipeline_from_gcs, is_pipeline_present, \
+    serialize_and_upload_pipeline_to_gcs, delete_pipeline_file, delete_expired_pipeline_states, touch_pipeline_state
+from instrumentation import METRICS, METRICS_LOGGER
+from live_ingestion import LiveIngestion
+from pipeline_jobs import PIPELINE_JOBS_WORKERS, PipelineJob, PipelineJobs
+from results_tables import EXPORT_FORMATS, query_results_table, results_table_path
+from rfid_pollinators_pipeline import CHART_GROUPS_FILES, Pipeline, Plot, ReaderFilesError
+from visits_timeline import ALL_GENOTYPES, build_visits_timeline, select_timeline_range
+from workspaces import WORKSPACE_TTL_SECONDS, WORKSPACES_FOLDER, Workspace, collect_expired_workspaces
 
-UPLOAD_FOLDER = "/tmp/server_uploads"
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", os.cpu_count() or 1))
+PIPELINE_JOBS = PipelineJobs(int(os.environ.get("PIPELINE_JOBS_WORKERS", PIPELINE_JOBS_WORKERS)))
+LIVE_INGESTION_FOLDER = os.environ.get("LIVE_INGESTION_FOLDER")  # folder where the readers export their logs
+LIVE_INGESTIONS: Dict[str, LiveIngestion] = {}  # live ingestion of each workspace
+LIVE_INGESTIONS_MAX = int(os.environ.get("LIVE_INGESTIONS_MAX", 4))  # each one polls the folder in its own thread
+LIVE_INGESTIONS_LOCK = threading.Lock()
+WORKSPACE_COOKIE = "workspace_id"
+WORKSPACES_COLLECTION_INTERVAL_SECONDS = 10 * 60
+CHARTS_MAX_AGE_SECONDS = 7 * 24 * 60 * 60  # chart URLs include the fingerprint of the run, so they never change
+RUN_FINGERPRINT_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+CACHED_TIMELINES = 32
+SWEEP_MAX_VALUES = 20  # each value of a sweep segments all the reads again
+SWEEP_MAX_TIME_BETWEEN_SIGNALS = 24 * 60 * 60
+SWEEP_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+TABLE_PAGE_ROWS = 50
 
 
 def create_tmp_folders_for_templates():
@@ -23,27 +52,73 @@ def create_tmp_folders_for_templates():
             copy(f'templates/{file}', '/tmp/templates')
         except FileExistsError:
             pass
-    try:
-        os.mkdir('/tmp/server_uploads')  # Creates the folder for uploading files
-    except FileExistsError:
-        pass
+    os.makedirs(WORKSPACES_FOLDER, exist_ok=True)  # Creates the folder for the workspaces of each session
 
 
 create_tmp_folders_for_templates()
 
+METRICS_LOGGER.setLevel(os.environ.get("METRICS_LOG_LEVEL", "INFO"))  # the metrics of each step are INFO JSON logs
+METRICS_LOGGER.addHandler(logging.StreamHandler())  # only the metrics, the level of the other loggers is unchanged
+METRICS_LOGGER.propagate = False
 app = Flask(__name__, template_folder='/tmp/templates')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['TEMPLATES_AUTO_RELOAD'] = True
+last_workspaces_collection = 0
+
+
+def current_workspace() -> Workspace:
+    """
+    Returns the workspace of the session of the request, creating a new one on the first request. The workspace
+    and the pipeline state of the session are marked as used, so they expire together.
+    """
+    if "workspace" not in g:
+        g.workspace = Workspace(request.cookies.get(WORKSPACE_COOKIE))
+        g.workspace.create()
+        if g.workspace.workspace_id == request.cookies.get(WORKSPACE_COOKIE):  # a new session has no state yet
+            touch_pipeline_state(g.workspace.workspace_id)
+    return g.workspace
+
+
+@app.after_request
+def set_workspace_cookie(response):
+    """ Keeps the id of the workspace in a cookie, renewing its expiration with each request """
+    if "workspace" in g:
+        response.set_cookie(WORKSPACE_COOKIE, g.workspace.workspace_id, max_age=WORKSPACE_TTL_SECONDS, httponly=True,
+                            samesite="Lax")
+    return response
+
+
+@app.before_request
+def collect_expired_workspaces_periodically():
+    """ Every few minutes, removes the workspaces and pipeline states not used in WORKSPACE_TTL_SECONDS """
+    global last_workspaces_collection
+    if time.time() - last_workspaces_collection < WORKSPACES_COLLECTION_INTERVAL_SECONDS:
+        return
+    last_workspaces_collection = time.time()
+
+    def collect_expired_workspaces_and_states():
+        stop_live_ingestions(collect_expired_workspaces())
+        delete_expired_pipeline_states(WORKSPACE_TTL_SECONDS)
+
+    threading.Thread(target=collect_expired_workspaces_and_states, daemon=True).start()
+
+
+def stop_live_ingestions(workspaces_ids: List[str]):
+    """ Stops and removes the live ingestions of the workspaces, so their threads don't outlive the sessions """
+    with LIVE_INGESTIONS_LOCK:
+        live_ingestions = [LIVE_INGESTIONS.pop(workspace_id, None) for workspace_id in workspaces_ids]
+    for live_ingestion in live_ingestions:
+        if live_ingestion is not None:
+            live_ingestion.stop()
 
 
 def genotypes_form_to_list(form_dict: Dict[str, str]) -> List[Dict[int, str]]:
     """ Transforms the dict coming from the input_genotypes HTML form into a list of dicts """
     nested_genotypes = {}
     for key in form_dict:  # form_dict = request.form
-        split_key = key.split(".xlsx ")  # ["file1", "1"]
+        split_key = key.rsplit(" ", 1)  # ["file1.xlsx", "1"], file names have no spaces after secure_filename
         nested_genotypes[split_key[0]] = {}  # 1st loop creates the necessary dictionaries
     for key in form_dict:
-        split_key = key.split(".xlsx ")
+        split_key = key.rsplit(" ", 1)
         nested_genotypes[split_key[0]][int(split_key[1])] = form_dict[key]  # 2nd loop assigns the values to each dict
     genotypes_of_each_experiment = []
     for key in nested_genotypes:
@@ -51,15 +126,89 @@ def genotypes_form_to_list(form_dict: Dict[str, str]) -> List[Dict[int, str]]:
     return genotypes_of_each_experiment
 
 
+def run_pipeline_job(job: PipelineJob, workspace: Workspace, parameters: list):
+    """ Runs the pipeline with the parameters of the run and saves the results. Plots are rendered on demand """
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+    pipeline.input_parameters_of_run(*parameters)
+    pipeline.run_pipeline(progress_callback=job.report_stage)
+    job.report_stage("saving", "started")
+    serialize_and_upload_pipeline_to_gcs(pipeline, workspace.workspace_id)
+    job.report_stage("saving", "finished")
+    workspace.touch()
+
+
+def sweep_job(job: PipelineJob, workspace: Workspace, run_fingerprint: str, max_times: List[int], sweep_id: str):
+    """
+    Computes a sweep of the max time between signals for the last run and writes its table to the workspace.
+    The state of the pipeline is not saved: the sweep doesn't change the results of the run
+    """
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+    if pipeline.run_fingerprint != run_fingerprint:
+        raise ValueError("The results changed while the sensitivity analysis was queued, run it again")
+    job.report_stage("sweep", "started")
+    sweep_table = pipeline.sweep_max_time_between_signals(max_times)
+    job.report_stage("sweep", "finished")
+    path = sweep_table_path(workspace, sweep_id)
+    temporary_path = f"{path}.{threading.get_ident()}.tmp"
+    sweep_table.to_parquet(temporary_path, index=False)
+    os.replace(temporary_path, path)
+    workspace.touch()
+
+
+def parse_max_times(max_times: str) -> List[int]:
+    """
+    Parses the max times between signals of a sweep, whole seconds separated by commas, without repeated values.
+    Raises ValueError if they are invalid or too many, each value costs a segmentation of all the reads.
+    """
+    try:
+        values = list(dict.fromkeys(int(value) for value in max_times.split(",") if value.strip()))
+    except ValueError:
+        raise ValueError("The max times between signals must be whole seconds separated by commas") from None
+    if not values:
+        raise ValueError("Introduce at least one max time between signals")
+    if len(values) > SWEEP_MAX_VALUES:
+        raise ValueError(f"A sensitivity analysis can compare up to {SWEEP_MAX_VALUES} values")
+    if min(values) < 1 or max(values) > SWEEP_MAX_TIME_BETWEEN_SIGNALS:
+        raise ValueError(f"The max times between signals must be between 1 and {SWEEP_MAX_TIME_BETWEEN_SIGNALS} "
+                         f"seconds")
+    return values
+
+
+def sweep_table_path(workspace: Workspace, sweep_id: str) -> str:
+    """ Sweeps are kept with the exports of the run, so a new run removes them """
+    return os.path.join(workspace.exports_folder, f"sweep_{sweep_id}.parquet")
+
+
+def append_files_job(job: PipelineJob, workspace: Workspace, file_names: List[str]):
+    """ Adds new files to the pipeline, updating the results of its last run, and saves it """
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+    pipeline.append_files(file_names, workers=INGESTION_WORKERS, progress_callback=job.report_stage)
+    job.report_stage("saving", "started")
+    serialize_and_upload_pipeline_to_gcs(pipeline, workspace.workspace_id)
+    job.report_stage("saving", "finished")
+    workspace.touch()
+
+
+def available_file_name(file_name: str, file_names: List[str]) -> str:
+    """ Returns the file name, numbered if it is already one of file_names (readers export files with one name) """
+    stem, extension = os.path.splitext(file_name)
+    count = 1
+    while file_name in file_names:
+        count += 1
+        file_name = f"{stem}_{count}{extension}"
+    return file_name
+
+
 @app.route('/')
 def home():
     """
     Main home screen for the web app.
     Returns the HTMl template where the Excel files are uploaded.
-    Resets the pipeline by deleting the pkl file form Google Cloud Storage.
+    Resets the pipeline of the session by deleting its state from Google Cloud Storage.
     """
-    if is_pipeline_present():
-        delete_pipeline_file()
+    workspace = current_workspace()
+    if is_pipeline_present(workspace.workspace_id):
+        delete_pipeline_file(workspace.workspace_id)
     return render_template('home.html')
 
 
@@ -70,22 +219,26 @@ def upload_files():
     Initializes the pipeline Class and executes some pre-processing functions.
     Returns the next screen of the app: Input Parameters.
     """
+    workspace = current_workspace()
     if request.method == 'POST':
         file_names = []
         excel_files = request.files.getlist('excel_files')
         for file in excel_files:
             secure_file_name = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], secure_file_name))
+            file.save(os.path.join(workspace.uploads_folder, secure_file_name))
             file_names.append(secure_file_name)
-        pipeline = Pipeline(file_names)
-        pipeline.preprocessing_of_data()
-        serialize_and_upload_pipeline_to_gcs(pipeline)
+        pipeline = Pipeline(file_names, upload_folder=workspace.uploads_folder, exports_folder=workspace.exports_folder)
+        try:
+            pipeline.preprocessing_of_data(workers=INGESTION_WORKERS)
+        except ReaderFilesError as error:
+            return render_template('error_input_genotypes.html', failed_files=error.failed_files)
+        serialize_and_upload_pipeline_to_gcs(pipeline, workspace.workspace_id)
         return render_template('input_genotypes.html',
                                file_names=file_names,
                                dates=pipeline.dates_of_dfs,
                                antennas_info=pipeline.antennas_info)
-    elif request.method == 'GET' and is_pipeline_present():
-        pipeline = download_and_deserialize_pipeline_from_gcs()
+    elif request.method == 'GET' and is_pipeline_present(workspace.workspace_id):
+        pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
         file_names = pipeline.excel_files
         antennas_info = pipeline.antennas_info
         dates = pipeline.dates_of_dfs
@@ -98,13 +251,14 @@ def upload_files():
 @app.route('/input-parameters', methods=['POST', 'GET'])
 def send_genotypes():
     """ Posts the data for the genotypes and returns the template for Input Parameters """
-    if request.method == 'POST' and is_pipeline_present():
-        pipeline = download_and_deserialize_pipeline_from_gcs()
+    workspace = current_workspace()
+    if request.method == 'POST' and is_pipeline_present(workspace.workspace_id):
+        pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
         genotypes = genotypes_form_to_list(request.form)
         pipeline.input_genotypes_data(genotypes)
-        serialize_and_upload_pipeline_to_gcs(pipeline)
+        serialize_and_upload_pipeline_to_gcs(pipeline, workspace.workspace_id)
         return render_template('input_parameters.html')
-    elif request.method == 'GET' and is_pipeline_present():
+    elif request.method == 'GET' and is_pipeline_present(workspace.workspace_id):
         return render_template('input_parameters.html')
     else:
         return render_template('error_input_parameters.html')
@@ -112,51 +266,291 @@ def send_genotypes():
 
 @app.route('/view-results', methods=['POST', 'GET'])
 def send_parameters_and_run():
-    """ Posts the parameters data, runs the main pipeline functions and returns the pipeline results """
-    if request.method == 'POST' and is_pipeline_present():
+    """
+    Posts the parameters data and queues the run of the pipeline, returning the page that follows its progress.
+    Once the run has finished, returns the pipeline results.
+    """
+    workspace = current_workspace()
+    if request.method == 'POST' and is_pipeline_present(workspace.workspace_id):
         # Introduce the parameters of the pipeline
         parameters = [request.form["max_time_between_signals"], request.form["round_or_truncate"],
                       request.form["pollinators_to_remove"].split(', '),
                       request.form["filter_tags_by_visited_genotypes"],
                       request.form["visited_genotypes_required"].split(', '),
-                      request.form["start_date_filter"], request.form["end_date_filter"]]
-        pipeline = download_and_deserialize_pipeline_from_gcs()
-        pipeline.input_parameters_of_run(*parameters)
-        # Run the main process of the pipeline
-        pipeline.run_pipeline()
-        plots = Plot(pipeline.genotypes_dfs)
-        plots.lay_out_plots_to_html()
-        serialize_and_upload_pipeline_to_gcs(pipeline)
+                      request.form["start_date_filter"], request.form["end_date_filter"],
+                      request.form.get("visited_genotypes_mode", "all"),
+                      request.form.get("min_visited_genotypes") or 1,
+                      request.form.get("ttest_method", "student"), request.form.get("ttest_correction", "none")]
+        # Run the main process of the pipeline in the background
+        job = PIPELINE_JOBS.submit(run_pipeline_job, workspace, parameters)
+        return redirect(url_for('view_job', job_id=job.job_id))
+    elif request.method == 'GET' and is_pipeline_present(workspace.workspace_id):
+        pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+        if pipeline.run_fingerprint is None:  # the pipeline has not been run yet
+            return render_template('error_pipeline_results.html')
         return render_template('pipeline_results.html',
                                stats=pipeline.statistics,
                                file_names=pipeline.excel_files,
                                pollinators_alias=pipeline.pollinators_aliases,
-                               tables_names=pipeline.genotypes_names)
-    elif request.method == 'GET' and is_pipeline_present() and are_plots_files_present():
-        pipeline = download_and_deserialize_pipeline_from_gcs()
-        return render_template('pipeline_results.html',
-                               stats=pipeline.statistics,
-                               file_names=pipeline.excel_files,
-                               pollinators_alias=pipeline.pollinators_aliases,
-                               tables_names=pipeline.genotypes_names)
+                               tables_names=pipeline.genotypes_names,
+                               run_fingerprint=pipeline.run_fingerprint,
+                               live_ingestion_enabled=LIVE_INGESTION_FOLDER is not None,
+                               steps_metrics=(getattr(pipeline, 'ingestion_metrics', None) or [])
+                               + (getattr(pipeline, 'run_metrics', None) or []),
+                               bokeh_js=CDN.render_js())
     else:
         return render_template('error_pipeline_results.html')
 
 
+@app.route('/append-files', methods=['POST'])
+def append_files():
+    """
+    Uploads new reader files to the analysis of the session and queues the update of its results with them,
+    returning the page that follows its progress. Only the new files are processed.
+    """
+    workspace = current_workspace()
+    if not is_pipeline_present(workspace.workspace_id):
+        return render_template('error_pipeline_results.html')
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+    file_names = []
+    for file in request.files.getlist('excel_files'):
+        file_name = available_file_name(secure_filename(file.filename), pipeline.excel_files + file_names)
+        file.save(os.path.join(workspace.uploads_folder, file_name))
+        file_names.append(file_name)
+    job = PIPELINE_JOBS.submit(append_files_job, workspace, file_names)
+    return redirect(url_for('view_job', job_id=job.job_id))
+
+
+@app.route('/live/start', methods=['POST'])
+def start_live_ingestion():
+    """
+    Starts following the logs of LIVE_INGESTION_FOLDER with the parameters of the last run of the session,
+    replacing its previous live ingestion, and returns the page of its running aggregates.
+    At most LIVE_INGESTIONS_MAX sessions follow the folder at the same time.
+    """
+    workspace = current_workspace()
+    if LIVE_INGESTION_FOLDER is None or not is_pipeline_present(workspace.workspace_id):
+        abort(404)
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+    if pipeline.run_fingerprint is None:  # the live ingestion uses the parameters of the last run
+        return render_template('error_pipeline_results.html')
+    live_ingestion = LiveIngestion.from_pipeline(pipeline, LIVE_INGESTION_FOLDER)
+    with LIVE_INGESTIONS_LOCK:
+        if workspace.workspace_id not in LIVE_INGESTIONS and len(LIVE_INGESTIONS) >= LIVE_INGESTIONS_MAX:
+            return jsonify({"error": "Too many live ingestions running, try again later"}), 503
+        previous_live_ingestion = LIVE_INGESTIONS.pop(workspace.workspace_id, None)
+        LIVE_INGESTIONS[workspace.workspace_id] = live_ingestion
+    if previous_live_ingestion is not None:
+        previous_live_ingestion.stop()
+    live_ingestion.start()
+    return redirect(url_for('live_ingestion_status'))
+
+
+@app.route('/live/stop', methods=['POST'])
+def stop_live_ingestion():
+    """ Stops the live ingestion of the session """
+    with LIVE_INGESTIONS_LOCK:
+        live_ingestion = LIVE_INGESTIONS.pop(current_workspace().workspace_id, None)
+    if live_ingestion is None:
+        return jsonify({"error": "There is no live ingestion running"}), 404
+    live_ingestion.stop()
+    return jsonify(live_ingestion.to_dict())
+
+
+@app.route('/live/status')
+def live_ingestion_status():
+    """
+    Returns the running aggregates of the live ingestion of the session as JSON: the visits, durations and
+    pollinators of each genotype, its open visits, and the latest visits
+    """
+    live_ingestion = LIVE_INGESTIONS.get(current_workspace().workspace_id)
+    if live_ingestion is None:
+        return jsonify({"error": "There is no live ingestion running"}), 404
+    return jsonify(live_ingestion.to_dict())
+
+
+@app.route('/charts/<run_fingerprint>/<group>')
+def chart_group(run_fingerprint, group):
+    """
+    Returns a group of charts of a run as a Bokeh JSON item, embedded by the results page when it is shown.
+    Charts are only rendered the first time they are requested, and then cached in the workspace by the fingerprint
+    of the run (its files and parameters), so reloading the results page or going back to it costs nothing.
+    """
+    if group not in CHART_GROUPS_FILES or not RUN_FINGERPRINT_PATTERN.match(run_fingerprint):
+        abort(404)
+    workspace = current_workspace()
+    file_name = f"{run_fingerprint}_{group}.json"
+    if not os.path.isfile(os.path.join(workspace.plots_folder, file_name)):
+        if not is_pipeline_present(workspace.workspace_id):
+            abort(404)
+        pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+        if pipeline.run_fingerprint != run_fingerprint:
+            abort(404)
+        plots = Plot(pipeline.genotypes_dfs, workspace.plots_folder, getattr(pipeline, 'visits_timeline', None),
+                     url_for('visits_timeline', run_fingerprint=run_fingerprint),
+                     getattr(pipeline, 'genotypes_t_tests', None))
+        chart_json = plots.chart_group_to_json(group)
+        temporary_path = os.path.join(workspace.plots_folder, f"{file_name}.{threading.get_ident()}.tmp")
+        with open(temporary_path, "w") as file_handler:
+            file_handler.write(chart_json)
+        os.replace(temporary_path, os.path.join(workspace.plots_folder, file_name))
+    response = send_from_directory(workspace.plots_folder, file_name, mimetype="application/json",
+                                   max_age=CHARTS_MAX_AGE_SECONDS)
+    response.cache_control.public = False
+    response.cache_control.private = True  # charts of a session, only the browser can cache them
+    return response
+
+
+@lru_cache(maxsize=CACHED_TIMELINES)
+def load_visits_timeline(workspace_id: str, run_fingerprint: str):
+    """
+    Returns the rollups of the visit counts of a run, kept in memory by the fingerprint of the run, so panning
+    and zooming a chart doesn't load the pipeline state on every request
+    """
+    if not is_pipeline_present(workspace_id):
+        abort(404)
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace_id)
+    if pipeline.run_fingerprint != run_fingerprint:
+        abort(404)
+    visits_timeline = getattr(pipeline, 'visits_timeline', None)  # states saved before the timeline stage
+    return visits_timeline if visits_timeline is not None else build_visits_timeline(pipeline.joined_visits())
+
+
+@app.route('/timeline/<run_fingerprint>')
+def visits_timeline(run_fingerprint):
+    """
+    Returns the number of visits between start and end (epoch milliseconds) of a genotype, or of all of them,
+    at the finest resolution that keeps the response under a bounded number of points, as JSON.
+    Used by the evolution chart to load the visible range as the user pans and zooms.
+    """
+    if not RUN_FINGERPRINT_PATTERN.match(run_fingerprint):
+        abort(404)
+    timeline = load_visits_timeline(current_workspace().workspace_id, run_fingerprint)
+    genotype = request.args.get("genotype", ALL_GENOTYPES)
+    if genotype not in timeline["day"]:
+        return jsonify({"error": f"Unknown genotype {genotype}"}), 400
+    start = request.args.get("start", type=int)  # None (the whole timeline) if missing or not an integer
+    end = request.args.get("end", type=int)
+    response = jsonify(select_timeline_range(timeline, start, end, genotype))
+    response.cache_control.max_age = CHARTS_MAX_AGE_SECONDS
+    response.cache_control.private = True
+    return response
+
+
+@app.route('/jobs/<job_id>')
+def view_job(job_id):
+    """ Returns the page that polls the progress of a pipeline run and opens the results when it finishes """
+    if PIPELINE_JOBS.get(job_id) is None:
+        abort(404)
+    return render_template('job_status.html', job_id=job_id)
+
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    """ Returns the status of a pipeline run, with the progress and timing of each stage, as JSON """
+    job = PIPELINE_JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Returns the measurements of the steps of the pipeline, the charts and the storage of the states in this server
+    process as JSON: the totals of each step (count, wall and CPU seconds) and the latest measurements
+    """
+    return jsonify(METRICS.to_dict())
+
+
+@app.route('/sensitivity-analysis', methods=['POST'])
+def sweep_max_time_between_signals():
+    """
+    Queues the computation of the visits for several max times between signals, with the rest of the last run
+    parameters, returning the page that follows its progress. A sweep already computed for the run is shown directly.
+    """
+    workspace = current_workspace()
+    if not is_pipeline_present(workspace.workspace_id):
+        return render_template('error_pipeline_results.html')
+    try:
+        max_times = parse_max_times(request.form.get("max_times", ""))
+    except ValueError as error:
+        abort(400, str(error))
+    run_fingerprint = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id).run_fingerprint
+    if run_fingerprint is None:  # the sweep uses the parameters of the last run
+        return render_template('error_pipeline_results.html')
+    sweep_id = hashlib.sha256(json.dumps([run_fingerprint, max_times]).encode()).hexdigest()[:32]
+    if os.path.isfile(sweep_table_path(workspace, sweep_id)):
+        return redirect(url_for('view_sweep', sweep_id=sweep_id))
+    job = PIPELINE_JOBS.submit(sweep_job, workspace, run_fingerprint, max_times, sweep_id,
+                               result_url=url_for('view_sweep', sweep_id=sweep_id))
+    return redirect(url_for('view_job', job_id=job.job_id))
+
+
+@app.route('/sensitivity-analysis/<sweep_id>')
+def view_sweep(sweep_id):
+    """ Returns the table and the chart of a sweep of the max time between signals computed by a sweep job """
+    if not SWEEP_ID_PATTERN.match(sweep_id):
+        abort(404)
+    path = sweep_table_path(current_workspace(), sweep_id)
+    if not os.path.isfile(path):  # never computed, or removed by a new run
+        abort(404)
+    sweep_table = pd.read_parquet(path)
+    return render_template('sweep_results.html',
+                           max_times=sweep_table["Max Time Between Signals"].unique().tolist(),
+                           sweep_table=sweep_table.to_html(index=False, classes="table table-striped", border=0),
+                           sweep_chart=Plot.sweep_plot_to_json(sweep_table),
+                           bokeh_js=CDN.render_js())
+
+
 @app.route('/view-table/<name>')
 def open_html_table(name):
-    """ When called from a button on view-results, returns the corresponding HTML table file """
-    path = f'/tmp/exports/{name}_table.html'
-    return send_file(path)
+    """ When called from a button on view-results, returns the page of a table, which loads its rows page by page """
+    if not os.path.isfile(results_table_path(current_workspace().exports_folder, name)):
+        abort(404)
+    return render_template('results_table.html', table_name=name, page_rows=TABLE_PAGE_ROWS)
 
 
-@app.route('/download-data-excel')
-def download_excel_file():
-    """ When called from a button on view-results, returns the excel file containing the dataframes """
+@app.route('/tables/<name>')
+def results_table_page(name):
+    """
+    Returns a page of a results table as JSON. Query parameters: offset, limit, sort (column), descending (true or
+    false), and the filters tag (DEC Tag ID or alias), start and end (scan dates and times).
+    Only the requested rows are read from the memory-mapped file of the table.
+    """
+    path = results_table_path(current_workspace().exports_folder, name)  # names can't contain "/"
+    if not os.path.isfile(path):
+        return jsonify({"error": f"Unknown table {name}"}), 404
     try:
-        return send_file('/tmp/exports/genotypes.xlsx')
-    except Exception as e:
-        return str(e)
+        table_page = query_results_table(path, offset=request.args.get("offset", 0, type=int),
+                                         limit=request.args.get("limit", TABLE_PAGE_ROWS, type=int),
+                                         sort_by=request.args.get("sort") or None,
+                                         descending=request.args.get("descending") == "true",
+                                         tag=request.args.get("tag", "").strip(),
+                                         start=request.args.get("start", "").strip(),
+                                         end=request.args.get("end", "").strip())
+    except ValueError as error:  # unknown column or invalid date
+        return jsonify({"error": str(error)}), 400
+    return jsonify(table_page)
+
+
+@app.route('/download-data-excel', defaults={'export_format': 'xlsx'})
+@app.route('/download-data/<export_format>')
+def download_results(export_format):
+    """
+    When called from a button on view-results, returns the results tables as an Excel workbook, a ZIP of CSV files
+    or a Parquet file. Each format is only exported the first time it is downloaded after a run.
+    """
+    workspace = current_workspace()
+    if export_format not in EXPORT_FORMATS or not is_pipeline_present(workspace.workspace_id):
+        abort(404)
+    pipeline = download_and_deserialize_pipeline_from_gcs(workspace.workspace_id)
+    if pipeline.run_fingerprint is None:
+        return render_template('error_pipeline_results.html')
+    export_path = pipeline.export_results(export_format)
+    file_name, mimetype = EXPORT_FORMATS[export_format]
+    return send_from_directory(workspace.exports_folder, os.path.basename(export_path), mimetype=mimetype,
+                               as_attachment=True, download_name=file_name)
 
 
 @app.errorhandler(404)
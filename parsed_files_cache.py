@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARSED_FILES_CACHE_FOLDER = '/tmp/parsed_files_cache'
+PARSED_FILES_CACHE_MAX_BYTES = 256 * 1024 * 1024  # App Engine /tmp lives in the instance memory, keep it small
+CACHE_FILE_EXTENSION = '.parquet'
+SUMMARY_METADATA_KEY = b'rfid_pollinators_summary'
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ Returns the SHA-256 hex digest of the contents of a file, read in chunks """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ParsedFilesCache:
+    """
+    Content-addressed cache of parsed reader files.
+    Each entry is the parsed dataframe of an uploaded file, stored as a Parquet file named after the hash of the
+    original upload, so the same field file is only parsed once no matter its name or the session that uploads it.
+    Next to the dataframe, each entry keeps a small JSON summary (antennas, dates...) in the Parquet metadata,
+    so that information is available on a cache hit without scanning the dataframe again.
+    The folder is bounded in size: when it grows over max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, folder: str = PARSED_FILES_CACHE_FOLDER, max_bytes: int = PARSED_FILES_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def get(self, file_hash: str) -> Optional[Tuple[pd.DataFrame, dict]]:
+        """ Returns the cached dataframe and summary for that hash, or None if it is not in the cache """
+        path = self._entry_path(file_hash)
+        try:
+            table = pq.read_table(path)
+            summary = json.loads(table.schema.metadata.get(SUMMARY_METADATA_KEY, b'{}'))
+            dataframe = table.to_pandas()
+        except FileNotFoundError:
+            return None
+        except Exception:  # a corrupted or half-evicted entry is just a cache miss
+            self._remove_entry(path)
+            return None
+        os.utime(path)  # the modification time is used as the "last used" mark for the LRU eviction
+        return dataframe, summary
+
+    def put(self, file_hash: str, dataframe: pd.DataFrame, summary: dict = None):
+        """ Saves a parsed dataframe to the cache and evicts old entries if the cache is over its size limit """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._entry_path(file_hash)
+        temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[SUMMARY_METADATA_KEY] = json.dumps(summary or {}, default=str).encode()
+        pq.write_table(table.replace_schema_metadata(metadata), temporary_path)
+        os.replace(temporary_path, path)  # atomic, so other threads never read a half-written entry
+        self._evict_least_recently_used()
+
+    def _entry_path(self, file_hash: str) -> str:
+        return os.path.join(self.folder, file_hash + CACHE_FILE_EXTENSION)
+
+    def _evict_least_recently_used(self):
+        """ Removes the oldest entries until the total size of the cache fits in max_bytes """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(CACHE_FILE_EXTENSION):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            self._remove_entry(path)
+            total_size -= size
+
+    @staticmethod
+    def _remove_entry(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,106 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+PIPELINE_JOBS_WORKERS = 2
+FINISHED_JOBS_RETENTION_SECONDS = 60 * 60
+
+
+class PipelineJob:
+    """
+    A run of the pipeline executed in the background.
+    Keeps its status ("queued", "running", "finished" or "failed") and the progress and timing of each stage,
+    reported by the pipeline through report_stage. result_url is the page that shows the results once it finishes.
+    """
+
+    def __init__(self, result_url: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.result_url = result_url
+        self.status = "queued"
+        self.error = None
+        self.stages = []
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def report_stage(self, stage_name: str, event: str):
+        """ Progress callback of the pipeline: event is "started", "finished" or "skipped" """
+        with self._lock:
+            now = time.time()
+            if event == "started":
+                self.stages.append({"name": stage_name, "status": "running", "started_at": now, "seconds": None})
+            elif event == "skipped":
+                self.stages.append({"name": stage_name, "status": "skipped", "started_at": now, "seconds": 0})
+            else:
+                stage = next(stage for stage in reversed(self.stages) if stage["name"] == stage_name)
+                stage["status"] = "finished"
+                stage["seconds"] = round(now - stage["started_at"], 3)
+
+    def to_dict(self) -> dict:
+        """ Returns the status of the job in a JSON serializable dict """
+        with self._lock:
+            end = self.finished_at or time.time()
+            return {"job_id": self.job_id,
+                    "status": self.status,
+                    "error": self.error,
+                    "result_url": self.result_url,
+                    "queued_seconds": round((self.started_at or end) - self.submitted_at, 3),
+                    "running_seconds": round(end - self.started_at, 3) if self.started_at else None,
+                    "stages": [{key: value for key, value in stage.items() if key != "started_at"}
+                               for stage in self.stages]}
+
+    def _set_status(self, status: str, error: str = None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            if status == "running":
+                self.started_at = time.time()
+            elif status in ("finished", "failed"):
+                self.finished_at = time.time()
+
+
+class PipelineJobs:
+    """
+    Queue of pipeline runs executed by a pool of background threads, so web requests return straight away.
+    Jobs are kept in memory until some time after they finish, so they can be polled by their id.
+    """
+
+    def __init__(self, workers: int = PIPELINE_JOBS_WORKERS,
+                 retention_seconds: float = FINISHED_JOBS_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline-job")
+        self._jobs: Dict[str, PipelineJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_function: Callable, *args, result_url: str = None) -> PipelineJob:
+        """ Queues job_function(job, *args), which receives the job to report the progress of its stages """
+        job = PipelineJob(result_url)
+        with self._lock:
+            self._forget_old_jobs()
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run_job, job, job_function, args)
+        return job
+
+    def get(self, job_id: str) -> Optional[PipelineJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def _run_job(job: PipelineJob, job_function: Callable, args: tuple):
+        job._set_status("running")
+        try:
+            job_function(job, *args)
+        except Exception as error:  # the error is reported to the user through the status of the job
+            job._set_status("failed", f"{type(error).__name__}: {error}")
+        else:
+            job._set_status("finished")
+
+    def _forget_old_jobs(self):
+        """ Removes the jobs that finished more than retention_seconds ago """
+        limit = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < limit]:
+            del self._jobs[job_id]
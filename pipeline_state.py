@@ -0,0 +1,267 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from rfid_pollinators_pipeline import Pipeline
+
+STATE_MANIFEST_NAME = 'state.json'
+STATE_LAST_USED_NAME = 'last_used'  # rewritten when the state is used without being saved
+STATE_BLOBS_PREFIX = 'blobs/'
+STATE_FORMAT_VERSION = 1
+PRIVATE_ATTRIBUTES_PREFIX = '_state_'  # attributes of StoredPipeline that are never stored
+SUPERSEDED_BLOBS_GRACE_SECONDS = 60 * 60  # longer than any request that may still read an older state
+
+
+class LocalStateBackend:
+    """ Backend of the StateStore that keeps the blobs as files in a local folder, used in tests and benchmarks """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.location = os.path.abspath(folder)
+
+    def read(self, name: str) -> Optional[bytes]:
+        """ Returns the contents of a blob, or None if it doesn't exist """
+        try:
+            with open(os.path.join(self.folder, name), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name: str, data: bytes):
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+
+    def delete(self, name: str):
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+
+    def list_blobs(self) -> Dict[str, float]:
+        """ Returns the names of the blobs, with the time they were written """
+        blobs_folder = os.path.join(self.folder, STATE_BLOBS_PREFIX)
+        if not os.path.isdir(blobs_folder):
+            return {}
+        return {STATE_BLOBS_PREFIX + entry.name: entry.stat().st_mtime for entry in os.scandir(blobs_folder)}
+
+
+class StoredPipeline(Pipeline):
+    """
+    Pipeline loaded from a StateStore.
+    Its JSON metadata is loaded straight away, but each dataframe (or other big attribute) is only downloaded
+    the first time it is accessed, so a request only fetches the parts of the state it actually needs.
+    """
+
+    def __getattr__(self, name: str):
+        # Only called when the attribute is not in the instance yet, which is the case of the lazy attributes
+        lazy_entries = self.__dict__.get('_state_lazy_entries')
+        if lazy_entries is None or name not in lazy_entries:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        value = self._state_store.decode_entry(lazy_entries.pop(name))
+        setattr(self, name, value)
+        return value
+
+
+class StateStore:
+    """
+    Stores the state of a Pipeline split in parts, instead of as a single pickle of the whole object.
+    Small attributes (parameters, aliases, statistics...) are kept as JSON in a manifest. Dataframes are stored
+    as separate Parquet blobs, and any other attribute that can't be represented as JSON as a pickle blob.
+    Blobs are named after the hash of their contents, so saving only uploads the blobs that changed. The
+    attributes of a loaded pipeline that were never accessed are not even serialized again, and those accessed are
+    serialized to compare their contents with the stored ones, so changing them in place is saved as well.
+    The manifest is written last, so a failed save never leaves a half-written state. The blobs it no longer uses
+    are kept, as a request may still be reading an older state, until collect_superseded_blobs removes them.
+    The backend is pluggable: any object with read(name), write(name, data), delete(name) and list_blobs()
+    methods, and a location attribute that identifies where it stores the blobs.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def exists(self) -> bool:
+        return self._read_manifest() is not None
+
+    def touch(self):
+        """ Marks the state as used now, for the expiration of the states that are used but not saved again """
+        self.backend.write(STATE_LAST_USED_NAME, str(time.time()).encode())
+
+    def load(self) -> StoredPipeline:
+        """ Returns the stored pipeline, with its big attributes still to be downloaded on their first access """
+        manifest = self._read_manifest()
+        if manifest is None:
+            raise FileNotFoundError("There is no pipeline state in the store")
+        pipeline = StoredPipeline.__new__(StoredPipeline)
+        pipeline._state_store = self
+        pipeline._state_lazy_entries = {}
+        for name, entry in manifest["attributes"].items():
+            if "json" in entry:
+                setattr(pipeline, name, entry["json"])
+            else:
+                pipeline._state_lazy_entries[name] = entry
+        return pipeline
+
+    def save(self, pipeline: Pipeline):
+        """ Saves the pipeline, uploading only the blobs that are not already in the store """
+        old_manifest = self._read_manifest()
+        old_blobs = self._blobs_of_manifest(old_manifest) if old_manifest else set()
+        loaded_from_store = isinstance(pipeline, StoredPipeline) and self._is_same_store(pipeline._state_store)
+        if isinstance(pipeline, StoredPipeline) and not loaded_from_store:
+            for name in list(pipeline._state_lazy_entries):  # copied from another store, so everything is needed
+                getattr(pipeline, name)
+
+        attributes = dict(pipeline._state_lazy_entries) if loaded_from_store else {}  # never accessed, unchanged
+        new_blobs = {}
+        for name, value in vars(pipeline).items():
+            if not name.startswith(PRIVATE_ATTRIBUTES_PREFIX):
+                attributes[name], blobs = self._encode_value(value)
+                new_blobs.update(blobs)
+
+        for blob_name, data in new_blobs.items():
+            if blob_name not in old_blobs:
+                self.backend.write(blob_name, data)
+        manifest = {"version": STATE_FORMAT_VERSION, "attributes": attributes}
+        manifest_blobs = self._blobs_of_manifest(manifest)
+        now, limit = time.time(), time.time() - SUPERSEDED_BLOBS_GRACE_SECONDS
+        superseded = {blob_name: superseded_at for blob_name, superseded_at
+                      in (old_manifest or {}).get("superseded", {}).items() if superseded_at > limit}
+        superseded.update({blob_name: now for blob_name in old_blobs - manifest_blobs})
+        manifest["superseded"] = {blob_name: superseded_at for blob_name, superseded_at in superseded.items()
+                                  if blob_name not in manifest_blobs}
+        self.backend.write(STATE_MANIFEST_NAME, json.dumps(manifest).encode())
+        if isinstance(pipeline, StoredPipeline):
+            pipeline._state_store = self  # a later save of this same object is a delta again
+
+    def _is_same_store(self, other: 'StateStore') -> bool:
+        """ Stores are the same when their backends point to the same location, even if they are different objects """
+        return other is self or getattr(other.backend, 'location', None) == getattr(self.backend, 'location', object())
+
+    def delete(self):
+        """ Removes the manifest and every blob of the stored pipeline, including the superseded ones """
+        self.backend.delete(STATE_MANIFEST_NAME)
+        self.backend.delete(STATE_LAST_USED_NAME)
+        for blob_name in self.backend.list_blobs():
+            self.backend.delete(blob_name)
+
+    def collect_superseded_blobs(self, grace_seconds: float = SUPERSEDED_BLOBS_GRACE_SECONDS) -> int:
+        """
+        Removes the blobs the stored pipeline no longer uses, once they were superseded (or written, for those of
+        a save that never finished) more than grace_seconds ago. Returns the number of blobs removed.
+        The manifest is only read, so a save running at the same time is never undone.
+        """
+        manifest = self._read_manifest()
+        if manifest is None:
+            return 0
+        limit = time.time() - grace_seconds
+        used_blobs = self._blobs_of_manifest(manifest)
+        used_blobs.update(blob_name for blob_name, superseded_at in manifest.get("superseded", {}).items()
+                          if superseded_at > limit)
+        removed_blobs = 0
+        for blob_name, written_at in self.backend.list_blobs().items():
+            if blob_name not in used_blobs and written_at <= limit:
+                self.backend.delete(blob_name)
+                removed_blobs += 1
+        return removed_blobs
+
+    def decode_entry(self, entry: dict):
+        """ Downloads and decodes the value of a manifest entry """
+        if "json" in entry:
+            return entry["json"]
+        if "frame" in entry:
+            return self._read_frame(entry["frame"])
+        if "frames" in entry:
+            return {key: self._read_frame(blob_name) for key, blob_name in entry["frames"]}
+        return pickle.loads(self._read_blob(entry["pickle"]))
+
+    def _read_manifest(self) -> Optional[dict]:
+        data = self.backend.read(STATE_MANIFEST_NAME)
+        if data is None:
+            return None
+        manifest = json.loads(data)
+        return manifest if manifest.get("version") == STATE_FORMAT_VERSION else None
+
+    def _read_blob(self, blob_name: str) -> bytes:
+        data = self.backend.read(blob_name)
+        if data is None:
+            raise FileNotFoundError(f"Blob {blob_name} of the pipeline state is missing")
+        return data
+
+    def _read_frame(self, blob_name: str) -> pd.DataFrame:
+        if blob_name.endswith('.pkl'):
+            return pickle.loads(self._read_blob(blob_name))
+        return pq.read_table(pa.BufferReader(self._read_blob(blob_name))).to_pandas()
+
+    def _encode_value(self, value) -> Tuple[dict, Dict[str, bytes]]:
+        """ Returns the manifest entry of an attribute and the blobs needed to store it """
+        if isinstance(value, pd.DataFrame):
+            blob_name, data = self._encode_frame(value)
+            return {"frame": blob_name}, {blob_name: data}
+        if isinstance(value, dict) and value and all(isinstance(item, pd.DataFrame) for item in value.values()):
+            frames, blobs = [], {}
+            for key, frame in value.items():
+                blob_name, data = self._encode_frame(frame)
+                frames.append([key, blob_name])
+                blobs[blob_name] = data
+            if _is_json_value([key for key, _ in frames]):
+                return {"frames": frames}, blobs
+        if _is_json_value(value):
+            return {"json": value}, {}
+        data = pickle.dumps(value)
+        blob_name = _blob_name(data, '.pkl')
+        return {"pickle": blob_name}, {blob_name: data}
+
+    @staticmethod
+    def _encode_frame(frame: pd.DataFrame) -> Tuple[str, bytes]:
+        """ Serializes a dataframe to Parquet, or to a pickle if Arrow can't represent its columns """
+        try:
+            buffer = io.BytesIO()
+            pq.write_table(pa.Table.from_pandas(frame), buffer)
+            data, extension = buffer.getvalue(), '.parquet'
+        except (pa.ArrowException, TypeError, ValueError):
+            data, extension = pickle.dumps(frame), '.pkl'
+        return _blob_name(data, extension), data
+
+    @staticmethod
+    def _blobs_of_manifest(manifest: dict) -> set:
+        blobs = set()
+        for entry in manifest["attributes"].values():
+            if "frame" in entry:
+                blobs.add(entry["frame"])
+            elif "frames" in entry:
+                blobs.update(blob_name for _, blob_name in entry["frames"])
+            elif "pickle" in entry:
+                blobs.add(entry["pickle"])
+        return blobs
+
+
+def _blob_name(data: bytes, extension: str) -> str:
+    return STATE_BLOBS_PREFIX + hashlib.sha256(data).hexdigest() + extension
+
+
+def _is_json_value(value) -> bool:
+    """ Checks that a value is the same after a JSON round trip (so no sets, tuples or non-string keys) """
+    try:
+        return json.loads(json.dumps(value)) == value and _has_only_json_types(value)
+    except (TypeError, ValueError):
+        return False
+
+
+def _has_only_json_types(value) -> bool:
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _has_only_json_types(item) for key, item in value.items())
+    if isinstance(value, list):
+        return all(_has_only_json_types(item) for item in value)
+    return value is None or isinstance(value, (str, bool, int, float))
@@ -1,57 +1,119 @@
 import os
-import pickle
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
 
-from rfid_pollinators_pipeline import Pipeline
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 
-PIPELINE_BLOB_NAME = 'pipeline.pkl'
+from instrumentation import measure
+from pipeline_state import STATE_BLOBS_PREFIX, STATE_LAST_USED_NAME, STATE_MANIFEST_NAME, StateStore, StoredPipeline
+
 GCS_BUCKET = 'rfid-pollinators-2.appspot.com'
-PIPELINE_PKL_LOCAL_PATH = '/tmp/pipeline.pkl'
+PIPELINE_STATE_PREFIX = 'pipeline_state/'
+STATE_TOUCH_INTERVAL_SECONDS = 10 * 60  # the last use of each state is written at most this often
 
 CREDENTIAL_PATH = "gcs_credential.json"
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CREDENTIAL_PATH
+last_state_touches: Dict[str, float] = {}  # when this process last wrote the last use of each state
+
+
+class GCSStateBackend:
+    """ Backend of the StateStore that keeps the blobs in a GCS bucket, under a common prefix """
+
+    def __init__(self, bucket_name: str = GCS_BUCKET, prefix: str = PIPELINE_STATE_PREFIX):
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+        self.location = f"gs://{bucket_name}/{prefix}"
+
+    def read(self, name: str) -> Optional[bytes]:
+        """ Returns the contents of a blob, or None if it doesn't exist """
+        with measure("storage.gcs_read") as measurement:
+            try:
+                data = self.bucket.blob(self.prefix + name).download_as_bytes()
+            except NotFound:
+                return None
+            measurement["bytes"] = len(data)
+        return data
+
+    def write(self, name: str, data: bytes):
+        with measure("storage.gcs_write") as measurement:
+            self.bucket.blob(self.prefix + name).upload_from_string(data)
+            measurement["bytes"] = len(data)
+
+    def delete(self, name: str):
+        with measure("storage.gcs_delete"):
+            try:
+                self.bucket.blob(self.prefix + name).delete()
+            except NotFound:
+                pass
+
+    def list_blobs(self) -> Dict[str, float]:
+        """ Returns the names of the blobs, with the time they were written """
+        with measure("storage.gcs_list"):
+            return {blob.name[len(self.prefix):]: blob.updated.timestamp()
+                    for blob in self.bucket.list_blobs(prefix=self.prefix + STATE_BLOBS_PREFIX)}
+
+
+def _pipeline_state_store(workspace_id: str) -> StateStore:
+    """ Each workspace (user session) keeps the state of its pipeline under its own prefix """
+    return StateStore(GCSStateBackend(prefix=f"{PIPELINE_STATE_PREFIX}{workspace_id}/"))
 
 
-def serialize_and_upload_pipeline_to_gcs(pipeline):
-    """ Serializes and saves the Pipeline class to a blob on a GCS bucket """
-    with open(PIPELINE_PKL_LOCAL_PATH, 'wb') as file:
-        pickle.dump(pipeline, file)
+def serialize_and_upload_pipeline_to_gcs(pipeline, workspace_id: str):
+    """ Saves the state of the Pipeline class to GCS, uploading only the parts that changed """
+    with measure("storage.save_pipeline"):
+        _pipeline_state_store(workspace_id).save(pipeline)
 
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(GCS_BUCKET)
-    blob = bucket.blob(PIPELINE_BLOB_NAME)  # Name of the object to be stored in the bucket
-    blob.upload_from_filename(PIPELINE_PKL_LOCAL_PATH)   # Name of the object in local file system
 
+def download_and_deserialize_pipeline_from_gcs(workspace_id: str) -> StoredPipeline:
+    """ Returns the Pipeline stored in GCS. Its dataframes are only downloaded when they are used """
+    with measure("storage.load_pipeline"):
+        return _pipeline_state_store(workspace_id).load()
 
-def download_and_deserialize_pipeline_from_gcs() -> Pipeline:
-    """ Downloads the pipeline file form GCS bucket and returns the deserialized object """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET)
-    blob = bucket.blob(PIPELINE_BLOB_NAME)
-    blob.download_to_filename(PIPELINE_PKL_LOCAL_PATH)
 
-    with open(PIPELINE_PKL_LOCAL_PATH, 'rb') as file:
-        pipeline = pickle.load(file)
-    return pipeline
+def is_pipeline_present(workspace_id: str):  # TODO test
+    """ Checks if the state of the Pipeline is present on GCS bucket """
+    with measure("storage.pipeline_exists"):
+        return _pipeline_state_store(workspace_id).exists()
 
 
-def is_pipeline_present():  # TODO test
-    """ Checks if the serialized file for the Pipeline is present on GCS bucket """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET)
-    exists = storage.Blob(bucket=bucket, name=PIPELINE_BLOB_NAME).exists(storage_client)
-    return exists
+def delete_pipeline_file(workspace_id: str):
+    """ Deletes the state of the Pipeline from GCS bucket """
+    with measure("storage.delete_pipeline"):
+        _pipeline_state_store(workspace_id).delete()
 
 
-def are_plots_files_present():  # TODO test
-    """ Checks if the Plot files are already present """
-    return os.path.isfile("/tmp/templates/charts_per_genotype.html") and os.path.isfile(
-        "/tmp/templates/charts_per_pollinator.html") and os.path.isfile("/tmp/templates/evolution_charts.html")
+def touch_pipeline_state(workspace_id: str):
+    """
+    Marks the state of a workspace as used now. It is called on every request of the session, like
+    Workspace.touch, so the state and the workspace expire together even if the state is not saved again.
+    It is only written every STATE_TOUCH_INTERVAL_SECONDS, which is negligible next to their expiration.
+    """
+    now = time.time()
+    if now - last_state_touches.get(workspace_id, 0) < STATE_TOUCH_INTERVAL_SECONDS:
+        return
+    for touched_workspace_id, touched_at in list(last_state_touches.items()):
+        if now - touched_at >= STATE_TOUCH_INTERVAL_SECONDS:
+            last_state_touches.pop(touched_workspace_id, None)
+    last_state_touches[workspace_id] = now
+    with measure("storage.touch_pipeline"):
+        _pipeline_state_store(workspace_id).touch()
 
 
-def delete_pipeline_file():
-    """ Deletes the pipeline blob from GCS bucket """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET)
-    blob = bucket.blob(PIPELINE_BLOB_NAME)
-    blob.delete()
+def delete_expired_pipeline_states(ttl_seconds: float):
+    """
+    Deletes the pipeline states of the workspaces that have not been used (saved, or touched by a request of their
+    session) in ttl_seconds, and the blobs the other states no longer use
+    """
+    limit = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    last_uses = {}
+    for blob in storage.Client().bucket(GCS_BUCKET).list_blobs(prefix=PIPELINE_STATE_PREFIX):
+        workspace_id, _, name = blob.name[len(PIPELINE_STATE_PREFIX):].partition("/")
+        if name in (STATE_MANIFEST_NAME, STATE_LAST_USED_NAME):
+            last_uses[workspace_id] = max(blob.updated, last_uses.get(workspace_id, blob.updated))
+    for workspace_id, last_use in last_uses.items():
+        if last_use < limit:
+            delete_pipeline_file(workspace_id)
+        else:
+            _pipeline_state_store(workspace_id).collect_superseded_blobs()
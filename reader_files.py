@@ -0,0 +1,208 @@
+import csv
+import itertools
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from openpyxl import load_workbook
+from pyarrow import csv as pyarrow_csv
+
+READER_COLUMNS = ["Scan Date", "Scan Time", "Antenna ID", "DEC Tag ID"]
+READER_DTYPES = {"Scan Date": "object", "Scan Time": "object", "Antenna ID": "int64", "DEC Tag ID": "object"}
+READER_ARROW_TYPES = {column: pa.int64() if dtype == "int64" else pa.string()
+                      for column, dtype in READER_DTYPES.items()}
+STREAMING_MIN_FILE_BYTES = 8 * 1024 * 1024  # bigger workbooks are read in chunks instead of with read_excel
+STREAMING_CHUNK_ROWS = 50000
+SCAN_DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S.%f"
+SCAN_DATE_FORMAT = "%d/%m/%Y"
+SCAN_TIME_SEPARATORS = {2: ord(":"), 5: ord(":"), 8: ord(".")}  # fixed "HH:MM:SS.fff" format of the reader
+SCAN_TIME_DIGITS = [0, 1, 3, 4, 6, 7, 9, 10, 11]
+EXCEL_SIGNATURES = (b"PK\x03\x04", b"\xd0\xcf\x11\xe0")  # xlsx/ods are zip files, old xls are OLE2 files
+TEXT_DELIMITERS = ",;\t"
+
+
+def parse_reader_file(file_path: str) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Parses a reader export into the columns used by the pipeline (see parse_reader_rows), and returns them with
+    the dates of its first and last rows. Big workbooks are parsed chunk by chunk while they are streamed, so
+    their rows are never held as Python objects all at once.
+    """
+    if detect_reader_file_format(file_path) == "excel" and os.path.getsize(file_path) >= STREAMING_MIN_FILE_BYTES:
+        return read_excel_in_chunks(file_path)
+    rows = read_reader_file(file_path)
+    if rows.empty:
+        raise ValueError("The file has no reads")
+    return parse_reader_rows(rows), [rows['Scan Date'].iloc[0], rows['Scan Date'].iloc[-1]]
+
+
+def parse_reader_rows(rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the rows of the reader with the columns used by the pipeline: "Scan Timestamp" (epoch milliseconds of
+    the scan date and time), "Antenna ID" and "DEC Tag ID"
+    """
+    return pd.DataFrame({"Scan Timestamp": parse_scan_timestamps(rows['Scan Date'].values, rows['Scan Time'].values),
+                         "Antenna ID": rows['Antenna ID'].values,
+                         "DEC Tag ID": rows['DEC Tag ID'].values})
+
+
+def read_reader_file(file_path: str) -> pd.DataFrame:
+    """
+    Reads the rows of a reader export, keeping only the columns used by the pipeline.
+    The format is detected from the content of the file, not its extension:
+    CSV/TSV/TXT logs are parsed with the multi-threaded Arrow CSV reader, and workbooks with read_excel.
+    """
+    if detect_reader_file_format(file_path) == "text":
+        return read_text_log(file_path)
+    return pd.read_excel(file_path, usecols=READER_COLUMNS, dtype=READER_DTYPES)
+
+
+def detect_reader_file_format(file_path: str) -> str:
+    """ Returns "excel" for spreadsheet files (by their signature) and "text" for any other file """
+    with open(file_path, "rb") as file:
+        signature = file.read(4)
+    return "excel" if signature in EXCEL_SIGNATURES else "text"
+
+
+def read_text_log(file_path: str) -> pd.DataFrame:
+    """
+    Parses a delimited text export of the reader (comma, semicolon or tab separated, detected from the header).
+    Only the reader columns are converted, straight into the dtypes used for the Excel files.
+    """
+    with open(file_path, "r", encoding="utf-8-sig", errors="replace") as file:
+        header = file.readline()
+    table = pyarrow_csv.read_csv(file_path,
+                                 parse_options=pyarrow_csv.ParseOptions(delimiter=_header_delimiter(header)),
+                                 convert_options=pyarrow_csv.ConvertOptions(include_columns=READER_COLUMNS,
+                                                                            column_types=READER_ARROW_TYPES))
+    return table.to_pandas()
+
+
+def read_text_log_from(file_path: str, offset: int = 0) -> Tuple[pd.DataFrame, int]:
+    """
+    Parses the rows of a text export of the reader that start at a byte offset, for logs that keep growing while
+    the reader is running. Only complete lines are parsed: a last line still being written is left for the next call.
+    Returns the rows and the offset to continue from (after the header if offset is 0 and there are no rows yet).
+    """
+    with open(file_path, "rb") as file:
+        header = file.readline()
+        if not header.endswith(b"\n"):
+            return _empty_reader_rows(), 0
+        offset = max(offset, len(header))
+        file.seek(offset)
+        data = file.read()
+    data = data[:data.rfind(b"\n") + 1]
+    header = header.decode("utf-8-sig", errors="replace").rstrip("\r\n")
+    delimiter = _header_delimiter(header)
+    if not data:
+        return _empty_reader_rows(), offset
+    table = pyarrow_csv.read_csv(pa.BufferReader(data),
+                                 read_options=pyarrow_csv.ReadOptions(
+                                     column_names=next(csv.reader([header], delimiter=delimiter))),
+                                 parse_options=pyarrow_csv.ParseOptions(delimiter=delimiter),
+                                 convert_options=pyarrow_csv.ConvertOptions(include_columns=READER_COLUMNS,
+                                                                            column_types=READER_ARROW_TYPES))
+    return table.to_pandas(), offset + len(data)
+
+
+def _empty_reader_rows() -> pd.DataFrame:
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in READER_DTYPES.items()})
+
+
+def _header_delimiter(header: str) -> str:
+    """ Returns the delimiter of a text export of the reader, detected from its header (a comma by default) """
+    try:
+        return csv.Sniffer().sniff(header, delimiters=TEXT_DELIMITERS).delimiter
+    except csv.Error:
+        return ","
+
+
+def read_excel_in_chunks(file_path: str,
+                         chunk_rows: int = STREAMING_CHUNK_ROWS) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Streams the first sheet of a workbook using openpyxl read-only mode, chunk_rows rows at a time, and parses it
+    as parse_reader_file. Each chunk is converted straight away into compact arrays: scan dates and times into
+    int64 epoch milliseconds, antennas into int64 and tags into int32 codes of a lookup table, so only the chunk
+    being read is held as Python objects. Tags are returned as a categorical of those codes, never decoded back.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        missing_columns = [column for column in READER_COLUMNS if column not in header]
+        if missing_columns:
+            raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing_columns}")
+        date_index, time_index, antenna_index, tag_index = [header.index(column) for column in READER_COLUMNS]
+
+        tags_lookup_table = {}
+        chunks = {"Scan Timestamp": [], "Antenna ID": [], "DEC Tag ID": []}
+        first_and_last_dates = []
+        while True:
+            chunk = list(itertools.islice(rows, chunk_rows))
+            if not chunk:
+                break
+            chunk = [(row[date_index], row[time_index], row[antenna_index], row[tag_index]) for row in chunk
+                     if not (row[date_index] is None and row[time_index] is None and row[tag_index] is None)]
+            if not chunk:
+                continue
+            dates, times, antennas, tags = zip(*chunk)
+            chunks["Scan Timestamp"].append(parse_scan_timestamps(np.array(dates, dtype=object),
+                                                                  np.array(times, dtype=object)))
+            chunks["Antenna ID"].append(np.array(antennas, dtype=np.int64))
+            chunks["DEC Tag ID"].append(_encode_chunk(tags, tags_lookup_table))
+            first_and_last_dates = [(first_and_last_dates or dates)[0], dates[-1]]
+    finally:
+        workbook.close()
+
+    if not first_and_last_dates:
+        raise ValueError("The file has no reads")
+    tags = pd.Categorical.from_codes(np.concatenate(chunks["DEC Tag ID"]),
+                                     categories=pd.Index(list(tags_lookup_table), dtype=object))
+    return pd.DataFrame({"Scan Timestamp": np.concatenate(chunks["Scan Timestamp"]),
+                         "Antenna ID": np.concatenate(chunks["Antenna ID"]), "DEC Tag ID": tags}), first_and_last_dates
+
+
+def parse_scan_timestamps(scan_dates: np.ndarray, scan_times: np.ndarray) -> np.ndarray:
+    """
+    Parses the "Scan Date" and "Scan Time" columns of the reader into epoch milliseconds (int64).
+    Each distinct date string is parsed only once. Times in the fixed "HH:MM:SS.fff" format of the reader are
+    decoded directly from their bytes with NumPy; any other time falls back to pandas with the full format.
+    """
+    date_codes, unique_dates = pd.factorize(np.asarray(scan_dates, dtype=object))
+    if (date_codes < 0).any():
+        raise ValueError("Some rows have no Scan Date")
+    unique_dates_milliseconds = _to_epoch_milliseconds(pd.to_datetime(unique_dates, format=SCAN_DATE_FORMAT))
+    dates_milliseconds = unique_dates_milliseconds[date_codes]
+
+    scan_times = np.asarray(scan_times, dtype=object)
+    try:  # one byte more than the format, so longer times can be told apart
+        characters = scan_times.astype("S13").view(np.uint8).reshape(-1, 13)
+    except UnicodeEncodeError:
+        characters = np.zeros((len(scan_times), 13), dtype=np.uint8)  # all the times go through pandas
+    fixed_format = characters[:, 12] == 0
+    for position, separator in SCAN_TIME_SEPARATORS.items():
+        fixed_format &= characters[:, position] == separator
+    digits = characters[:, SCAN_TIME_DIGITS].astype(np.int64) - ord("0")
+    fixed_format &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+    hours, minutes, seconds, milliseconds = (digits[:, 0:2] @ [10, 1], digits[:, 2:4] @ [10, 1],
+                                             digits[:, 4:6] @ [10, 1], digits[:, 6:9] @ [100, 10, 1])
+    times_milliseconds = ((hours * 60 + minutes) * 60 + seconds) * 1000 + milliseconds
+    if not fixed_format.all():
+        other_rows = ~fixed_format
+        other_datetimes = pd.to_datetime(pd.Series(unique_dates[date_codes[other_rows]]).astype(str) + " "
+                                         + pd.Series(scan_times[other_rows]).astype(str),
+                                         format=SCAN_DATETIME_FORMAT)
+        times_milliseconds[other_rows] = _to_epoch_milliseconds(other_datetimes) - dates_milliseconds[other_rows]
+    return dates_milliseconds + times_milliseconds
+
+
+def _to_epoch_milliseconds(datetimes) -> np.ndarray:
+    return np.asarray(datetimes, dtype="datetime64[ns]").astype("datetime64[ms]").view(np.int64)
+
+
+def _encode_chunk(values: tuple, lookup_table: Dict[object, int]) -> np.ndarray:
+    """ Dictionary-encodes a chunk of values into int32 codes, adding the new values to the lookup table """
+    return np.fromiter((lookup_table.setdefault(value, len(lookup_table)) for value in values),
+                       dtype=np.int32, count=len(values))
+
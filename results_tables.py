@@ -0,0 +1,156 @@
+import csv
+import io
+import os
+import uuid
+import zipfile
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+RESULTS_TABLE_SUFFIX = '_table.arrow'
+RESULTS_TABLE_BATCH_ROWS = 64 * 1024
+RESULTS_TABLE_MAX_PAGE_ROWS = 500
+OPEN_RESULTS_TABLES = 16
+TIME_COLUMN = 'Scan Date and Time'
+TAG_COLUMNS = ['DEC Tag ID', 'Tag Alias']
+# File name and MIME type of each export of the results tables
+EXPORT_FORMATS = {"xlsx": ("genotypes.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+                  "csv": ("genotypes_csv.zip", "application/zip"),
+                  "parquet": ("genotypes.parquet", "application/vnd.apache.parquet")}
+
+
+def results_table_path(folder: str, name: str) -> str:
+    return os.path.join(folder, name + RESULTS_TABLE_SUFFIX)
+
+
+def write_results_table(dataframe: pd.DataFrame, path: str):
+    """
+    Saves a results table as an uncompressed Arrow IPC file, which can be memory-mapped and read without copies.
+    Categorical columns are stored as plain strings, so they can be compared and sorted as any other column.
+    """
+    dataframe = dataframe.astype({column: str for column in dataframe.columns
+                                  if isinstance(dataframe[column].dtype, pd.CategoricalDtype)})
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=RESULTS_TABLE_BATCH_ROWS)
+    os.replace(temporary_path, path)
+
+
+def open_results_table(path: str) -> pa.Table:
+    """
+    Returns the table of a results file, memory-mapped: its columns point to the pages of the file, which are only
+    read from disk when accessed and are shared by every process (or gunicorn worker) that maps the same file.
+    """
+    status = os.stat(path)
+    return _open_mapped_table(path, status.st_ino, status.st_mtime_ns)
+
+
+@lru_cache(maxsize=OPEN_RESULTS_TABLES)
+def _open_mapped_table(path: str, inode: int, modification_time: int) -> pa.Table:
+    # A replaced file is another inode, so it is mapped again instead of returning the table of the old one
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def query_results_table(path: str, offset: int = 0, limit: int = 50, sort_by: str = None, descending: bool = False,
+                        tag: str = None, start: str = None, end: str = None) -> dict:
+    """
+    Returns a page of a results table, as a JSON serializable dict with its columns and rows.
+    Rows can be filtered by tag (DEC Tag ID or alias) and by a range of scan times, and sorted by any column.
+    Only the columns used to filter and sort are scanned, and only the rows of the page are converted.
+    """
+    table = open_results_table(path)
+    if sort_by is not None and sort_by not in table.column_names:
+        raise ValueError(f"Unknown column {sort_by}")
+    mask = None
+    if tag:
+        for column in TAG_COLUMNS:
+            if column in table.column_names:
+                matches = pc.equal(table.column(column), tag)
+                mask = matches if mask is None else pc.or_(mask, matches)
+    for bound, compare in ((start, pc.greater_equal), (end, pc.less_equal)):
+        if bound:
+            bound = pa.scalar(pd.Timestamp(bound), table.schema.field(TIME_COLUMN).type)
+            matches = compare(table.column(TIME_COLUMN), bound)
+            mask = matches if mask is None else pc.and_(mask, matches)
+    if mask is None:
+        rows = pa.array(np.arange(table.num_rows))
+    else:
+        rows = pc.indices_nonzero(pc.fill_null(mask, False))
+    if sort_by is not None:
+        order = pc.sort_indices(table.column(sort_by).take(rows),
+                                sort_keys=[("", "descending" if descending else "ascending")])
+        rows = rows.take(order)
+    limit = max(0, min(int(limit), RESULTS_TABLE_MAX_PAGE_ROWS))
+    offset = max(0, int(offset))
+    page = table.take(rows[offset:offset + limit]).to_pandas()
+    return {"columns": table.column_names,
+            "rows": _rows_to_json_values(page),
+            "offset": offset,
+            "limit": limit,
+            "filtered_rows": len(rows),
+            "total_rows": table.num_rows}
+
+
+def export_results_tables(folder: str, names: List[str], export_format: str, path: str):
+    """
+    Writes the results tables of the genotypes to a file: an Excel workbook with a sheet for each genotype, a ZIP
+    with a CSV for each genotype, or a single Parquet file (the tables already have a Genotype column).
+    Tables are read one batch of rows at a time from their memory-mapped files, and the writers keep only the
+    current batch in memory (the Excel workbook is written in openpyxl's write-only mode).
+    """
+    export_writers = {"xlsx": _write_excel_export, "csv": _write_csv_export, "parquet": _write_parquet_export}
+    tables = {name: open_results_table(results_table_path(folder, name)) for name in names}
+    temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        export_writers[export_format](tables, temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def _write_excel_export(tables: Dict[str, pa.Table], path: str):
+    workbook = Workbook(write_only=True)
+    for name, table in tables.items():
+        sheet = workbook.create_sheet(title=name)
+        sheet.append(table.column_names)
+        for batch in table.to_batches():
+            rows = batch.to_pandas().astype(object)
+            for row in rows.where(rows.notna(), None).itertuples(index=False, name=None):
+                sheet.append(row)
+    workbook.save(path)
+
+
+def _write_csv_export(tables: Dict[str, pa.Table], path: str):
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, table in tables.items():
+            with archive.open(f'{name}.csv', 'w') as entry, io.TextIOWrapper(entry, encoding='utf-8',
+                                                                             newline='') as text:
+                csv.writer(text).writerow(table.column_names)
+                for batch in table.to_batches():
+                    batch.to_pandas().to_csv(text, header=False, index=False)
+
+
+def _write_parquet_export(tables: Dict[str, pa.Table], path: str):
+    # Tables without visits may have other column types (nulls), and have no rows to write anyway
+    tables_with_rows = [table for table in tables.values() if table.num_rows] or list(tables.values())[:1]
+    schema = tables_with_rows[0].schema if tables_with_rows else pa.schema([])
+    with pq.ParquetWriter(path, schema) as writer:
+        for table in tables_with_rows:
+            for batch in table.cast(schema).to_batches():
+                writer.write_batch(batch)
+
+
+def _rows_to_json_values(page: pd.DataFrame) -> List[list]:
+    """ Returns the rows of a dataframe as lists of Python values, with the scan times as strings and NaN as None """
+    if TIME_COLUMN in page:
+        page[TIME_COLUMN] = page[TIME_COLUMN].dt.strftime('%Y-%m-%d %H:%M:%S')
+    page = page.astype(object)
+    return page.where(page.notna(), None).values.tolist()
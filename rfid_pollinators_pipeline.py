@@ -1,28 +1,95 @@
-import itertools
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
-from typing import List, Dict
+from functools import partial
+from typing import Callable, List, Dict, Tuple
 
 import numpy as np
 import pandas as pd
-from bokeh.embed import file_html
-from bokeh.layouts import layout
-from bokeh.models import (ColumnDataSource, HoverTool, DatetimeTickFormatter,
-                          )
+from bokeh.embed import file_html, json_item
+from bokeh.layouts import column, layout
+from bokeh.models import (ColorBar, ColumnDataSource, CustomJS, HoverTool, DatetimeTickFormatter, LinearAxis,
+                          LinearColorMapper, Range1d, Select)
 from bokeh.palettes import viridis
 from bokeh.plotting import figure
 from bokeh.resources import CDN
 from math import pi
-from numpy.lib import math
-from scipy.stats import ttest_ind
+
+from genotype_comparisons import pairwise_t_tests, summaries_statistics, t_tests_to_dict
+from incidence_index import build_incidence_index, select_visitors
+from instrumentation import measure
+from parsed_files_cache import ParsedFilesCache, hash_file
+from reader_files import parse_reader_file
+from results_tables import (EXPORT_FORMATS, RESULTS_TABLE_SUFFIX, export_results_tables, results_table_path,
+                           write_results_table)
+from visit_segmentation import (MILLISECONDS_PER_SECOND, drop_last_visits_of_genotypes, reads_to_resegment,
+                                segment_visits, sort_reads)
+from visit_statistics import DurationsSummary, merge_visits_summaries, select_durations_summary, summarize_visits
+from visits_timeline import ALL_GENOTYPES, build_visits_timeline, select_timeline_range, update_visits_timeline
+
+UPLOAD_FOLDER = "/tmp/server_uploads/"
+EXPORTS_FOLDER = "/tmp/exports"
+PLOTS_FOLDER = "/tmp/templates"
+CHART_GROUPS_FILES = {"genotypes": "charts_per_genotype.html", "pollinators": "charts_per_pollinator.html",
+                      "evolution": "evolution_charts.html"}
+NANOSECONDS_PER_MS = 1000000
+# Asks the server for the visits of the visible range once the user stops panning or zooming, ignoring stale answers
+TIMELINE_CALLBACK_CODE = """
+clearTimeout(source.timeline_timeout);
+source.timeline_timeout = setTimeout(function () {
+    const request = source.timeline_request = (source.timeline_request || 0) + 1;
+    const parameters = new URLSearchParams({start: Math.floor(x_range.start), end: Math.ceil(x_range.end),
+                                            genotype: genotype.value});
+    fetch(url + "?" + parameters).then(response => response.json()).then(function (timeline) {
+        if (request !== source.timeline_request) { return; }
+        source.data = {dates: timeline.buckets, visits_count: timeline.visits};
+        plot.title.text = "Evolution of visits grouped by " + timeline.resolution;
+    });
+}, 250);
+"""
+PARSED_FILES_FORMAT_VERSION = 2  # increase it when the parsed dataframes change, so cached files are parsed again
+READS_STAGES = ["join", "selection", "sorting"]  # stages that don't depend on max_time_between_signals
+# Attribute with the rows produced by each stage, measured by the instrumentation
+STAGES_ROWS_ATTRIBUTES = {"join": "df_with_genotypes", "selection": "df", "sorting": "sorted_reads", "visits": "visits",
+                          "statistics": "visits_summaries"}
+
+
+class ReaderFilesError(Exception):
+    """ Raised when one or more of the uploaded reader files can't be parsed """
+
+    def __init__(self, failed_files: Dict[str, str]):
+        self.failed_files = failed_files  # file name: error message
+        super().__init__("Could not parse " + ", ".join(f"{name} ({error})" for name, error in failed_files.items()))
+
+
+def _ingest_reader_file(file_path: str, parsed_files_cache: ParsedFilesCache) -> Tuple[str, pd.DataFrame, dict]:
+    """
+    Hashes, parses and summarizes a single reader file. Module level so it can run on a worker process.
+    Scan dates and times are parsed here, once, into a "Scan Timestamp" column of epoch milliseconds.
+    Returns the hash of the file, the parsed dataframe and a summary with its antennas and dates.
+    """
+    file_hash = hash_file(file_path)
+    cached_entry = parsed_files_cache.get(file_hash)
+    if cached_entry is not None and cached_entry[1].get("format") == PARSED_FILES_FORMAT_VERSION:
+        return (file_hash, *cached_entry)
+    parsed_dataframe, dates = parse_reader_file(file_path)
+    summary = {"format": PARSED_FILES_FORMAT_VERSION,
+               "antennas": sorted(parsed_dataframe['Antenna ID'].unique().tolist()), "dates": dates}
+    parsed_files_cache.put(file_hash, parsed_dataframe, summary)
+    return file_hash, parsed_dataframe, summary
 
 
 class Pipeline:
     """ Class that includes all the functions of the ETL pipeline """
 
-    def __init__(self, excel_files: List[str]):
+    def __init__(self, excel_files: List[str], upload_folder: str = None, exports_folder: str = None):
         # Input involved in creating the initial dataframe
         self.excel_files = excel_files
+        self.upload_folder = upload_folder or UPLOAD_FOLDER
+        self.exports_folder = exports_folder or EXPORTS_FOLDER
+        self.files_hashes = None
         self.parsed_dataframes = None
         self.antennas_info = None
         self.dates_of_dfs = None
@@ -33,7 +100,11 @@ class Pipeline:
         self.list_of_good_visitors = None
         self.filter_tags_by_visited_genotypes = None
         self.visited_genotypes_required = None
+        self.visited_genotypes_mode = "all"
+        self.min_visited_genotypes = 1
         self.pollinators_to_remove = None
+        self.ttest_method = "student"
+        self.ttest_correction = "none"
         self.filter_start_datetime = None
         self.filter_end_datetime = None
         # Pipeline attributes
@@ -41,16 +112,74 @@ class Pipeline:
         self.df_with_genotypes = None
         self.genotypes_dfs = None
         self.df = None
+        self.reads_incidence = None
+        self.sorted_reads = None
+        self.visits = None
+        # Fingerprints of the inputs of each stage, to skip the stages whose inputs didn't change
+        self.stages_fingerprints = {}
+        self.run_fingerprint = None
+        # Measurements of the steps of the ingestion of the files and of the last run, shown with the results
+        self.ingestion_metrics = []
+        self.run_metrics = []
         # Parameters for results and statistics
-        self.final_joined_df = None
         self.statistics = None
         self.genotypes_names = None
+        self.visits_incidence = None
+        self.visits_summaries = None
+        self.genotypes_t_tests = None
+        self.visits_timeline = None
+
+    def preprocessing_of_data(self, parsed_files_cache: ParsedFilesCache = None, workers: int = 1):
+        """
+        Calls the excel parser function and exports the antennas and dates of each dataframe.
+        Files already parsed in a previous run (same content) are loaded from the parsed files cache instead.
+        With workers > 1, the files are parsed concurrently on a pool of processes.
+        """
+        if parsed_files_cache is None:
+            parsed_files_cache = ParsedFilesCache()
+        self.ingestion_metrics = []
+        with measure("pipeline.ingestion", self.ingestion_metrics) as measurement:
+            self.parsed_dataframes = self._excel_files_to_dataframe(parsed_files_cache, workers)
+            measurement["files"] = len(self.parsed_dataframes)
+            measurement["rows"] = sum(len(dataframe) for dataframe in self.parsed_dataframes.values())
 
-    def preprocessing_of_data(self):
-        """Calls the excel parser function and exports the antennas of each dataframe"""
-        self.parsed_dataframes = self._excel_files_to_dataframe()
-        self.antennas_info = self._export_antennas_info()
-        self.dates_of_dfs = self._export_dates_info()
+    def append_files(self, excel_files: List[str], genotypes_of_each_experiment: List[Dict[int, str]] = None,
+                     parsed_files_cache: ParsedFilesCache = None, workers: int = 1,
+                     progress_callback: Callable[[str, str], None] = None):
+        """
+        Adds new reader files (Excel or CSV) to the analysis, such as the reads downloaded during a campaign.
+        Only the new files are parsed. The antennas of each one have the genotypes of genotypes_of_each_experiment,
+        or the genotypes of the last experiment of the analysis if not given.
+        If the results of the last run are up to date, they are updated with the reads of the new files instead of
+        running the pipeline again: only the new reads, and the visits they can continue, are segmented, and the
+        statistics, timeline and results tables are updated with the visits that changed. The results are the same
+        as running the pipeline with all the files. Otherwise, the next run processes the new files with the rest.
+        progress_callback is called as in run_pipeline.
+        """
+        file_names = [str(excel_file) for excel_file in excel_files]
+        repeated_files = [file_name for file_name in file_names if file_name in self.excel_files]
+        if repeated_files:
+            raise ValueError(f"Files already in the analysis: {', '.join(repeated_files)}")
+        results_up_to_date = self._results_up_to_date()
+        if progress_callback:
+            progress_callback("ingestion", "started")
+        self.run_metrics = []
+        with measure("pipeline.ingestion", self.run_metrics) as measurement:
+            parsed_dataframes = self._parse_reader_files(file_names, parsed_files_cache or ParsedFilesCache(),
+                                                         workers)
+            measurement["files"] = len(parsed_dataframes)
+            measurement["rows"] = sum(len(dataframe) for dataframe in parsed_dataframes.values())
+        # Attributes are replaced, never changed in place, so the state store sees they changed
+        self.parsed_dataframes = {**self.parsed_dataframes, **parsed_dataframes}
+        self.excel_files = list(self.excel_files) + file_names
+        if self.genotypes_of_each_experiment is not None:
+            if genotypes_of_each_experiment is None:
+                genotypes_of_each_experiment = [self.genotypes_of_each_experiment[-1]] * len(file_names)
+            self.genotypes_of_each_experiment = self.genotypes_of_each_experiment + genotypes_of_each_experiment
+        if progress_callback:
+            progress_callback("ingestion", "finished")
+        if results_up_to_date:
+            self._append_to_results(file_names, progress_callback)
 
     def input_genotypes_data(self, genotypes_of_each_experiment: List[Dict[int, str]]):
         """Method for introducing the genotypes of each antenna"""
@@ -59,8 +188,16 @@ class Pipeline:
     def input_parameters_of_run(self, max_time_between_signals: str, round_or_truncate: str,
                                 pollinators_to_remove: List[str], filter_tags_by_visited_genotypes: str,
                                 visited_genotypes_required=None, filter_start_datetime: str = "",
-                                filter_end_datetime: str = ""):
-        """Method for introducing all the necessary parameters for the pipeline run"""
+                                filter_end_datetime: str = "", visited_genotypes_mode: str = "all",
+                                min_visited_genotypes: int = 1, ttest_method: str = "student",
+                                ttest_correction: str = "none"):
+        """
+        Method for introducing all the necessary parameters for the pipeline run.
+        When filtering by visited genotypes, visited_genotypes_mode keeps the pollinators that visited "all", "any"
+        or "at_least" min_visited_genotypes of the required genotypes.
+        The t-tests between genotypes are "student" or "welch" tests, with a ttest_correction of the p-values for
+        multiple comparisons: "none", "bonferroni", "holm" or "fdr_bh" (Benjamini-Hochberg).
+        """
         if visited_genotypes_required is None:
             visited_genotypes_required = []
         self.max_time_between_signals = int(max_time_between_signals)
@@ -69,69 +206,407 @@ class Pipeline:
         self.round_or_truncate = round_or_truncate
         self.filter_tags_by_visited_genotypes = filter_tags_by_visited_genotypes
         self.visited_genotypes_required = visited_genotypes_required
+        self.visited_genotypes_mode = visited_genotypes_mode
+        self.min_visited_genotypes = int(min_visited_genotypes)
+        self.ttest_method = ttest_method
+        self.ttest_correction = ttest_correction
         self.pollinators_to_remove = pollinators_to_remove
 
-    def run_pipeline(self):
-        """Main function of the class, runs all the pipeline steps"""
+    def run_pipeline(self, progress_callback: Callable[[str, str], None] = None):
+        """
+        Main function of the class, runs all the pipeline steps.
+        Steps are grouped in stages, and each stage is fingerprinted by its inputs: the fingerprint of the previous
+        stage and only the parameters the stage depends on. Stages whose fingerprint is the same as in the last run
+        keep their results, so a new run only recomputes the stages downstream of the parameters that changed.
+        If given, progress_callback is called with the name of each stage and "started", "finished" or "skipped".
+        """
         pd.options.mode.chained_assignment = None  # Temporary fix for SettingCopyWarning
 
+        self.run_metrics = []
         self._clean_up_cached_files()
+        fingerprint = self._run_reads_stages(progress_callback)
+        for stage_name, parameters, stage_function in self._stages():
+            if stage_name not in READS_STAGES:
+                fingerprint = self._run_stage(stage_name, fingerprint, parameters, stage_function, progress_callback)
+        self.run_fingerprint = fingerprint
+        # Exports always run, they are files of the instance and not part of the state of the pipeline.
+        # Excel, CSV and Parquet files are only written when downloaded, by export_results
+        if progress_callback:
+            progress_callback("exports", "started")
+        with measure("pipeline.exports", self.run_metrics) as measurement:
+            measurement["rows"] = self._export_results_tables()
+        if progress_callback:
+            progress_callback("exports", "finished")
+
+    def export_results(self, export_format: str) -> str:
+        """
+        Returns the path of the export of the results of the last run in a format of EXPORT_FORMATS ("xlsx", "csv"
+        or "parquet"). It is written from the results tables the first time it is requested after each run.
+        """
+        file_name, _ = EXPORT_FORMATS[export_format]
+        path = os.path.join(self.exports_folder, f"{self.run_fingerprint[:16]}_{file_name}")
+        if not os.path.isfile(path):
+            with measure(f"pipeline.export_results.{export_format}"):
+                export_results_tables(self.exports_folder, self.genotypes_names, export_format, path)
+        return path
+
+    def visits_statistics(self, genotypes: List[str] = None, tags: List[str] = None, start_day: str = None,
+                          end_day: str = None) -> dict:
+        """
+        Returns the descriptive statistics of the visits of some genotypes, pollinators (DEC Tag IDs or aliases) and
+        range of days of the last run (all of them if None), from the summaries of the visits and without
+        going through the visits again.
+        """
+        return self._durations_statistics(select_durations_summary(self.visits_summaries, genotypes, tags,
+                                                                   start_day, end_day))
+
+    @staticmethod
+    def _durations_statistics(summary: DurationsSummary) -> dict:
+        return {"visits_count": summary.count,
+                "visits_mean": round(summary.mean, 2),
+                "visits_median": summary.median,
+                "visits_mode": summary.modes,
+                "visits_std": round(summary.std, 2)}
+
+    def _stages(self) -> List[Tuple[str, list, Callable]]:
+        """ Returns the stages of the pipeline in order, with the parameters each one depends on and its function """
+        return [("join", [self.files_hashes, self.genotypes_of_each_experiment], self._join_stage),
+                ("selection", [self.pollinators_to_remove, self.filter_tags_by_visited_genotypes,
+                               self.visited_genotypes_required, self.visited_genotypes_mode,
+                               self.min_visited_genotypes], self._selection_stage),
+                ("sorting", [self.round_or_truncate, self.filter_start_datetime, self.filter_end_datetime],
+                 self._sort_reads),
+                ("visits", [self.max_time_between_signals], self._process_all_genotypes_dfs),
+                ("statistics", [self.ttest_method, self.ttest_correction], self._statistics_stage),
+                ("timeline", [], self._timeline_stage)]
+
+    def _run_reads_stages(self, progress_callback: Callable[[str, str], None] = None) -> str:
+        """ Runs the stages that prepare the sorted reads, which don't depend on max_time_between_signals """
+        fingerprint = ""
+        for stage_name, parameters, stage_function in self._stages():
+            if stage_name in READS_STAGES:
+                fingerprint = self._run_stage(stage_name, fingerprint, parameters, stage_function, progress_callback)
+        return fingerprint
+
+    def _results_up_to_date(self) -> bool:
+        """ Returns whether every stage of the last run is up to date with the files and parameters of the pipeline """
+        if self.run_fingerprint is None or getattr(self, "visits", None) is None:  # states saved before the visits
+            return False
+        fingerprint = ""
+        for stage_name, parameters, _ in self._stages():
+            fingerprint = self._stage_fingerprint(stage_name, fingerprint, parameters)
+            if self.stages_fingerprints.get(stage_name) != fingerprint:
+                return False
+        return fingerprint == self.run_fingerprint
+
+    def _append_to_results(self, file_names: List[str], progress_callback: Callable[[str, str], None] = None):
+        """
+        Updates the results of the last run with the reads of new files, running an incremental version of each
+        stage. As the files changed, every stage runs, and ends up with the fingerprint of a run with all the files.
+        If a stage fails, its fingerprint is removed, so the next run computes it (and the next ones) again.
+        """
+        appended = {"files": file_names}  # what each stage hands over to the next ones
+        appended_stages = {"join": self._append_join_stage, "selection": self._append_selection_stage,
+                           "sorting": self._append_sorting_stage, "visits": self._append_visits_stage,
+                           "statistics": self._append_statistics_stage, "timeline": self._append_timeline_stage}
+        fingerprint = ""
+        for stage_name, parameters, _ in self._stages():
+            fingerprint = self._run_stage(stage_name, fingerprint, parameters,
+                                          partial(appended_stages[stage_name], appended), progress_callback)
+        self.run_fingerprint = fingerprint
+        if progress_callback:
+            progress_callback("exports", "started")
+        with measure("pipeline.exports", self.run_metrics) as measurement:
+            if os.path.exists(self.exports_folder):
+                for entry in os.listdir(self.exports_folder):  # exports of the last run, the tables are updated below
+                    if not entry.endswith(RESULTS_TABLE_SUFFIX):
+                        os.remove(os.path.join(self.exports_folder, entry))
+            measurement["rows"] = self._export_results_tables(appended["changed_genotypes"])
+        if progress_callback:
+            progress_callback("exports", "finished")
+
+    def sweep_max_time_between_signals(self, max_times_between_signals: List[int]) -> pd.DataFrame:
+        """
+        Sensitivity analysis of the max time between signals, with the rest of the parameters of the run.
+        The reads are sorted once and only their time deltas are re-thresholded for each value, so the visits
+        of every value cost a single pass of the segmentation engine.
+        Returns a tidy table with a row for each value and genotype (plus an "All genotypes" row for each value) with
+        the same summaries as the run statistics. The visits themselves are not kept, only their summaries.
+        """
+        self._run_reads_stages()
+        summaries = []
+        with measure("pipeline.sweep") as measurement:
+            for max_time in max_times_between_signals:
+                summaries.append(self._summarize_sweep_visits(int(max_time),
+                                                              segment_visits(self.sorted_reads, int(max_time))))
+            measurement["rows"] = len(self.sorted_reads)
+        return pd.concat(summaries, ignore_index=True)
+
+    def _summarize_sweep_visits(self, max_time: int, visits: pd.DataFrame) -> pd.DataFrame:
+        """ Summarizes the visits of a single value of the sweep, per genotype and for all the genotypes """
+        genotypes = self.df['Genotype'].cat.categories
+        visits = visits.assign(Genotype=pd.Categorical.from_codes(visits['Genotype Code'].values, genotypes))
+        per_genotype = visits.groupby('Genotype', observed=False, sort=False)
+        summary = pd.concat([per_genotype.size().rename("Visits Count"),
+                             visits.drop_duplicates(['Genotype', 'Tag Code']).groupby(
+                                 'Genotype', observed=False, sort=False).size().rename("Pollinators Count"),
+                             per_genotype['Visit Duration'].agg(['mean', 'median', 'std', 'sum'])], axis=1)
+        summary.loc["All genotypes"] = [len(visits), visits['Tag Code'].nunique(), visits['Visit Duration'].mean(),
+                                        visits['Visit Duration'].median(), visits['Visit Duration'].std(),
+                                        visits['Visit Duration'].sum()]
+        summary = summary.reindex(self.genotypes_names + ["All genotypes"])
+        summary.columns = ["Visits Count", "Pollinators Count", "Visits Mean", "Visits Median", "Visits Std",
+                           "Total Duration"]
+        summary = summary.fillna({"Visits Count": 0, "Pollinators Count": 0, "Total Duration": 0})
+        summary = summary.astype({"Visits Count": "int64", "Pollinators Count": "int64"}).round(2)
+        summary.insert(0, "Genotype", summary.index)
+        summary.insert(0, "Max Time Between Signals", max_time)
+        return summary.reset_index(drop=True)
+
+    def _run_stage(self, stage_name: str, upstream_fingerprint: str, parameters: list, stage_function,
+                   progress_callback: Callable[[str, str], None] = None) -> str:
+        """ Runs a stage only if its fingerprint changed since the last run, and returns the fingerprint """
+        fingerprint = self._stage_fingerprint(stage_name, upstream_fingerprint, parameters)
+        if self.stages_fingerprints.get(stage_name) == fingerprint:
+            if progress_callback:
+                progress_callback(stage_name, "skipped")
+            return fingerprint
+        if progress_callback:
+            progress_callback(stage_name, "started")
+        self.stages_fingerprints.pop(stage_name, None)  # a failed stage must never look up to date
+        with measure(f"pipeline.{stage_name}", self.run_metrics) as measurement:
+            stage_function()
+            rows_attribute = STAGES_ROWS_ATTRIBUTES.get(stage_name)
+            if rows_attribute in vars(self):  # never downloads a stored attribute just to count its rows
+                measurement["rows"] = len(vars(self)[rows_attribute])
+        self.stages_fingerprints[stage_name] = fingerprint
+        if progress_callback:
+            progress_callback(stage_name, "finished")
+        return fingerprint
+
+    @staticmethod
+    def _stage_fingerprint(stage_name: str, upstream_fingerprint: str, parameters: list) -> str:
+        return hashlib.sha256(json.dumps([stage_name, upstream_fingerprint, parameters],
+                                         sort_keys=True, default=str).encode()).hexdigest()
+
+    def _join_stage(self):
+        """ Joins all the experiments with their genotypes and assigns the aliases """
         self._add_genotypes_and_join_df()
         self._assign_aliases_for_pollinators()
-        self.df = self.df_with_genotypes.copy()
+
+    def _selection_stage(self):
+        """ Removes the unwanted pollinators, splits the reads by genotype and obtains the good visitors """
+        self.df = self.df_with_genotypes
         self._remove_pollinators_manually(self.pollinators_to_remove)
         # Create a list of unique Tag IDs to use in other functions
         all_tag_ids = self.df['DEC Tag ID'].unique().tolist()
         # Create dataframes for each genotype
         self.genotypes_dfs = self._create_dict_of_genotypes_dfs()
-        # Create list of good visitors (Tag IDs with all the required genotypes visited)
+        self.genotypes_names = list(self.genotypes_dfs)
+        # Create list of good visitors (Tag IDs with all, any or at least k of the required genotypes visited)
         if self.filter_tags_by_visited_genotypes == "True":
             self.list_of_good_visitors = self._obtain_good_visitors(all_tag_ids, self.visited_genotypes_required)
-        # Apply all the necessary functions to the genotypes data frames
-        self.genotypes_dfs = self._process_all_genotypes_dfs()
-        self._simplify_dataframes()
+
+    def _statistics_stage(self):
+        """ Computes the statistics of the visits and keeps only the aliases of the final pollinators """
+        self.visits_incidence = build_incidence_index(self.genotypes_dfs)
+        self.visits_summaries = summarize_visits(self.genotypes_dfs)
         self._compute_descriptive_statistics()
-        self._export_dataframes_to_excel()
-        self._dataframes_to_html_tables()
         self._update_pollinator_aliases()
 
-    def _excel_files_to_dataframe(self) -> Dict[str, pd.DataFrame]:
-        """ Given a list of excel files, creates a dict with the parsed dataframes """
+    def _timeline_stage(self):
+        """ Builds the rollups of the visit counts per minute, hour and day served to the evolution charts """
+        self.visits_timeline = build_visits_timeline(self.joined_visits())
+
+    def joined_visits(self) -> pd.DataFrame:
+        """
+        Returns the visits of every genotype of the last run in a single dataframe. It is built only when needed
+        (rollups of the timeline built from scratch), the statistics come from the summaries of the visits
+        """
+        return pd.concat(list(self.genotypes_dfs.values()))
+
+    def _append_join_stage(self, appended: dict):
+        """
+        Joins the reads of the new files, with their genotypes, after the joined reads. New pollinators get the next
+        aliases, and the new Tag IDs and genotypes are added to the categories of the joined reads (Tag IDs stay
+        sorted, so the codes of the old reads change but keep their order).
+        """
+        file_names = appended["files"]
+        genotypes_of_new_files = self.genotypes_of_each_experiment[-len(file_names):]
+        new_reads = pd.concat([self.parsed_dataframes[file_name].assign(
+            Genotype=self.parsed_dataframes[file_name]["Antenna ID"].map(genotypes))
+            for file_name, genotypes in zip(file_names, genotypes_of_new_files)])
+        joined_reads = self.df_with_genotypes.drop(columns="Tag Alias")
+        # Aliases of every pollinator of the joined reads, the final aliases only keep those with visits
+        aliases = dict(zip(self.df_with_genotypes['DEC Tag ID'].cat.categories,
+                           self.df_with_genotypes['Tag Alias'].cat.categories))
+        for pollinator in new_reads['DEC Tag ID'].unique().tolist():
+            if pollinator not in aliases:
+                aliases[pollinator] = str(len(aliases) + 1)
+        tag_ids = sorted(aliases)
+        genotypes = joined_reads['Genotype'].cat.categories.tolist()
+        genotypes += [genotype for genotype in new_reads['Genotype'].dropna().unique().tolist()
+                      if genotype not in genotypes]
+        joined_reads['DEC Tag ID'] = joined_reads['DEC Tag ID'].cat.set_categories(tag_ids)
+        joined_reads['Genotype'] = joined_reads['Genotype'].cat.set_categories(genotypes)
+        new_reads['DEC Tag ID'] = pd.Categorical(new_reads['DEC Tag ID'], categories=tag_ids)
+        new_reads['Genotype'] = pd.Categorical(new_reads['Genotype'], categories=genotypes)
+        self.df_with_genotypes = pd.concat([joined_reads, new_reads])
+        self.df_with_genotypes["Tag Alias"] = self.df_with_genotypes["DEC Tag ID"].map(aliases)
+        self.pollinators_aliases = aliases
+
+    def _append_selection_stage(self, appended: dict):
+        """
+        Selects the new reads, which go after the old ones in self.df, and adds them to the incidence index of the
+        reads to update the good visitors. Good visitors can only be added: their old reads are selected too.
+        """
+        old_reads_count = len(self.df)
+        appended["genotypes"] = list(self.genotypes_dfs)
+        self.df = self.df_with_genotypes
+        self._remove_pollinators_manually(self.pollinators_to_remove)
+        new_genotypes_dfs = self._create_dict_of_genotypes_dfs(self.df.iloc[old_reads_count:])
+        self.genotypes_names = self.genotypes_names + [genotype for genotype in new_genotypes_dfs
+                                                       if genotype not in self.genotypes_names]
+        appended["reads"] = np.arange(old_reads_count, len(self.df))
+        if self.filter_tags_by_visited_genotypes == "True":
+            self.reads_incidence = self.reads_incidence.add(build_incidence_index(new_genotypes_dfs), fill_value=0)
+            self.reads_incidence = self.reads_incidence.reindex(columns=self.genotypes_names,
+                                                                fill_value=0).fillna(0).astype(np.int64)
+            good_visitors = select_visitors(self.reads_incidence, self.visited_genotypes_required,
+                                            self.visited_genotypes_mode, self.min_visited_genotypes)
+            new_good_visitors = list(good_visitors - self.list_of_good_visitors)
+            self.list_of_good_visitors = good_visitors
+            old_reads_of_new_visitors = np.flatnonzero(
+                self.df['DEC Tag ID'].values[:old_reads_count].isin(new_good_visitors))
+            appended["reads"] = np.concatenate([old_reads_of_new_visitors, appended["reads"]])
+
+    def _append_sorting_stage(self, appended: dict):
+        """
+        Inserts the new reads into the sorted reads: the sorted reads and the new ones are concatenated and sorted
+        with a stable sort, which merges them in linear time and keeps the old read of any duplicated read
+        """
+        new_positions, new_timestamps = self._select_reads(appended["reads"])
+        appended["sorted_reads"] = self.sorted_reads
+        positions = np.concatenate([self.sorted_reads["Read Position"].values, new_positions])
+        timestamps = np.concatenate([self.sorted_reads["Timestamp"].values, new_timestamps])
+        self.sorted_reads = sort_reads(self.df['Genotype'].cat.codes.values[positions],
+                                       self.df['DEC Tag ID'].cat.codes.values[positions],
+                                       timestamps, self.df['Antenna ID'].values[positions], stable=True)
+        appended["inserted_reads"] = self.sorted_reads["Read Position"].values >= len(appended["sorted_reads"])
+        self.sorted_reads["Read Position"] = positions[self.sorted_reads["Read Position"].values]
+
+    def _append_visits_stage(self, appended: dict):
+        """
+        Segments only the reads whose visits can change with the new reads (see reads_to_resegment), keeping the rest
+        of the visits of the last run. The visits added and removed by the new reads are handed over to the
+        statistics and timeline stages.
+        """
+        old_visits = drop_last_visits_of_genotypes(appended["sorted_reads"], self.visits,
+                                                   self.max_time_between_signals)
+        resegmented_reads = reads_to_resegment(self.sorted_reads, appended["inserted_reads"],
+                                               self.max_time_between_signals)
+        sorted_positions = np.zeros(len(self.df), dtype=np.int64)  # position of each read of self.df in the sorted
+        sorted_positions[self.sorted_reads["Read Position"].values] = np.arange(len(self.sorted_reads))
+        kept_visits = self.visits[~resegmented_reads[sorted_positions[self.visits["Read Position"].values]]]
+        visits = pd.concat([kept_visits, segment_visits(self.sorted_reads[resegmented_reads],
+                                                        self.max_time_between_signals, include_last_visits=True)])
+        visits = visits.iloc[np.argsort(sorted_positions[visits["Read Position"].values], kind='stable')]
+        visits["Tag Code"] = self.df['DEC Tag ID'].cat.codes.values[visits["Read Position"].values].astype(np.int64)
+        self.visits = visits.reset_index(drop=True)
+        final_visits = drop_last_visits_of_genotypes(self.sorted_reads, self.visits, self.max_time_between_signals)
+
+        visit_keys = ["Read Position", "Visit Duration"]  # a visit is identified by its last read and its duration
+        old_keys = pd.MultiIndex.from_frame(old_visits[visit_keys])
+        new_keys = pd.MultiIndex.from_frame(final_visits[visit_keys])
+        appended["added_visits"] = self._visits_dataframes(final_visits[~new_keys.isin(old_keys)])
+        appended["removed_visits"] = self._visits_dataframes(old_visits[~old_keys.isin(new_keys)])
+        appended["changed_genotypes"] = [genotype for genotype in self.genotypes_names
+                                         if genotype not in appended["genotypes"]
+                                         or len(appended["added_visits"][genotype])
+                                         or len(appended["removed_visits"][genotype])]
+        self.genotypes_dfs = self._visits_dataframes(final_visits)
+
+    def _append_statistics_stage(self, appended: dict):
+        """
+        Adds the summaries and the incidence of the added visits to those of the last run and subtracts those of the
+        removed visits, and computes the statistics from them
+        """
+        added_visits, removed_visits = appended["added_visits"], appended["removed_visits"]
+        removed_summaries = summarize_visits(removed_visits)
+        self.visits_summaries = merge_visits_summaries(self.visits_summaries, summarize_visits(added_visits),
+                                                       removed_summaries.assign(Count=-removed_summaries["Count"]))
+        visits_incidence = self.visits_incidence.add(build_incidence_index(added_visits), fill_value=0).sub(
+            build_incidence_index(removed_visits), fill_value=0)
+        visits_incidence = visits_incidence.reindex(columns=self.genotypes_names, fill_value=0).fillna(0)
+        self.visits_incidence = visits_incidence[(visits_incidence != 0).any(axis=1)].astype(np.int64)
+        self._compute_descriptive_statistics()
+        self._update_pollinator_aliases()
+
+    def _append_timeline_stage(self, appended: dict):
+        """ Adds the counts of the added visits to the timeline and subtracts those of the removed ones """
+        self.visits_timeline = update_visits_timeline(self.visits_timeline,
+                                                      pd.concat(appended["added_visits"].values()),
+                                                      pd.concat(appended["removed_visits"].values()))
+
+    def _excel_files_to_dataframe(self, parsed_files_cache: ParsedFilesCache,
+                                  workers: int = 1) -> Dict[str, pd.DataFrame]:
+        """
+        Given a list of reader files (Excel or CSV), creates a dict with the parsed dataframes, in the same order.
+        Each file is hashed first, so only files never seen by the cache are parsed.
+        The antennas and dates of each file are exported along the way, on the worker that parses it.
+        Errors are collected for every file and raised together once all of them have been processed.
+        """
+        self.files_hashes = {}
+        self.antennas_info = {}
+        self.dates_of_dfs = {}
+        return self._parse_reader_files([str(excel_file) for excel_file in self.excel_files], parsed_files_cache,
+                                        workers)
+
+    def _parse_reader_files(self, file_names: List[str], parsed_files_cache: ParsedFilesCache,
+                            workers: int = 1) -> Dict[str, pd.DataFrame]:
+        """ Parses some reader files and adds their hashes, antennas and dates to those of the pipeline """
+        file_paths = [os.path.join(self.upload_folder, file_name) for file_name in file_names]
+        results = {}
+        failed_files = {}
+        if workers > 1 and len(file_paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+                futures = {file_name: executor.submit(_ingest_reader_file, file_path, parsed_files_cache)
+                           for file_name, file_path in zip(file_names, file_paths)}
+                for file_name, future in futures.items():
+                    try:
+                        results[file_name] = future.result()
+                    except Exception as error:
+                        failed_files[file_name] = str(error)
+        else:
+            for file_name, file_path in zip(file_names, file_paths):
+                try:
+                    results[file_name] = _ingest_reader_file(file_path, parsed_files_cache)
+                except Exception as error:
+                    failed_files[file_name] = str(error)
+        if failed_files:
+            raise ReaderFilesError(failed_files)
+
         parsed_dataframes = {}
-        for excel_file in self.excel_files:
-            file_name = str(excel_file)
-            excel_path = "".join(["/tmp/server_uploads/", excel_file])
-            parsed_dataframes[file_name] = pd.read_excel(excel_path,
-                                                         usecols=["Scan Date", "Scan Time", "Antenna ID", "DEC Tag ID"],
-                                                         dtype={"Scan Date": "object", "Scan Time": "object",
-                                                                "Antenna ID": "int64", "DEC Tag ID": "object"})
+        files_hashes, antennas_info = dict(self.files_hashes), dict(self.antennas_info)
+        dates_of_dfs = dict(self.dates_of_dfs)
+        for file_name in file_names:
+            file_hash, parsed_dataframe, summary = results[file_name]
+            parsed_dataframes[file_name] = parsed_dataframe
+            files_hashes[file_name] = file_hash
+            antennas_info[file_name] = summary["antennas"]
+            dates_of_dfs[file_name] = summary["dates"]
+        self.files_hashes, self.antennas_info, self.dates_of_dfs = files_hashes, antennas_info, dates_of_dfs
         return parsed_dataframes
 
     def _clean_up_cached_files(self):
-        """Removes old files that are not going to be used on this pipeline run"""
-        if os.path.exists('/tmp/exports'):
-            for entry in os.listdir('/tmp/exports'):  # removes old html/excel files
-                os.remove(os.path.join('/tmp/exports', entry))
-        if os.path.exists('/tmp/server_uploads'):
-            for entry in os.listdir('/tmp/server_uploads'):  # removes input excel files
+        """Removes old files of this pipeline's folders that are not going to be used on this pipeline run"""
+        if os.path.exists(self.exports_folder):
+            for entry in os.listdir(self.exports_folder):  # removes old html/excel files
+                os.remove(os.path.join(self.exports_folder, entry))
+        if os.path.exists(self.upload_folder):
+            for entry in os.listdir(self.upload_folder):  # removes input excel files
                 if entry not in self.excel_files:
-                    os.remove(os.path.join('/tmp/server_uploads', entry))
-
-    def _export_antennas_info(self) -> Dict[str, List[str]]:
-        """ Exports a dict with lists of the antennas present in each dataframe """
-        antennas_of_each_dataframe = {}
-        for file_name in self.parsed_dataframes:
-            antennas = sorted(self.parsed_dataframes[file_name]['Antenna ID'].unique().tolist())
-            antennas_of_each_dataframe[file_name] = antennas
-        return antennas_of_each_dataframe
-
-    def _export_dates_info(self) -> Dict[str, List[str]]:
-        """ Exports a dict with the start and end date of each experiment """
-        dates_of_dfs = {}
-        for file_name in self.parsed_dataframes:
-            dates_of_dfs[file_name] = [self.parsed_dataframes[file_name]['Scan Date'].iloc[0],
-                                       self.parsed_dataframes[file_name]['Scan Date'].iloc[-1]]
-        return dates_of_dfs
+                    os.remove(os.path.join(self.upload_folder, entry))
 
     def _add_genotypes_column(self, dict_of_dfs: Dict[str, pd.DataFrame]):
         """
@@ -142,7 +617,7 @@ class Pipeline:
         dataframes = list(dict_of_dfs.values())
         new_dict_of_dfs = {}
         for count, (df, genotypes) in enumerate(zip(dataframes, self.genotypes_of_each_experiment)):
-            df["Genotype"] = df["Antenna ID"].map(genotypes)
+            df = df.assign(Genotype=df["Antenna ID"].map(genotypes))  # parsed dataframes are kept untouched
             name = "df_" + str(count)
             new_dict_of_dfs[name] = df
         return new_dict_of_dfs
@@ -156,192 +631,221 @@ class Pipeline:
         """
         Creates a dictionary for easier identification of the pollinators.
         Each pollinator (key) has its own integer.
+        Tag IDs, aliases and genotypes are also dictionary-encoded here, once, as categoricals: integer codes plus
+        a lookup table. The rest of the stages compare, filter and map the codes, and the strings are only decoded
+        when writing the HTML tables, the excel file and the plots.
         """
         self.pollinators_aliases = {}
         pollinators = self.df_with_genotypes['DEC Tag ID'].unique().tolist()
         for count, pollinator in enumerate(pollinators, start=1):
             self.pollinators_aliases[pollinator] = str(count)
+        # Tag IDs lookup table is sorted, so sorting by the codes is the same as sorting by the Tag IDs
+        self.df_with_genotypes['DEC Tag ID'] = pd.Categorical(self.df_with_genotypes['DEC Tag ID'],
+                                                              categories=sorted(pollinators))
         self.df_with_genotypes["Tag Alias"] = self.df_with_genotypes["DEC Tag ID"].map(self.pollinators_aliases)
+        genotypes = self.df_with_genotypes['Genotype'].dropna().unique().tolist()
+        self.df_with_genotypes['Genotype'] = pd.Categorical(self.df_with_genotypes['Genotype'], categories=genotypes)
 
     def _remove_pollinators_manually(self, pollinators_to_remove: List[str]):
         """ Given a list of pollinators (aliases), removes them completely from the main dataset """
         if pollinators_to_remove:
             self.df = self.df[~self.df['DEC Tag ID'].isin(pollinators_to_remove)]
 
-    def _create_dict_of_genotypes_dfs(self) -> Dict[str, pd.DataFrame]:
+    def _create_dict_of_genotypes_dfs(self, reads: pd.DataFrame = None) -> Dict[str, pd.DataFrame]:
         """
-        Create a dictionary with "n" dataframes, being "n" the number of different genotypes on the data.
+        Create a dictionary with "n" dataframes, being "n" the number of different genotypes on the data
+        (self.df, or the given reads).
         Each dataframe is named after the appropriate genotype.
         Structure of the returned dict is "df_genotype":pd.DataFrame
         """
-        genotypes = self.df['Genotype'].unique().tolist()
+        reads = self.df if reads is None else reads
+        genotypes = reads['Genotype'].unique().tolist()
         genotypes_data_frames = {}
         for genotype in genotypes:
-            genotype_data_frame = self.df['Genotype'] == genotype
+            genotype_data_frame = reads['Genotype'] == genotype
             genotype_name = str(genotype)
-            genotypes_data_frames[genotype_name] = self.df[genotype_data_frame]
+            genotypes_data_frames[genotype_name] = reads[genotype_data_frame]
         return genotypes_data_frames
 
     def _obtain_good_visitors(self, all_tag_ids: List[str], genotypes_required: List[str]) -> set:
         """
-        Creates and returns a set that includes only those Tag IDs that have visited the desired genotypes.
-        Takes the list of Tag IDs and the list of genotypes dataframes as arguments,
-        and iterates over the Tag IDs list, checking if each Tag ID is present on each dataframe.
+        Creates and returns a set that includes only those Tag IDs that have visited the desired genotypes
+        (all of them, any of them or at least min_visited_genotypes, depending on visited_genotypes_mode).
+        The reads of each Tag ID on each genotype are counted once in a tag × genotype incidence index, and the
+        visitors are selected with a single reduction of its rows. The index is kept, to add the reads of new files.
         """
-        good_visitors = set()
-        for tag_id in all_tag_ids:
-            is_visitor_in_df = []
-            for genotype_name in genotypes_required:
-                is_visitor_in_df.append(tag_id in self.genotypes_dfs[genotype_name]["DEC Tag ID"].values)
-            if all(is_visitor_in_df):  # if all elements are True, it's a "good" visitor
-                good_visitors.add(tag_id)
-        return good_visitors
+        self.reads_incidence = build_incidence_index(self.genotypes_dfs)
+        good_visitors = select_visitors(self.reads_incidence, genotypes_required, self.visited_genotypes_mode,
+                                        self.min_visited_genotypes)
+        return good_visitors.intersection(all_tag_ids)
 
-    def _process_all_genotypes_dfs(self) -> Dict[str, pd.DataFrame]:
-        """ Apply all the different functions to each genotype dataframe """
-        for genotype_key, genotype_df in self.genotypes_dfs.items():
-
-            # Filter dataframe values by removing those "not good" tag IDs
-            if self.filter_tags_by_visited_genotypes == "True":
-                genotype_df = genotype_df[genotype_df['DEC Tag ID'].isin(self.list_of_good_visitors)]
-            # Parse scan dates and times manually after reading the Excel file
-            genotype_df['Scan Date and Time'] = pd.to_datetime(genotype_df['Scan Date'] + ' '
-                                                               + genotype_df['Scan Time'],
-                                                               format="%d/%m/%Y %H:%M:%S.%f")
-            if self.round_or_truncate == "round":
-                genotype_df["Scan Date and Time"] = self._round_milliseconds("Scan Date and Time", genotype_df)
-            elif self.round_or_truncate == "truncate":
-                genotype_df["Scan Date and Time"] = self._truncate_milliseconds("Scan Date and Time", genotype_df)
-            # Filter all data by date (start and end)
-            if self.filter_start_datetime != "" and self.filter_end_datetime != "":
-                genotype_df = genotype_df[(genotype_df["Scan Date and Time"] >= self.filter_start_datetime)
-                                          & (genotype_df["Scan Date and Time"] <= self.filter_end_datetime)]
-            # Remove unused columns before removing duplicates
-            genotype_df = genotype_df.drop(columns=['Scan Date', 'Scan Time'])
-            genotype_df = genotype_df.drop_duplicates()
-            genotype_df = self._calculate_visit_duration(genotype_df)
-            self.genotypes_dfs[genotype_key] = genotype_df
+    def _sort_reads(self):
+        """
+        Selects the reads used for the visits and sorts the reads of every genotype at once.
+        Removes the "not good" Tag IDs, rounds or truncates the timestamps and filters them by date.
+        The positions of the sorted reads point to the rows of self.df.
+        """
+        selected_positions, timestamps = self._select_reads(np.arange(len(self.df)))
+        self.sorted_reads = sort_reads(self.df['Genotype'].cat.codes.values[selected_positions],
+                                       self.df['DEC Tag ID'].cat.codes.values[selected_positions],
+                                       timestamps, self.df['Antenna ID'].values[selected_positions])
+        self.sorted_reads["Read Position"] = selected_positions[self.sorted_reads["Read Position"].values]
 
-        return self.genotypes_dfs
+    def _select_reads(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns which of some reads (positions of self.df) are used for the visits, and their timestamps
+        """
+        selected_reads = np.ones(len(positions), dtype=bool)
+        # Filter dataframe values by removing those "not good" tag IDs
+        if self.filter_tags_by_visited_genotypes == "True":
+            selected_reads &= self.df['DEC Tag ID'].values[positions].isin(list(self.list_of_good_visitors))
+        # Timestamps were parsed on ingestion as epoch milliseconds, so rounding and filtering are integer arithmetic
+        timestamps = pd.DataFrame({"Scan Timestamp": self.df["Scan Timestamp"].values[positions]})
+        if self.round_or_truncate == "round":
+            self._round_milliseconds("Scan Timestamp", timestamps)
+        elif self.round_or_truncate == "truncate":
+            self._truncate_milliseconds("Scan Timestamp", timestamps)
+        timestamps = timestamps["Scan Timestamp"].values
+        # Filter all data by date (start and end)
+        if self.filter_start_datetime != "" and self.filter_end_datetime != "":
+            selected_reads &= ((timestamps >= pd.Timestamp(self.filter_start_datetime).value // NANOSECONDS_PER_MS)
+                               & (timestamps <= pd.Timestamp(self.filter_end_datetime).value // NANOSECONDS_PER_MS))
+        return positions[selected_reads], timestamps[selected_reads]
 
-    def _simplify_dataframes(self):
+    def _process_all_genotypes_dfs(self) -> Dict[str, pd.DataFrame]:
         """
-        Removes Time Delta column and leaves only the final rows where Visit duration is > 0
+        Calculates the visits of every genotype at once, with a single pass of the segmentation engine
+        over the sorted reads, and splits the resulting visits into a dataframe for each genotype.
         The final structure of each dataframe is:
-        Antenna ID | Tag ID | Scan Date and time | Visit Duration
-        """
-        # TODO solve problem: scan time should be the first or the last signal?
-        for genotype_key in self.genotypes_dfs:
-            self.genotypes_dfs[genotype_key].dropna(inplace=True)
-            self.genotypes_dfs[genotype_key].drop(columns='Time Delta', inplace=True)
-            self.genotypes_dfs[genotype_key] = self.genotypes_dfs[genotype_key][
-                self.genotypes_dfs[genotype_key]['Visit Duration'] != 0]
-
-    def _calculate_visit_duration(self, genotype_df: pd.DataFrame) -> pd.DataFrame:
-        """ Calculates the duration of the visits of pollinators in each genotype """
-        # Sort using DEC Tag ID so time delta is correctly calculated
-        genotype_df = genotype_df.sort_values(by=['DEC Tag ID', 'Scan Date and Time'])
-        # Calculate time delta by subtracting "Scan Time" rows
-        genotype_df['Time Delta'] = (genotype_df['Scan Date and Time'] -
-                                     genotype_df['Scan Date and Time'].shift(1)).astype('timedelta64[s]')
-        # Calculate which individual visits are valid and their durations
-        # It has to be the same Tag ID and a visit between 1 and the desired number of seconds
-        genotype_df['Valid Visits'] = 0
-        genotype_df['Valid Visits'] = np.where((genotype_df['Time Delta'] > 0) &
-                                               (genotype_df['Time Delta'] <= self.max_time_between_signals) &
-                                               (genotype_df['DEC Tag ID'] == genotype_df['DEC Tag ID'].shift(1)),
-                                               genotype_df['Time Delta'], 0)
-        # Stopper: 1 when the running summation has to stop
-        genotype_df['Visit Stopper'] = np.where(genotype_df['Valid Visits'] == 0, 1, 0)
-        # Sum the duration of the individual visits to find the total
-        sum_duration = genotype_df.groupby(genotype_df['Visit Stopper'].shift(fill_value=0)
-                                           .cumsum())['Valid Visits'].transform('sum')
-        genotype_df['Visit Duration'] = np.where(genotype_df['Visit Stopper'] == 1, sum_duration, 0)
-        # Shift up al rows so the visit duration is in line with the correct Tag ID
-        genotype_df['Visit Duration'] = genotype_df['Visit Duration'].shift(-1)
-        # Drop unnecessary columns used for the calculations only
-        genotype_df.drop(columns=['Valid Visits', 'Visit Stopper'], inplace=True)
-
-        return genotype_df
+        Antenna ID | Tag ID | Genotype | Tag Alias | Scan Date and time | Visit Duration
+        """
+        # All the visits are kept, so the last visit of each genotype can be continued by the reads of new files
+        self.visits = segment_visits(self.sorted_reads, self.max_time_between_signals, include_last_visits=True)
+        self.genotypes_dfs = self._visits_dataframes(drop_last_visits_of_genotypes(
+            self.sorted_reads, self.visits, self.max_time_between_signals))
+        return self.genotypes_dfs
+
+    def _visits_dataframes(self, visits: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """ Returns a dataframe with the visits of each genotype, with the rows of self.df of their last reads """
+        visits_df = self.df.iloc[visits['Read Position'].values].drop(columns='Scan Timestamp')
+        # Timestamps are decoded back to dates only for the visits, at the edge of the pipeline
+        visits_df['Scan Date and Time'] = pd.to_datetime(visits['Timestamp'].values, unit='ms')
+        visits_df['Visit Duration'] = visits['Visit Duration'].values
+        # Visits are sorted by genotype, so each genotype is a contiguous slice of the visits
+        genotype_codes = visits['Genotype Code'].values
+        categories = self.df['Genotype'].cat.categories
+        genotypes_dfs = {}
+        for genotype_key in self.genotypes_names:
+            start, end = 0, 0
+            if genotype_key in categories:
+                code = categories.get_loc(genotype_key)
+                start, end = np.searchsorted(genotype_codes, [code, code + 1])
+            genotypes_dfs[genotype_key] = visits_df.iloc[start:end]
+        return genotypes_dfs
 
     def _compute_descriptive_statistics(self):
-        """ Returns a list of descriptive stats about the data frames """
-        dataframes = list(self.genotypes_dfs.values())
-        self.final_joined_df = pd.concat(dataframes)
+        """
+        Returns a list of descriptive stats about the data frames.
+        Every statistic comes from the accumulators of the visits, never from the visits themselves: the summary of
+        the durations of each genotype, the statistics of all the visits (those of visits_statistics, from the
+        summaries of the visits) and the incidence index.
+        """
+        summaries = dict(tuple(self.visits_summaries.groupby('Genotype', sort=False)))
+        genotypes_summaries = {genotype: DurationsSummary(summaries[genotype]['Visit Duration'].values,
+                                                          summaries[genotype]['Count'].values)
+                               if genotype in summaries else DurationsSummary() for genotype in self.genotypes_dfs}
         self.statistics = {"genotypes_count": len(self.genotypes_dfs),
-                           "pollinators_count": len(self.final_joined_df['DEC Tag ID'].unique()),
-                           "visits_count": len(self.final_joined_df),
-                           "visits_mean": round(self.final_joined_df["Visit Duration"].mean(), 2),
-                           "visits_median": self.final_joined_df["Visit Duration"].median(),
-                           "visits_mode": self.final_joined_df["Visit Duration"].mode().values.tolist(),
-                           "visits_std": round(self.final_joined_df["Visit Duration"].std(), 2),
-                           "ttest_genotypes": self._test_difference_means(),
-                           "outliers": self._detect_outliers()}
-
-    def _export_dataframes_to_excel(self):
-        """ Exports the current genotypes_dfs to an excel file with a sheet for each dataframe """
-        if not os.path.exists('/tmp/exports'):
-            os.mkdir('/tmp/exports')
-        with pd.ExcelWriter('/tmp/exports/genotypes.xlsx') as writer:
-            for genotype_key in self.genotypes_dfs:
-                self.genotypes_dfs[genotype_key].to_excel(writer, sheet_name=genotype_key, index=False)
-
-    def _dataframes_to_html_tables(self):
-        """ Exports each dataframe to a simple HTML table """
+                           "pollinators_count": len(self.visits_incidence),
+                           "pollinators_per_genotype": (self.visits_incidence > 0).sum().to_dict(),
+                           **self.visits_statistics(),
+                           "ttest_genotypes": self._test_difference_means(genotypes_summaries),
+                           "outliers": self._detect_outliers(DurationsSummary.merge_all(genotypes_summaries.values()))}
+
+    def _export_results_tables(self, genotypes_names: List[str] = None) -> int:
+        """
+        Exports each dataframe (or those of genotypes_names) to a memory-mapped Arrow file, from which the results
+        tables are served page by page. Returns the number of rows written.
+        """
+        os.makedirs(self.exports_folder, exist_ok=True)
         self.genotypes_names = []
+        rows_written = 0
         for name in self.genotypes_dfs:
-            html = self.genotypes_dfs[name].to_html(index=False)
+            if genotypes_names is None or name in genotypes_names:
+                write_results_table(self.genotypes_dfs[name], results_table_path(self.exports_folder, name))
+                rows_written += len(self.genotypes_dfs[name])
             self.genotypes_names.append(name)
-            with open("/tmp/exports/" + name + "_table.html", "w+") as file_handler:
-                file_handler.write(html)
+        return rows_written
 
-    def _detect_outliers(self) -> Dict[str, int]:
+    def _detect_outliers(self, visits_summary: DurationsSummary) -> Dict[str, int]:
         """
         Detects outliers in the whole dat by using the IQR method.
         Computes the Q1 and Q3 and extracts those visits out of that range.
         Then fetches the pollinators accountable for those visits and returns them as a dict.
+        Both are obtained from the summaries of the visits: the summary of all of them for the quartiles, and the
+        counts of each duration of each pollinator for the outliers.
         """
-        q1 = self.final_joined_df['Visit Duration'].quantile(0.25)
-        q3 = self.final_joined_df['Visit Duration'].quantile(0.75)
+        q1 = visits_summary.quantile(0.25)
+        q3 = visits_summary.quantile(0.75)
         iqr = q3 - q1
-        outliers_series = (self.final_joined_df['Visit Duration'] < (q1 - 1.5 * iqr)) | (
-                self.final_joined_df['Visit Duration'] > (q3 + 1.5 * iqr))
+        durations = self.visits_summaries['Visit Duration']
+        outliers_series = (durations < (q1 - 1.5 * iqr)) | (durations > (q3 + 1.5 * iqr))
 
-        pollinators_series = self.final_joined_df.loc[outliers_series.values]["Tag Alias"]
-        outlier_pollinators = pollinators_series.value_counts().to_dict()
+        outliers_count = self.visits_summaries[outliers_series].groupby('Tag Alias')['Count'].sum()
+        outlier_pollinators = outliers_count.sort_values(ascending=False, kind='stable').to_dict()
         return outlier_pollinators
 
-    def _test_difference_means(self) -> Dict[str, List[float]]:
+    def _test_difference_means(self, genotypes_summaries: Dict[str, DurationsSummary]) -> Dict[str, List[float]]:
         """
         Computes a t-test (difference between means) between each possible pair of genotypes,
         using the average visit duration of the df.
+        All the tests are computed at once from the count, mean and variance of each genotype, taken from the
+        summaries of its durations, and are kept as genotype × genotype matrices of t statistics and p-values in
+        genotypes_t_tests. Returns the rounded [t, p] of each pair that could be tested.
         """
-        ttest_results = {}
-        for genotype, genotype2 in itertools.combinations(self.genotypes_dfs.keys(), 2):
-            result = [round(num, 3) for num in list(  # round t-test results
-                ttest_ind(self.genotypes_dfs[genotype]["Visit Duration"],
-                          self.genotypes_dfs[genotype2]["Visit Duration"]))]  # genotype is compared with the rest
-            if not math.isnan(result[0]):  # save the result only if not NaN
-                ttest_results[genotype + " and " + genotype2] = result
-        return ttest_results
+        self.genotypes_t_tests = pairwise_t_tests(summaries_statistics(genotypes_summaries), self.ttest_method,
+                                                  self.ttest_correction)
+        return t_tests_to_dict(self.genotypes_t_tests)
 
     def _update_pollinator_aliases(self):
-        final_pollinators = self.final_joined_df["DEC Tag ID"].unique().tolist()
-        new_dict = {alias: self.pollinators_aliases[alias] for alias in final_pollinators}
-        self.pollinators_aliases = new_dict
+        """
+        Keeps only the aliases of the pollinators present in the final data: the tags of the incidence index of the
+        visits, in order of appearance, with the aliases of the summaries of their visits
+        """
+        final_pollinators = self.visits_summaries[["DEC Tag ID", "Tag Alias"]].drop_duplicates("DEC Tag ID")
+        aliases = dict(zip(final_pollinators["DEC Tag ID"], final_pollinators["Tag Alias"]))
+        self.pollinators_aliases = {tag: aliases[str(tag)] for tag in self.visits_incidence.index}
 
     @staticmethod
-    def _round_milliseconds(column: str, dataframe: pd.DataFrame) -> pd.DataFrame:
-        """ Rounds milliseconds on the desired column """
-        dataframe[column] = dataframe[column].dt.round('1s')
+    def _round_milliseconds(column: str, dataframe: pd.DataFrame) -> pd.Series:
+        """
+        Rounds milliseconds on the desired column (epoch milliseconds or datetimes) with integer arithmetic.
+        Halves are rounded to the even second, as pandas does.
+        """
+        def round_to_seconds(milliseconds: np.ndarray) -> np.ndarray:
+            seconds, remainder = np.divmod(milliseconds, MILLISECONDS_PER_SECOND)
+            seconds += (remainder > 500) | ((remainder == 500) & (seconds % 2 == 1))
+            return seconds * MILLISECONDS_PER_SECOND
+
+        dataframe[column] = Pipeline._apply_to_epoch_milliseconds(round_to_seconds, dataframe[column])
         return dataframe[column]
 
     @staticmethod
-    def _truncate_milliseconds(column: str, dataframe: pd.DataFrame) -> pd.DataFrame:
-        """ Truncates milliseconds on the desired column """
-        dataframe[column] = dataframe[column].astype('datetime64[s]')
+    def _truncate_milliseconds(column: str, dataframe: pd.DataFrame) -> pd.Series:
+        """ Truncates milliseconds on the desired column (epoch milliseconds or datetimes) with integer arithmetic """
+        def truncate_to_seconds(milliseconds: np.ndarray) -> np.ndarray:
+            return milliseconds // MILLISECONDS_PER_SECOND * MILLISECONDS_PER_SECOND
+
+        dataframe[column] = Pipeline._apply_to_epoch_milliseconds(truncate_to_seconds, dataframe[column])
         return dataframe[column]
 
+    @staticmethod
+    def _apply_to_epoch_milliseconds(function, series: pd.Series) -> np.ndarray:
+        """ Applies an integer function to a column of epoch milliseconds, converting datetime columns if needed """
+        if pd.api.types.is_datetime64_any_dtype(series):
+            milliseconds = series.values.astype('datetime64[ms]').view('int64')
+            return function(milliseconds).astype('datetime64[ms]').astype('datetime64[ns]')
+        return function(series.values)
+
 
 class Plot:
     """
@@ -349,48 +853,70 @@ class Plot:
     Is this collection of methods, Bokeh is used to generate HTML plots that are later included in the Flask app.
     """
 
-    def __init__(self, genotypes_dfs: Dict[str, pd.DataFrame]):
+    def __init__(self, genotypes_dfs: Dict[str, pd.DataFrame], plots_folder: str = PLOTS_FOLDER,
+                 visits_timeline: Dict[str, pd.DataFrame] = None, timeline_url: str = None,
+                 genotypes_t_tests: Dict[str, pd.DataFrame] = None):
         # Input for creating the initial dataframe
         self.genotypes_dfs = genotypes_dfs
+        self.plots_folder = plots_folder
+        # Rollups of the visit counts of the run (built from the visits if not given) and the URL that serves them
+        self.visits_timeline = visits_timeline
+        self.timeline_url = timeline_url
+        # Matrices of t statistics and p-values of the pipeline, shown as a heatmap if given
+        self.genotypes_t_tests = genotypes_t_tests
         dataframes = list(self.genotypes_dfs.values())
         self.final_joined_df = pd.concat(dataframes)
+        # Pollinators and genotypes with visits, in order of appearance
+        self.pollinators = self.final_joined_df['Tag Alias'].unique().tolist()
+        self.genotypes = self.final_joined_df['Genotype'].unique().tolist()
+        # Count and sum of the visit durations of each pollinator on each genotype, with a single grouped reduction.
+        # Every chart per genotype or per pollinator is aggregated from this cube instead of filtering the visits
+        cube = self.final_joined_df.groupby(['Tag Alias', 'Genotype'], observed=True)['Visit Duration'].agg(
+            ['count', 'sum'])
+        self.visits_count_cube = cube['count'].unstack(fill_value=0).reindex(
+            index=self.pollinators, columns=self.genotypes, fill_value=0)
+        self.visits_sum_cube = cube['sum'].unstack(fill_value=0).reindex(
+            index=self.pollinators, columns=self.genotypes, fill_value=0)
 
     def lay_out_plots_to_html(self):
         """ Saves all the plots generated in this Class to different HTML file with a certain layout"""
-        html = file_html(layout([
-            [self._plot_visit_count_per_genotype()],
-            [self._plot_visit_duration_cumsum_per_genotype()],
-            [self._plot_average_visit_duration_per_genotype()]
-        ]), CDN)
-        with open("/tmp/templates/charts_per_genotype.html", "w+") as file_handler:
-            file_handler.write("{% raw %}")  # avoid Jinja2 having problems with bokeh date formatters as "{%H"
-            file_handler.write(html)
-            file_handler.write("{% endraw %}")
-        html = file_html(layout([
-            [self._plot_visit_count_per_pollinator()],
-            [self._plot_visit_duration_cumsum_per_pollinator()],
-            [self._plot_average_visit_duration_per_pollinator()]
-        ]), CDN)
-        with open("/tmp/templates/charts_per_pollinator.html", "w+") as file_handler:
-            file_handler.write("{% raw %}")
-            file_handler.write(html)
-            file_handler.write("{% endraw %}")
-        html = file_html(layout([
-            [self._plot_visit_evolution_per_hour()],
-            [self._plot_visit_evolution_per_day()]
-        ]), CDN)
-        with open("/tmp/templates/evolution_charts.html", "w+") as file_handler:
-            file_handler.write("{% raw %}")
-            file_handler.write(html)
-            file_handler.write("{% endraw %}")
+        for group, file_name in CHART_GROUPS_FILES.items():
+            with measure(f"plot.lay_out_plots_to_html.{group}") as measurement:
+                html = file_html(self._lay_out_chart_group(group), CDN)
+                with open(os.path.join(self.plots_folder, file_name), "w+") as file_handler:
+                    file_handler.write("{% raw %}")  # avoid Jinja2 having problems with bokeh date formatters as "{%H"
+                    file_handler.write(html)
+                    file_handler.write("{% endraw %}")
+                measurement["rows"] = len(self.final_joined_df)
+
+    def chart_group_to_json(self, group: str) -> str:
+        """
+        Returns the layout of a group of charts as a Bokeh JSON item, so pages can embed it with BokehJS.
+        Only the charts of that group are built.
+        """
+        with measure(f"plot.chart_group_to_json.{group}") as measurement:
+            chart_json = json.dumps(json_item(self._lay_out_chart_group(group)))
+            measurement["rows"] = len(self.final_joined_df)
+        return chart_json
+
+    def _lay_out_chart_group(self, group: str):
+        """ Returns the layout of the charts of a group: "genotypes", "pollinators" or "evolution" """
+        chart_groups = {"genotypes": [self._plot_visit_count_per_genotype,
+                                      self._plot_visit_duration_cumsum_per_genotype,
+                                      self._plot_average_visit_duration_per_genotype],
+                        "pollinators": [self._plot_visit_count_per_pollinator,
+                                        self._plot_visit_duration_cumsum_per_pollinator,
+                                        self._plot_average_visit_duration_per_pollinator],
+                        "evolution": [self._plot_visit_evolution_per_hour,
+                                      self._plot_visit_evolution_per_day]}
+        if self.genotypes_t_tests is not None:
+            chart_groups["genotypes"].append(self._plot_t_tests_p_values)
+        return layout([[plot_chart()] for plot_chart in chart_groups[group]])
 
     def _plot_visit_count_per_genotype(self):
         """ Returns a plot with the total number visits for each genotype """
-        genotypes = []
-        visits = []
-        for name in self.genotypes_dfs:
-            genotypes.append(name)
-            visits.append(len(self.genotypes_dfs[name]))
+        genotypes = list(self.genotypes_dfs)
+        visits = self.visits_count_cube.sum().reindex(genotypes, fill_value=0).tolist()
         data = {'genotypes': genotypes,
                 'visits': visits,
                 'color': viridis(len(genotypes))}  # TODO palette limited to 256 colors. Need to cycle
@@ -411,18 +937,12 @@ class Plot:
 
     def _plot_visit_duration_cumsum_per_genotype(self):
         """ Returns a plot with the total duration of all visits for each genotype """
-        pollinators = self.final_joined_df['Tag Alias'].unique().tolist()
-        genotypes = self.final_joined_df['Genotype'].unique().tolist()
+        pollinators = self.pollinators
+        genotypes = self.genotypes
         data = {"genotypes": genotypes}
         colors = list(viridis(len(pollinators)))
         for pollinator in pollinators:
-            list_of_data = []
-            for genotype in genotypes:
-                series_for_sum = self.final_joined_df[
-                    self.final_joined_df['Tag Alias'] == pollinator]  # filter by pollinator
-                series_for_sum = series_for_sum[series_for_sum["Genotype"] == genotype]  # filter by genotype
-                list_of_data.append(series_for_sum["Visit Duration"].sum())  # sum all the values of that set
-            data[pollinator] = list_of_data
+            data[pollinator] = self.visits_sum_cube.loc[pollinator].tolist()  # total of each genotype
         plot = figure(x_range=genotypes, plot_height=400, title="Total duration (sum) of all visits per genotype",
                       tools="pan, wheel_zoom, box_zoom, reset, save", tooltips="Pollinator $name: @$name sec",
                       toolbar_sticky=False, margin=(15, 0, 15, 0))
@@ -440,11 +960,10 @@ class Plot:
 
     def _plot_average_visit_duration_per_genotype(self):
         """ Returns a plot with the average visit duration for each genotype """
-        genotypes = []
-        means = []
-        for name in self.genotypes_dfs:
-            genotypes.append(name)
-            means.append(round(self.genotypes_dfs[name]["Visit Duration"].mean(), 2))
+        genotypes = list(self.genotypes_dfs)
+        sums = self.visits_sum_cube.sum().reindex(genotypes)
+        counts = self.visits_count_cube.sum().reindex(genotypes)
+        means = [round(mean, 2) for mean in (sums / counts).tolist()]  # NaN for genotypes without visits
         data = {'genotypes': genotypes,
                 'means': means,
                 'color': viridis(len(genotypes))}
@@ -463,13 +982,35 @@ class Plot:
         plot.yaxis.axis_label = "Average visit duration"
         return plot
 
+    def _plot_t_tests_p_values(self):
+        """ Returns a heatmap with the p-value of the t-test between the visit durations of each pair of genotypes """
+        p_values = self.genotypes_t_tests["p"]
+        t_statistics = self.genotypes_t_tests["t"]
+        genotypes = [str(genotype) for genotype in p_values.index]
+        data = {'genotypes_x': [genotype for _ in genotypes for genotype in genotypes],
+                'genotypes_y': [genotype for genotype in genotypes for _ in genotypes],
+                'p_values': p_values.values.round(3).ravel().tolist(),
+                't_statistics': t_statistics.values.round(3).ravel().tolist()}
+        source = ColumnDataSource(data=data)
+        color_mapper = LinearColorMapper(palette=viridis(256), low=0, high=1, nan_color="#f0f0f0")
+        plot = figure(x_range=genotypes, y_range=list(reversed(genotypes)), plot_height=400,
+                      title="p-value of the t-test between the average visit duration of each pair of genotypes",
+                      tools="pan, wheel_zoom, box_zoom, reset, save",
+                      tooltips=[("Genotypes", "@genotypes_y and @genotypes_x"), ("T-statistic", "@t_statistics"),
+                                ("p value", "@p_values")], toolbar_sticky=False, margin=(15, 0, 15, 0))
+        plot.rect(x="genotypes_x", y="genotypes_y", width=1, height=1, source=source, line_color=None,
+                  fill_color={'field': 'p_values', 'transform': color_mapper})
+        plot.add_layout(ColorBar(color_mapper=color_mapper, title="p value"), 'right')
+        plot.grid.grid_line_color = None
+        plot.axis.axis_line_color = None
+        plot.xaxis.major_label_orientation = pi / 4
+        plot.toolbar.logo = None
+        return plot
+
     def _plot_visit_count_per_pollinator(self):
         """Returns a plot with the total number visits of each pollinator"""
-        pollinators = self.final_joined_df['Tag Alias'].unique().tolist()
-        visits = []
-        for pollinator in pollinators:
-            series_for_count = self.final_joined_df[self.final_joined_df['Tag Alias'] == pollinator]
-            visits.append(len(series_for_count["Visit Duration"]))
+        pollinators = self.pollinators
+        visits = self.visits_count_cube.sum(axis=1).tolist()
         data = {'pollinators': pollinators,
                 'visits': visits,
                 'color': viridis(len(pollinators))}
@@ -490,11 +1031,9 @@ class Plot:
 
     def _plot_average_visit_duration_per_pollinator(self):
         """ Returns a plot with the average visit duration for each pollinator """
-        pollinators = self.final_joined_df['Tag Alias'].unique().tolist()
-        means = []
-        for pollinator in pollinators:
-            series_for_mean = self.final_joined_df[self.final_joined_df['Tag Alias'] == pollinator]
-            means.append(round(series_for_mean["Visit Duration"].mean(), 2))
+        pollinators = self.pollinators
+        means = [round(mean, 2) for mean in
+                 (self.visits_sum_cube.sum(axis=1) / self.visits_count_cube.sum(axis=1)).tolist()]
         data = {'pollinators': pollinators,
                 'means': means,
                 'color': viridis(len(pollinators))}
@@ -514,18 +1053,12 @@ class Plot:
 
     def _plot_visit_duration_cumsum_per_pollinator(self):
         """ Returns a plot with the sum of all visit durations for each pollinator """
-        pollinators = self.final_joined_df['Tag Alias'].unique().tolist()
-        genotypes = self.final_joined_df['Genotype'].unique().tolist()
+        pollinators = self.pollinators
+        genotypes = self.genotypes
         data = {"pollinators": pollinators}
         colors = list(viridis(len(genotypes)))
         for genotype in genotypes:
-            list_of_data = []
-            for pollinator in pollinators:
-                series_for_sum = self.final_joined_df[
-                    self.final_joined_df['Tag Alias'] == pollinator]  # filter by pollinator
-                series_for_sum = series_for_sum[series_for_sum["Genotype"] == genotype]  # filter by genotype
-                list_of_data.append(series_for_sum["Visit Duration"].sum())  # sum all the values of that  set
-            data[genotype] = list_of_data
+            data[genotype] = self.visits_sum_cube[genotype].tolist()  # total of each pollinator
         plot = figure(x_range=pollinators, plot_height=400, title="Total duration (sum) of all visits per pollinator",
                       tools="pan, wheel_zoom, box_zoom, reset, save", tooltips="@pollinators on $name: @$name sec",
                       toolbar_sticky=False, margin=(15, 0, 15, 0))
@@ -544,43 +1077,58 @@ class Plot:
         plot.yaxis.axis_label = "Total time visiting"
         return plot
 
+    def _get_visits_timeline(self) -> Dict[str, pd.DataFrame]:
+        """ Returns the rollups of the visit counts, building them from the visits the first time if not given """
+        if self.visits_timeline is None:
+            self.visits_timeline = build_visits_timeline(self.final_joined_df)
+        return self.visits_timeline
+
     def _plot_visit_evolution_per_hour(self):
-        """ Returns a plot with the evolution of number of visits per hour """
-        sorted_df = self.final_joined_df.sort_values(by=['Scan Date and Time'])
-        datetime_df = sorted_df.resample('H', on='Scan Date and Time').count()
-        datetime_df["visits_count"] = datetime_df["Visit Duration"]
-        datetime_df = datetime_df[['visits_count']]
-        x = datetime_df.index
-        y = datetime_df["visits_count"]
-        data = {'dates': x,
-                'visits_count': y}
+        """
+        Returns a zoomable plot with the evolution of the number of visits, at the finest resolution (minute, hour
+        or day) that keeps the chart under a bounded number of points.
+        With a timeline_url, the visits of the visible range are requested again as the user pans and zooms, so the
+        resolution follows the zoom, and the visits of a single genotype can be selected.
+        """
+        timeline = select_timeline_range(self._get_visits_timeline())
+        data = {'dates': timeline["buckets"],
+                'visits_count': timeline["visits"]}
         source = ColumnDataSource(data=data)
         custom_tooltips = HoverTool(
-            tooltips=[('Date', '@dates{%d/%m/%Y}'), ('Time', '@dates{%H:00 - %H:59}'),
-                      ('Visits this hour', '@visits_count')],
+            tooltips=[('Date', '@dates{%d/%m/%Y}'), ('Time', '@dates{%H:%M}'), ('Visits', '@visits_count')],
             formatters={'@dates': 'datetime'},
             mode='vline',
         )
-        plot = figure(plot_height=400, x_axis_type="datetime", title="Evolution of visits grouped by hour",
-                      tools=[custom_tooltips, "pan, wheel_zoom, box_zoom, reset, save"], toolbar_sticky=False,
+        plot = figure(plot_height=400, x_axis_type="datetime",
+                      title=f"Evolution of visits grouped by {timeline['resolution']}",
+                      tools=[custom_tooltips, "pan, xwheel_zoom, box_zoom, reset, save"], toolbar_sticky=False,
                       margin=(30, 0, 30, 0))
         plot.line(x='dates', y='visits_count', line_width=2, line_color="#168756", source=source)
         plot.xaxis.axis_label = "Date & time"
         plot.yaxis.axis_label = "Number of visits"
         plot.xaxis.formatter = DatetimeTickFormatter(days="%e/%m")
         plot.toolbar.logo = None
-        return plot
+        if not timeline["buckets"]:
+            return plot
+        # A fixed x range, so it is only moved by the user and not by the new data of each request
+        plot.x_range = Range1d(start=timeline["buckets"][0],
+                               end=timeline["buckets"][-1] + timeline["bucket_milliseconds"])
+        if self.timeline_url is None:
+            return plot
+        genotype = Select(title="Genotype", value=ALL_GENOTYPES, options=[ALL_GENOTYPES] + list(self.genotypes_dfs),
+                          width=250)
+        request_visits = CustomJS(args=dict(source=source, plot=plot, x_range=plot.x_range, genotype=genotype,
+                                            url=self.timeline_url), code=TIMELINE_CALLBACK_CODE)
+        plot.x_range.js_on_change('start', request_visits)
+        plot.x_range.js_on_change('end', request_visits)
+        genotype.js_on_change('value', request_visits)
+        return column(genotype, plot)
 
     def _plot_visit_evolution_per_day(self):
         """ Returns a plot with the evolution of number of visits per day """
-        sorted_df = self.final_joined_df.sort_values(by=['Scan Date and Time'])
-        datetime_df = sorted_df.resample('D', on='Scan Date and Time').count()
-        datetime_df["visits_count"] = datetime_df["Visit Duration"]
-        datetime_df = datetime_df[['visits_count']]
-        x = datetime_df.index
-        y = datetime_df["visits_count"]
-        data = {'dates': x,
-                'visits_count': y}
+        timeline = select_timeline_range(self._get_visits_timeline(), resolution="day")
+        data = {'dates': timeline["buckets"],
+                'visits_count': timeline["visits"]}
         source = ColumnDataSource(data=data)
         plot = figure(plot_height=400, x_axis_type="datetime", title="Evolution of visits grouped by day",
                       tools="pan, wheel_zoom, box_zoom, reset, save", toolbar_sticky=False, margin=(15, 0, 15, 0))
@@ -599,3 +1147,36 @@ class Plot:
         plot.xaxis.formatter = DatetimeTickFormatter(days="%e/%m")
         plot.toolbar.logo = None
         return plot
+
+    @staticmethod
+    def sweep_plot_to_json(sweep_table: pd.DataFrame) -> str:
+        """ Returns the plot of a sweep of the max time between signals as a Bokeh JSON item """
+        return json.dumps(json_item(Plot._plot_max_time_between_signals_sweep(sweep_table)))
+
+    @staticmethod
+    def _plot_max_time_between_signals_sweep(sweep_table: pd.DataFrame):
+        """ Returns a plot with the number of visits and their average duration for each max time of the sweep """
+        all_genotypes = sweep_table[sweep_table["Genotype"] == "All genotypes"]
+        data = {'max_times': all_genotypes["Max Time Between Signals"].tolist(),
+                'visits': all_genotypes["Visits Count"].tolist(),
+                'means': all_genotypes["Visits Mean"].fillna(0).tolist()}
+        source = ColumnDataSource(data=data)
+        plot = figure(plot_height=400, title="Visits depending on the max time between signals",
+                      tools="pan, wheel_zoom, box_zoom, reset, save",
+                      tooltips=[("Max time (sec)", "@max_times"), ("Total visits", "@visits"),
+                                ("Average visit (sec)", "@means")], toolbar_sticky=False, margin=(30, 0, 30, 0))
+        plot.line(x='max_times', y='visits', line_width=2, line_color="#168756", source=source,
+                  legend_label="Number of visits")
+        plot.circle(x='max_times', y='visits', size=6, color="#168756", source=source)
+        plot.extra_y_ranges = {"means": Range1d(start=0, end=max(data['means'], default=0) * 1.1 or 1)}
+        plot.add_layout(LinearAxis(y_range_name="means", axis_label="Average visit duration"), 'right')
+        plot.line(x='max_times', y='means', line_width=2, line_color="#440154", y_range_name="means", source=source,
+                  legend_label="Average visit duration")
+        plot.circle(x='max_times', y='means', size=6, color="#440154", y_range_name="means", source=source)
+        plot.y_range.start = 0
+        plot.legend.location = "top_left"
+        plot.legend.background_fill_alpha = 0.8
+        plot.toolbar.logo = None
+        plot.xaxis.axis_label = "Max time between signals (sec)"
+        plot.yaxis[0].axis_label = "Number of visits"
+        return plot
@@ -0,0 +1,143 @@
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pyarrow_csv
+
+from reader_files import READER_COLUMNS
+
+SYNTHETIC_START_DATE = "2021-05-12"
+SYNTHETIC_FORAGING_HOURS = (8, 20)  # bouts start during the day, when bumblebees forage
+SYNTHETIC_FILE_FORMATS = ["xlsx", "csv"]
+EXCEL_MAX_DATA_ROWS = 1048575  # rows of a sheet, without the header
+MILLISECONDS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+def generate_reader_exports(reads_count: int, tags: int = 50, antennas: int = 16, genotypes: int = 8, days: int = 7,
+                            experiments: int = 1, reads_per_visit: float = 6, seconds_between_reads: float = 1.5,
+                            visits_per_bout: float = 5, seed: int = 0) -> Tuple[List[pd.DataFrame],
+                                                                               List[Dict[int, str]]]:
+    """
+    Generates reader exports with exactly reads_count reads, always the same ones for the same arguments.
+    Reads come in bursts, as the real ones: each pollinator forages in bouts of visits (visits_per_bout on average)
+    to random antennas, and each visit is a burst of reads (reads_per_visit on average, seconds_between_reads apart)
+    with some pauses longer than the usual max time between signals. Some pollinators are much more active than
+    others. The days are split into consecutive experiments, each with its own export and genotypes of the antennas.
+    Returns the exports (dataframes with the columns of the reader, sorted by time) and the genotypes of each one.
+    """
+    random_generator = np.random.default_rng(seed)
+    # Visits of a geometric number of reads, enough to reach reads_count (the last one is cut)
+    visits_reads = random_generator.geometric(1 / reads_per_visit, int(reads_count / reads_per_visit * 1.2) + 10)
+    while visits_reads.sum() < reads_count:
+        visits_reads = np.concatenate([visits_reads, random_generator.geometric(1 / reads_per_visit,
+                                                                                len(visits_reads))])
+    visits_count = int(np.searchsorted(np.cumsum(visits_reads), reads_count)) + 1
+    visits_reads = visits_reads[:visits_count]
+    visits_reads[-1] -= visits_reads.sum() - reads_count
+
+    # Bouts of consecutive visits of a pollinator, on a day and from a time of the day
+    bout_starts = random_generator.random(visits_count) < 1 / visits_per_bout
+    bout_starts[0] = True
+    visits_bouts = np.cumsum(bout_starts) - 1
+    bouts_count = int(visits_bouts[-1]) + 1
+    tags_activity = 1 / np.arange(1, tags + 1) ** 0.8
+    bouts_tags = random_generator.choice(tags, bouts_count, p=tags_activity / tags_activity.sum())
+    bouts_days = random_generator.integers(0, days, bouts_count)
+    first_hour, last_hour = SYNTHETIC_FORAGING_HOURS
+    bouts_starts = random_generator.uniform(first_hour * 3600, last_hour * 3600, bouts_count)
+
+    # Seconds between the reads of each visit: short gaps, and a few pauses of the pollinator
+    reads_visits = np.repeat(np.arange(visits_count), visits_reads)
+    read_gaps = random_generator.exponential(seconds_between_reads, reads_count)
+    pauses = random_generator.random(reads_count) < 0.05
+    read_gaps[pauses] = random_generator.uniform(8, 60, pauses.sum())
+    first_reads = np.concatenate([[0], np.cumsum(visits_reads)[:-1]])
+    read_gaps[first_reads] = 0
+    reads_offsets = _cumsum_by_group(read_gaps, first_reads)
+    visits_spans = reads_offsets[np.cumsum(visits_reads) - 1]
+    # Visits of a bout follow each other, some seconds after the previous one ends
+    visit_gaps = random_generator.exponential(30, visits_count) + np.concatenate([[0], visits_spans[:-1]])
+    first_visits = np.flatnonzero(bout_starts)
+    visit_gaps[first_visits] = 0
+    visits_offsets = _cumsum_by_group(visit_gaps, first_visits)
+
+    reads_bouts = visits_bouts[reads_visits]
+    start = pd.Timestamp(SYNTHETIC_START_DATE).value // 1000000
+    timestamps = (start + bouts_days[reads_bouts] * MILLISECONDS_PER_DAY
+                  + np.round((bouts_starts[reads_bouts] + visits_offsets[reads_visits] + reads_offsets) * 1000)
+                  ).astype(np.int64)
+    reads_antennas = random_generator.integers(1, antennas + 1, visits_count)[reads_visits]
+    reads_tags = bouts_tags[reads_bouts]
+
+    exports, genotypes_of_each_experiment = [], []
+    days_experiments = np.repeat(np.arange(experiments),
+                                 [len(experiment_days) for experiment_days in np.array_split(np.arange(days),
+                                                                                             experiments)])
+    # The bouts of the last evening can end after midnight, they are still part of the last experiment
+    reads_experiments = days_experiments[np.minimum((timestamps - start) // MILLISECONDS_PER_DAY, days - 1)]
+    order = np.lexsort((reads_antennas, timestamps, reads_experiments))
+    tag_ids = np.array([f"985.{113005100000 + tag}" for tag in range(tags)], dtype=object)
+    for experiment, experiment_reads in enumerate(np.split(order, np.cumsum(np.bincount(reads_experiments,
+                                                                                         minlength=experiments))[:-1])):
+        experiment_timestamps = timestamps[experiment_reads]
+        exports.append(pd.DataFrame({"Reader ID": "R1",
+                                     "Scan Date": _format_scan_dates(experiment_timestamps),
+                                     "Scan Time": _format_scan_times(experiment_timestamps % MILLISECONDS_PER_DAY),
+                                     "Antenna ID": reads_antennas[experiment_reads],
+                                     "DEC Tag ID": tag_ids[reads_tags[experiment_reads]]},
+                                    columns=["Reader ID"] + READER_COLUMNS))
+        # The plants are moved between experiments, so each one has its own genotypes of the antennas
+        antennas_genotypes = random_generator.permutation(antennas) % genotypes
+        genotypes_of_each_experiment.append({antenna + 1: f"Genotype {genotype + 1}"
+                                             for antenna, genotype in enumerate(antennas_genotypes)})
+    return exports, genotypes_of_each_experiment
+
+
+def write_reader_exports(exports: List[pd.DataFrame], folder: str, file_format: str = "xlsx",
+                         name: str = "synthetic") -> List[str]:
+    """
+    Writes the exports as the files downloaded from the reader, Excel workbooks or CSV text logs, and returns
+    their file names. A sheet can't have more than 1048575 rows, so bigger exports must be written as text logs.
+    """
+    if file_format not in SYNTHETIC_FILE_FORMATS:
+        raise ValueError(f"Unknown file format {file_format}, it must be one of {SYNTHETIC_FILE_FORMATS}")
+    file_names = []
+    for number, export in enumerate(exports, start=1):
+        file_name = f"{name}_{number}.{file_format}"
+        path = os.path.join(folder, file_name)
+        if file_format == "xlsx":
+            if len(export) > EXCEL_MAX_DATA_ROWS:
+                raise ValueError(f"{len(export)} reads don't fit in an Excel sheet, write them as csv")
+            export.to_excel(path, index=False)
+        else:
+            pyarrow_csv.write_csv(pa.Table.from_pandas(export, preserve_index=False), path)
+        file_names.append(file_name)
+    return file_names
+
+
+def _cumsum_by_group(values: np.ndarray, group_starts: np.ndarray) -> np.ndarray:
+    """ Cumulative sum of values that starts again at each position of group_starts (sorted, starting with 0) """
+    cumulative_sum = np.cumsum(values)
+    group_sizes = np.diff(np.append(group_starts, len(values)))
+    return cumulative_sum - np.repeat(cumulative_sum[group_starts] - values[group_starts], group_sizes)
+
+
+def _format_scan_dates(timestamps: np.ndarray) -> np.ndarray:
+    """ Formats epoch milliseconds as the "Scan Date" of the reader, formatting each distinct day once """
+    days, days_codes = np.unique(timestamps // MILLISECONDS_PER_DAY, return_inverse=True)
+    return pd.to_datetime(days, unit="D").strftime("%d/%m/%Y").values.astype(object)[days_codes]
+
+
+def _format_scan_times(milliseconds_of_day: np.ndarray) -> np.ndarray:
+    """ Formats milliseconds of the day as the "Scan Time" of the reader ("HH:MM:SS.fff"), writing the bytes at once """
+    fields = [milliseconds_of_day // 3600000, milliseconds_of_day // 60000 % 60, milliseconds_of_day // 1000 % 60]
+    characters = np.empty((len(milliseconds_of_day), 12), dtype=np.uint8)
+    for position, field in zip((0, 3, 6), fields):
+        characters[:, position], characters[:, position + 1] = field // 10 + ord("0"), field % 10 + ord("0")
+    characters[:, [2, 5]], characters[:, 8] = ord(":"), ord(".")
+    for position, divisor in zip((9, 10, 11), (100, 10, 1)):
+        characters[:, position] = milliseconds_of_day // divisor % 10 + ord("0")
+    return characters.view("S12").ravel().astype("U12").astype(object)
+
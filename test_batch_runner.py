@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+import yaml
+
+from batch_runner import BATCH_RUN_FILE, load_batch_config, run_batch
+from synthetic_reads import generate_reader_exports, write_reader_exports
+
+
+@pytest.fixture
+def batch_config(tmp_path) -> dict:
+    exports, genotypes_of_each_experiment = generate_reader_exports(3000, experiments=2, seed=3)
+    os.makedirs(tmp_path / "archive")
+    write_reader_exports(exports, tmp_path / "archive", "csv", name="reader")
+    with open(tmp_path / "archive" / "invalid.csv", "w") as invalid_file:
+        invalid_file.write("not a reader file\n")
+    return {"output_folder": "results",
+            "defaults": {"parameters": {"max_time_between_signals": 7}, "export_formats": ["csv"], "charts": False},
+            "experiments": [{"name": "campaign", "files": ["archive/reader_*.csv"],
+                             "genotypes": genotypes_of_each_experiment},
+                            {"name": "first_day", "files": ["archive/reader_1.csv"],
+                             "genotypes": genotypes_of_each_experiment[0],
+                             "parameters": {"round_or_truncate": "truncate"}},
+                            {"name": "invalid", "files": ["archive/invalid.csv"], "genotypes": {1: "Genotype 1"}}]}
+
+
+def load_config(tmp_path, config: dict) -> dict:
+    with open(tmp_path / "batch.yaml", "w") as config_file:
+        yaml.safe_dump(config, config_file)
+    return load_batch_config(str(tmp_path / "batch.yaml"))
+
+
+def test_run_batch_writes_the_outputs_of_each_experiment_and_skips_the_finished_ones(tmp_path, batch_config):
+    config = load_config(tmp_path, batch_config)
+    assert config["experiments"][0]["files"] == [str(tmp_path / "archive" / "reader_1.csv"),
+                                                 str(tmp_path / "archive" / "reader_2.csv")]
+    summaries = run_batch(config["experiments"], config["output_folder"], workers=2)
+    assert [summary["status"] for summary in summaries] == ["finished", "finished", "failed"]
+    assert "Could not parse invalid.csv" in summaries[2]["error"]
+    campaign_folder = tmp_path / "results" / "campaign"
+    assert os.path.isfile(campaign_folder / "campaign_genotypes_csv.zip")
+    with open(campaign_folder / "statistics.json") as statistics_file:
+        assert json.load(statistics_file)["genotypes_count"] == len(summaries[0]["genotypes"])
+    assert summaries[0]["visits"] > summaries[1]["visits"] > 0
+    assert sorted(os.listdir(tmp_path / "archive")) == ["invalid.csv", "reader_1.csv", "reader_2.csv"]  # the archive is only read
+
+    # Finished experiments are skipped, and the ones whose parameters changed run again
+    batch_config["experiments"][1]["parameters"]["round_or_truncate"] = "round"
+    config = load_config(tmp_path, batch_config)
+    summaries = run_batch(config["experiments"], config["output_folder"], workers=2)
+    assert [summary["status"] for summary in summaries] == ["skipped", "finished", "failed"]
+    assert not os.path.exists(tmp_path / "results" / "invalid" / BATCH_RUN_FILE)
+    assert run_batch(config["experiments"][:1], config["output_folder"], force=True)[0]["status"] == "finished"
+
+
+def test_load_batch_config_reports_every_invalid_experiment(tmp_path, batch_config):
+    batch_config["experiments"] += [{"name": "campaign", "files": ["archive/reader_1.csv"], "genotypes": {1: "A"}},
+                                    {"name": "missing", "files": ["archive/missing.csv"], "genotypes": {1: "A"}},
+                                    {"name": "parameters", "files": ["archive/reader_1.csv"], "genotypes": {1: "A"},
+                                     "parameters": {"max_time": 7}},
+                                    {"name": "maps", "files": ["archive/reader_1.csv"],
+                                     "genotypes": [{1: "A"}, {1: "B"}]}]
+    with pytest.raises(ValueError) as error:
+        load_config(tmp_path, batch_config)
+    for problem in ("campaign: the name is repeated", "missing: file not found", "unknown parameters: max_time",
+                    "maps: there are 2 genotype maps for 1 files"):
+        assert problem in str(error.value)
@@ -0,0 +1,31 @@
+import json
+
+from benchmarks import BENCHMARK_COLUMNS, PLOT_METHODS, benchmark_scale, find_regressions, write_benchmark_results
+
+
+def test_benchmark_scale_measures_every_stage_and_chart(tmp_path):
+    results = benchmark_scale(2000, str(tmp_path / "benchmark"), file_format="csv", profile_memory=False)
+    steps = {(result["group"], result["step"]) for result in results}
+    assert {("pipeline", stage) for stage in ["ingestion", "join", "selection", "sorting", "visits", "statistics",
+                                              "timeline", "exports"]} <= steps
+    assert {("plot", method) for method in PLOT_METHODS} <= steps and ("export", "parquet") in steps
+    assert all(result["seconds"] >= 0 and result["peak_memory_mb"] is None for result in results)
+    ingestion = next(result for result in results if result["step"] == "ingestion")
+    assert ingestion["rows"] == 2000
+
+    paths = write_benchmark_results(results, str(tmp_path / "results"))
+    with open(paths["json"]) as file_handler:
+        assert json.load(file_handler)["results"] == results
+    with open(paths["csv"]) as file_handler:
+        assert file_handler.readline().strip() == ",".join(BENCHMARK_COLUMNS)
+
+
+def test_find_regressions_ignores_short_steps():
+    baseline = [{"reads": 10, "file_format": "csv", "group": "pipeline", "step": step, "seconds": seconds,
+                 "peak_memory_mb": None}
+                for step, seconds in [("visits", 1.0), ("join", 0.01), ("sorting", 1.0)]]
+    results = [dict(result, seconds=seconds) for result, seconds in zip(baseline, [1.5, 0.05, 1.1])]
+    assert [(regression["step"], regression["ratio"]) for regression in find_regressions(results, baseline)] == \
+        [("visits", 1.5)]
+    memory_profiled_results = [dict(result, peak_memory_mb=1.0) for result in results]
+    assert find_regressions(memory_profiled_results, baseline) == []  # tracing memory makes every step slower
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from genotype_comparisons import _correct_p_values, pairwise_t_tests, summaries_statistics, t_tests_to_dict
+from visit_statistics import DurationsSummary
+
+DURATIONS = {"A": [3.0, 5.0, 4.0, 8.0], "B": [9.0, 12.0, 10.0, 30.0, 11.0], "C": [2.0, 2.0], "D": [5.0, 5.0],
+             "E": [7.0], "F": []}
+
+
+@pytest.fixture
+def statistics() -> pd.DataFrame:
+    summaries = {genotype: DurationsSummary(values) for genotype, values in DURATIONS.items()}
+    summaries["B"] = DurationsSummary(DURATIONS["B"][:2]).merge(DurationsSummary(DURATIONS["B"][2:]))  # as appends
+    return summaries_statistics(summaries)
+
+
+def test_welch_t_tests_match_scipy(statistics):
+    t_tests = pairwise_t_tests(statistics, "welch")
+    for genotype, genotype2 in [("A", "B"), ("A", "C"), ("B", "D")]:
+        expected = ttest_ind(DURATIONS[genotype], DURATIONS[genotype2], equal_var=False)
+        assert t_tests["t"].at[genotype, genotype2] == pytest.approx(expected.statistic)
+        assert t_tests["t"].at[genotype2, genotype] == pytest.approx(-expected.statistic)
+        assert t_tests["p"].at[genotype, genotype2] == pytest.approx(expected.pvalue)
+    # Both variances are 0, so the degrees of freedom are 0 / 0: as scipy, the test has 1 degree of freedom
+    assert (t_tests["t"].at["C", "D"], t_tests["p"].at["C", "D"]) == (-np.inf, 0)
+    assert np.isnan(t_tests["t"].at["A", "F"]) and np.isnan(t_tests["t"].at["A", "A"])
+    assert "A and F" not in t_tests_to_dict(t_tests) and "A and B" in t_tests_to_dict(t_tests)
+
+
+def test_p_values_are_corrected_for_the_pairs_tested():
+    p = np.full((4, 4), np.nan)
+    for (row, column), p_value in {(0, 1): 0.01, (0, 2): 0.04, (1, 2): 0.03}.items():  # the pairs of D untested
+        p[row, column] = p[column, row] = p_value
+    expected = {"bonferroni": [0.03, 0.12, 0.09],  # p × 3 tests
+                "holm": [0.03, 0.06, 0.06],  # sorted 0.01 × 3, 0.03 × 2, 0.04 × 1, and never smaller than before
+                "fdr_bh": [0.03, 0.04, 0.04]}  # sorted 0.01 × 3 / 1, 0.03 × 3 / 2, 0.04 × 3 / 3, never larger after
+    for correction, adjusted in expected.items():
+        corrected = _correct_p_values(p.copy(), correction)
+        assert [corrected[0, 1], corrected[0, 2], corrected[1, 2]] == pytest.approx(adjusted), correction
+        assert corrected[2, 1] == corrected[1, 2] and np.isnan(corrected[0, 3]) and np.isnan(corrected[0, 0])
+    assert _correct_p_values(np.array([[np.nan, 0.6], [0.6, np.nan]]), "bonferroni")[0, 1] == 0.6
+    assert _correct_p_values(np.array([[np.nan, 0.6, 0.7], [0.6, np.nan, 0.8], [0.7, 0.8, np.nan]]),
+                             "bonferroni")[0, 1] == 1
+
+
+def test_unknown_methods_and_corrections_are_rejected(statistics):
+    with pytest.raises(ValueError, match="Unknown t-test method"):
+        pairwise_t_tests(statistics, "paired")
+    with pytest.raises(ValueError, match="Unknown correction"):
+        pairwise_t_tests(statistics, "student", "sidak")
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from incidence_index import build_incidence_index, select_visitors
+
+
+@pytest.fixture
+def incidence_index() -> pd.DataFrame:
+    return build_incidence_index({"A": pd.DataFrame({"DEC Tag ID": ["1", "2", "2", "4"]}),
+                                  "B": pd.DataFrame({"DEC Tag ID": ["2", "3"]}),
+                                  "C": pd.DataFrame({"DEC Tag ID": ["1", "3", "3", "3"]})})
+
+
+def test_incidence_index_counts_each_tag_on_each_genotype(incidence_index: pd.DataFrame):
+    assert incidence_index.index.tolist() == ["1", "2", "4", "3"]
+    assert incidence_index.to_dict("list") == {"A": [1, 2, 1, 0], "B": [0, 1, 0, 1], "C": [1, 0, 0, 3]}
+    assert build_incidence_index({}).empty
+
+
+def test_incidence_index_skips_rows_without_tag():
+    incidence_index = build_incidence_index({"A": pd.DataFrame({"DEC Tag ID": ["1", np.nan, "2"]}),
+                                             "B": pd.DataFrame({"DEC Tag ID": [np.nan]})})
+    assert incidence_index.to_dict("index") == {"1": {"A": 1, "B": 0}, "2": {"A": 1, "B": 0}}
+
+
+def test_select_visitors_of_all_any_or_at_least_some_genotypes(incidence_index: pd.DataFrame):
+    assert select_visitors(incidence_index, ["A", "C"]) == {"1"}
+    assert select_visitors(incidence_index, ["A", "C"], "any") == {"1", "2", "3", "4"}
+    assert select_visitors(incidence_index, ["A", "B", "C"], "at_least", 2) == {"1", "2", "3"}
+    assert select_visitors(incidence_index, []) == {"1", "2", "3", "4"}
+    with pytest.raises(ValueError):
+        select_visitors(incidence_index, ["A", "D"])
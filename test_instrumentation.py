@@ -0,0 +1,35 @@
+import json
+import logging
+
+import pytest
+
+from instrumentation import Metrics
+
+
+def test_measure_adds_up_the_measurements_of_each_step(caplog):
+    metrics = Metrics(enabled=True)
+    run_metrics = []
+    with caplog.at_level(logging.INFO, logger="pollinators.metrics"):
+        for rows in (10, 20):
+            with metrics.measure("pipeline.visits", run_metrics) as measurement:
+                measurement["rows"] = rows
+    assert [step["rows"] for step in run_metrics] == [10, 20]
+    assert set(run_metrics[0]) >= {"step", "seconds", "cpu_seconds", "max_rss_mb", "rss_growth_mb", "failed"}
+    assert json.loads(caplog.records[-1].getMessage())["rows"] == 20  # a structured log for each measurement
+    totals = metrics.to_dict()["steps"]["pipeline.visits"]
+    assert (totals["count"], totals["failed"]) == (2, 0)
+    assert totals["seconds"] == pytest.approx(run_metrics[0]["seconds"] + run_metrics[1]["seconds"], abs=1e-3)
+
+    with pytest.raises(ValueError):
+        with metrics.measure("pipeline.join"):
+            raise ValueError("the step fails")
+    assert metrics.to_dict()["steps"]["pipeline.join"]["failed"] == 1
+    assert metrics.to_dict()["recent"][-1]["failed"]
+
+
+def test_disabled_metrics_measure_nothing():
+    metrics = Metrics(enabled=False)
+    run_metrics = []
+    with metrics.measure("pipeline.visits", run_metrics) as measurement:
+        measurement["rows"] = 10
+    assert run_metrics == [] and metrics.to_dict() == {"enabled": False, "steps": {}, "recent": []}
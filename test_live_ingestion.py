@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from live_ingestion import LiveIngestion
+
+HEADER = "Scan Date,Scan Time,Antenna ID,DEC Tag ID\n"
+
+
+def reader_rows(*reads: tuple) -> str:
+    return "".join(f"12/05/2021,{scan_time},{antenna},{tag}\n" for scan_time, antenna, tag in reads)
+
+
+@pytest.fixture
+def live_ingestion(tmp_path) -> LiveIngestion:
+    return LiveIngestion(str(tmp_path), {1: "G1", 2: "G2"}, max_time_between_signals=7,
+                         pollinators_to_remove=["999"])
+
+
+def test_visits_continue_from_one_poll_to_the_next(live_ingestion: LiveIngestion, tmp_path):
+    log = tmp_path / "reader.csv"
+    log.write_text(HEADER + reader_rows(("10:00:00.000", 1, "900"), ("10:00:02.000", 1, "900"),
+                                        ("10:00:00.000", 3, "900"), ("10:00:01.000", 1, "999")))
+    assert live_ingestion.poll() == 2  # antenna 3 has no genotype and 999 is removed
+    status = live_ingestion.to_dict()
+    assert status["genotypes"]["G1"]["visits"] == 0 and status["genotypes"]["G1"]["open_visits"] == 1
+
+    with open(log, "a") as file:
+        file.write(reader_rows(("10:00:05.000", 1, "900"), ("10:00:30.000", 1, "900"), ("10:00:00.000", 2, "901")))
+    assert live_ingestion.poll() == 3
+    status = live_ingestion.to_dict()
+    assert status["genotypes"]["G1"]["visits"] == 1
+    assert status["genotypes"]["G1"]["total_duration"] == 5  # [0, 2, 5] continued across both polls
+    assert status["genotypes"]["G2"] == {"visits": 0, "total_duration": None, "mean_duration": None,
+                                         "median_duration": None, "std_duration": None, "pollinators": 0,
+                                         "open_visits": 0}
+    assert status["recent_visits"] == [{"genotype": "G1", "tag": "900", "scan_date_and_time": "2021-05-12 10:00:05",
+                                        "visit_duration": 5.0}]
+    assert status["files"] == {"reader.csv": log.stat().st_size}
+    assert live_ingestion.poll() == 0  # nothing new, nothing read again
+
+
+def test_new_files_and_workbooks_are_ingested(live_ingestion: LiveIngestion, tmp_path):
+    workbook = tmp_path / "reader.xlsx"
+    pd.DataFrame({"Scan Date": ["12/05/2021"] * 2, "Scan Time": ["10:00:00.000", "10:00:03.000"],
+                  "Antenna ID": [2, 2], "DEC Tag ID": ["901", "901"]}).to_excel(workbook, index=False)
+    assert live_ingestion.poll() == 2
+    (tmp_path / "reader_2.csv").write_text(HEADER + reader_rows(("10:00:20.000", 2, "901")))
+    assert live_ingestion.poll() == 1
+    assert live_ingestion.to_dict()["genotypes"]["G2"]["mean_duration"] == 3
+    assert live_ingestion.poll() == 0  # the workbook didn't change
+
+
+def test_a_file_that_cant_be_parsed_doesnt_lose_the_rows_of_the_others(live_ingestion: LiveIngestion, tmp_path):
+    (tmp_path / "a.csv").write_text(HEADER + reader_rows(("10:00:00.000", 1, "900"), ("10:00:04.000", 1, "900")))
+    broken = tmp_path / "b.csv"
+    broken.write_text(HEADER + reader_rows(("10:00:00.000", 2, "901")) + "not a date,10:00:01.000,2,901\n")
+    assert live_ingestion.poll() == 2
+    status = live_ingestion.to_dict()
+    assert list(status["files"]) == ["a.csv"] and "b.csv" in status["errors"]
+    assert status["genotypes"]["G1"]["open_visits"] == 1
+
+    broken.write_text(HEADER + reader_rows(("10:00:00.000", 2, "901"), ("10:00:01.000", 2, "901")))
+    assert live_ingestion.poll() == 2  # the fixed file is read from its start, a.csv isn't read again
+    status = live_ingestion.to_dict()
+    assert status["errors"] == {} and status["files"]["b.csv"] == broken.stat().st_size
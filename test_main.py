@@ -0,0 +1,118 @@
+import logging
+import os
+import time
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")  # main keeps the pipeline states in GCS
+
+import main
+from pipeline_state import LocalStateBackend, StateStore
+from rfid_pollinators_pipeline import Pipeline
+from live_ingestion import LiveIngestion
+from synthetic_reads import generate_reader_exports, write_reader_exports
+from workspaces import Workspace
+
+
+@pytest.fixture
+def client_with_results(tmp_path, monkeypatch):
+    """ A test client whose workspace has the state of a finished run, stored in a local folder instead of GCS """
+    workspace = Workspace()
+    workspace.create()
+    exports, genotypes_of_each_experiment = generate_reader_exports(2000, experiments=1, seed=5)
+    file_names = write_reader_exports(exports, workspace.uploads_folder, "csv")
+    pipeline = Pipeline(file_names, upload_folder=workspace.uploads_folder, exports_folder=workspace.exports_folder)
+    pipeline.preprocessing_of_data()
+    pipeline.input_genotypes_data(genotypes_of_each_experiment)
+    pipeline.input_parameters_of_run("7", "round", [], "False")
+    pipeline.run_pipeline()
+    state_store = StateStore(LocalStateBackend(str(tmp_path / "state")))
+    state_store.save(pipeline)
+    monkeypatch.setattr(main, "is_pipeline_present", lambda workspace_id: workspace_id == workspace.workspace_id)
+    monkeypatch.setattr(main, "download_and_deserialize_pipeline_from_gcs", lambda workspace_id: state_store.load())
+    monkeypatch.setattr(main, "touch_pipeline_state", lambda workspace_id: None)
+    client = main.app.test_client()
+    client.set_cookie("localhost", main.WORKSPACE_COOKIE, workspace.workspace_id)
+    yield client, pipeline
+    main.load_visits_timeline.cache_clear()
+
+
+def test_chart_groups_are_rendered_once_and_cached_by_the_browser(client_with_results):
+    client, pipeline = client_with_results
+    response = client.get(f"/charts/{pipeline.run_fingerprint}/genotypes")
+    assert response.status_code == 200 and response.mimetype == "application/json"
+    assert response.cache_control.max_age == main.CHARTS_MAX_AGE_SECONDS and response.cache_control.private
+    assert response.get_json()["target_id"] is None
+    assert client.get(f"/charts/{pipeline.run_fingerprint}/genotypes").data == response.data
+
+
+def test_only_the_metrics_logger_is_configured(client_with_results):
+    client, _ = client_with_results
+    assert logging.getLogger().level == logging.WARNING
+    assert main.METRICS_LOGGER.level == logging.INFO and not main.METRICS_LOGGER.propagate
+    response = client.get("/view-results")
+    assert b"Memory growth (MB)" in response.data and b"Peak memory" not in response.data
+
+
+def test_requests_of_a_session_mark_its_state_as_used(client_with_results, monkeypatch):
+    client, pipeline = client_with_results
+    touched_states = []
+    monkeypatch.setattr(main, "touch_pipeline_state", touched_states.append)
+    assert client.get("/tables/not_a_genotype").status_code == 404  # the state is not even loaded
+    assert touched_states == [os.path.basename(os.path.dirname(pipeline.upload_folder))]
+    main.app.test_client().get("/")  # a new session, without a state to mark
+    assert len(touched_states) == 1
+
+
+def test_results_are_downloaded_as_attachments(client_with_results):
+    client, _ = client_with_results
+    for url, export_format in [("/download-data-excel", "xlsx"), ("/download-data/csv", "csv"),
+                               ("/download-data/parquet", "parquet")]:
+        file_name, mimetype = main.EXPORT_FORMATS[export_format]
+        response = client.get(url)
+        assert response.status_code == 200 and response.mimetype == mimetype
+        assert response.headers["Content-Disposition"] == f"attachment; filename={file_name}"
+
+
+def test_sensitivity_analysis_runs_as_a_job_without_saving_the_state(client_with_results, monkeypatch):
+    client, pipeline = client_with_results
+    monkeypatch.setattr(main, "serialize_and_upload_pipeline_to_gcs", lambda *arguments: pytest.fail("state saved"))
+    for max_times in ["3, five", "0, 7", ",".join(str(value) for value in range(1, main.SWEEP_MAX_VALUES + 2))]:
+        assert client.post("/sensitivity-analysis", data={"max_times": max_times}).status_code == 400
+    response = client.post("/sensitivity-analysis", data={"max_times": "3, 7, 3"})
+    job = main.PIPELINE_JOBS.get(response.headers["Location"].rsplit("/", 1)[-1])
+    for _ in range(100):
+        if job.to_dict()["status"] in ("finished", "failed"):
+            break
+        time.sleep(0.05)
+    assert job.to_dict()["status"] == "finished"
+    sweep_page = client.get(job.result_url)
+    assert sweep_page.status_code == 200 and b"<strong>3, 7" in sweep_page.data
+    # The same sweep of the same run is shown without computing it again
+    assert client.post("/sensitivity-analysis", data={"max_times": "3,7"}).headers["Location"].endswith(
+        job.result_url)
+
+
+def test_live_ingestions_are_limited_and_stopped_with_their_workspaces(client_with_results, tmp_path, monkeypatch):
+    client, _ = client_with_results
+    other_session = LiveIngestion(str(tmp_path), {1: "G1"}, max_time_between_signals=7)
+    monkeypatch.setattr(main, "LIVE_INGESTION_FOLDER", str(tmp_path))
+    monkeypatch.setattr(main, "LIVE_INGESTIONS", {"other": other_session})
+    monkeypatch.setattr(main, "LIVE_INGESTIONS_MAX", 1)
+    monkeypatch.setattr(main, "delete_expired_pipeline_states", lambda ttl_seconds: None)
+    assert client.post("/live/start").status_code == 503
+    main.stop_live_ingestions(["other"])
+    assert client.post("/live/start").status_code == 302
+    (workspace_id, live_ingestion), = main.LIVE_INGESTIONS.items()
+    assert client.post("/live/start").status_code == 302  # the session replaces its own live ingestion
+    assert not live_ingestion.to_dict()["running"]
+    live_ingestion = main.LIVE_INGESTIONS[workspace_id]
+
+    os.utime(os.path.join(main.WORKSPACES_FOLDER, workspace_id), (0, 0))  # the session expired
+    monkeypatch.setattr(main, "last_workspaces_collection", 0)
+    main.collect_expired_workspaces_periodically()
+    for _ in range(100):
+        if not main.LIVE_INGESTIONS:
+            break
+        time.sleep(0.05)
+    assert main.LIVE_INGESTIONS == {} and not live_ingestion.to_dict()["running"]
@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+import pytest
+
+from parsed_files_cache import ParsedFilesCache, hash_file
+
+
+@pytest.fixture
+def parsed_dataframe() -> pd.DataFrame:
+    """ Sample dataframe with the same columns and dtypes as a parsed reader file """
+    return pd.DataFrame({"Scan Date": ["12/05/2021", "12/05/2021"], "Scan Time": ["10:00:00.100", "10:00:01.900"],
+                         "Antenna ID": [1, 3], "DEC Tag ID": ["985.113005100764", "982.091063520932"]})
+
+
+def test_hash_file_depends_only_on_content(tmp_path):
+    (tmp_path / "a.xlsx").write_bytes(b"same content")
+    (tmp_path / "b.xlsx").write_bytes(b"same content")
+    (tmp_path / "c.xlsx").write_bytes(b"other content")
+    assert hash_file(str(tmp_path / "a.xlsx")) == hash_file(str(tmp_path / "b.xlsx"))
+    assert hash_file(str(tmp_path / "a.xlsx")) != hash_file(str(tmp_path / "c.xlsx"))
+
+
+def test_cache_roundtrip(tmp_path, parsed_dataframe: pd.DataFrame):
+    cache = ParsedFilesCache(folder=str(tmp_path))
+    assert cache.get("abc") is None
+    cache.put("abc", parsed_dataframe, {"antennas": [1, 3]})
+    cached_dataframe, summary = cache.get("abc")
+    pd.testing.assert_frame_equal(cached_dataframe, parsed_dataframe)
+    assert summary == {"antennas": [1, 3]}
+
+
+def test_cache_evicts_least_recently_used(tmp_path, parsed_dataframe: pd.DataFrame):
+    cache = ParsedFilesCache(folder=str(tmp_path))
+    cache.put("first", parsed_dataframe)
+    entry_size = os.path.getsize(tmp_path / "first.parquet")
+    cache.max_bytes = 2 * entry_size
+    cache.put("second", parsed_dataframe)
+    os.utime(tmp_path / "first.parquet", (0, 0))
+    os.utime(tmp_path / "second.parquet", (1, 1))
+    cache.get("first")  # "first" becomes the most recently used entry
+    cache.put("third", parsed_dataframe)
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
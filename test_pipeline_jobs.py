@@ -0,0 +1,45 @@
+import threading
+
+from pipeline_jobs import PipelineJob, PipelineJobs
+
+
+def wait_for_job(job: PipelineJob, timeout: float = 5):
+    for _ in range(int(timeout * 100)):
+        if job.status in ("finished", "failed"):
+            return
+        threading.Event().wait(0.01)
+
+
+def test_job_reports_progress_of_each_stage():
+    jobs = PipelineJobs(workers=1)
+    can_finish = threading.Event()
+
+    def job_function(job: PipelineJob, stage_name: str):
+        job.report_stage("join", "skipped")
+        job.report_stage(stage_name, "started")
+        can_finish.wait(5)
+        job.report_stage(stage_name, "finished")
+
+    job = jobs.submit(job_function, "visits")
+    assert jobs.get(job.job_id) is job
+    can_finish.set()
+    wait_for_job(job)
+    status = job.to_dict()
+    assert status["status"] == "finished"
+    assert [(stage["name"], stage["status"]) for stage in status["stages"]] == [("join", "skipped"),
+                                                                                ("visits", "finished")]
+    assert status["stages"][1]["seconds"] >= 0
+
+
+def test_failed_job_keeps_the_error_and_old_jobs_are_forgotten():
+    jobs = PipelineJobs(workers=1, retention_seconds=0)
+
+    def failing_job_function(job: PipelineJob):
+        raise ValueError("no visits")
+
+    job = jobs.submit(failing_job_function)
+    wait_for_job(job)
+    assert job.to_dict()["status"] == "failed"
+    assert job.to_dict()["error"] == "ValueError: no visits"
+    jobs.submit(lambda job: None)
+    assert jobs.get(job.job_id) is None
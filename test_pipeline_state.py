@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+from pipeline_state import LocalStateBackend, StateStore, STATE_LAST_USED_NAME, STATE_MANIFEST_NAME
+from rfid_pollinators_pipeline import Pipeline
+
+
+class RecordingBackend(LocalStateBackend):
+    """ Local backend that records the names of the blobs read and written """
+
+    def __init__(self, folder: str):
+        super().__init__(folder)
+        self.reads, self.writes = [], []
+
+    def read(self, name: str):
+        self.reads.append(name)
+        return super().read(name)
+
+    def write(self, name: str, data: bytes):
+        self.writes.append(name)
+        super().write(name, data)
+
+
+@pytest.fixture
+def stored_pipeline() -> Pipeline:
+    pipeline = Pipeline(["exp_a.xlsx", "exp_b.xlsx"])
+    pipeline.genotypes_of_each_experiment = [{1: "G1", 2: "G2"}]
+    pipeline.pollinators_aliases = {"985.113005100764": "1"}
+    pipeline.list_of_good_visitors = {"985.113005100764"}
+    pipeline.df = pd.DataFrame({"DEC Tag ID": pd.Categorical(["b", "a", "b"], categories=["a", "b"]),
+                                "Scan Timestamp": [3000, 1000, 2000]})
+    pipeline.genotypes_dfs = {"G1": pipeline.df.iloc[:2], "G2": pipeline.df.iloc[2:]}
+    return pipeline
+
+
+def test_state_store_round_trip(tmp_path, stored_pipeline: Pipeline):
+    store = StateStore(LocalStateBackend(str(tmp_path)))
+    store.save(stored_pipeline)
+    loaded_pipeline = store.load()
+    assert loaded_pipeline.excel_files == ["exp_a.xlsx", "exp_b.xlsx"]
+    assert loaded_pipeline.genotypes_of_each_experiment == [{1: "G1", 2: "G2"}]
+    assert loaded_pipeline.list_of_good_visitors == {"985.113005100764"}
+    pd.testing.assert_frame_equal(loaded_pipeline.df, stored_pipeline.df)
+    pd.testing.assert_frame_equal(loaded_pipeline.genotypes_dfs["G2"], stored_pipeline.genotypes_dfs["G2"])
+    assert loaded_pipeline.max_time_between_signals is None
+    with pytest.raises(AttributeError):
+        getattr(loaded_pipeline, "not_an_attribute")
+
+
+def test_state_store_fetches_and_uploads_only_what_is_needed(tmp_path, stored_pipeline: Pipeline):
+    backend = RecordingBackend(str(tmp_path))
+    store = StateStore(backend)
+    store.save(stored_pipeline)
+    backend.reads.clear()
+    loaded_pipeline = store.load()
+    assert loaded_pipeline.pollinators_aliases == {"985.113005100764": "1"}
+    assert backend.reads == [STATE_MANIFEST_NAME]  # metadata comes with the manifest, frames are lazy
+    loaded_pipeline.df  # noqa
+    assert len(backend.reads) == 2
+
+    backend.writes.clear()
+    loaded_pipeline.max_time_between_signals = 7
+    StateStore(backend).save(loaded_pipeline)  # each request creates its own store for the same location
+    assert backend.writes == [STATE_MANIFEST_NAME]
+
+    backend.writes.clear()
+    loaded_pipeline.genotypes_dfs = {"G1": loaded_pipeline.df.iloc[:1], "G2": stored_pipeline.genotypes_dfs["G2"]}
+    store.save(loaded_pipeline)
+    assert len(backend.writes) == 2  # the new G1 frame and the manifest
+    assert store.load().max_time_between_signals == 7
+
+
+def test_state_store_delete_removes_every_blob(tmp_path, stored_pipeline: Pipeline):
+    store = StateStore(LocalStateBackend(str(tmp_path)))
+    store.save(stored_pipeline)
+    store.touch()
+    assert (tmp_path / STATE_LAST_USED_NAME).exists()
+    store.delete()
+    assert not store.exists() and not (tmp_path / STATE_LAST_USED_NAME).exists()
+    assert not list((tmp_path / "blobs").iterdir())
+
+
+def test_state_store_copies_lazy_attributes_to_another_store(tmp_path, stored_pipeline: Pipeline):
+    store = StateStore(LocalStateBackend(str(tmp_path / "first")))
+    store.save(stored_pipeline)
+    other_store = StateStore(LocalStateBackend(str(tmp_path / "second")))
+    other_store.save(store.load())
+    pd.testing.assert_frame_equal(other_store.load().df, stored_pipeline.df)
+
+
+def test_state_store_saves_attributes_changed_in_place(tmp_path, stored_pipeline: Pipeline):
+    store = StateStore(LocalStateBackend(str(tmp_path)))
+    store.save(stored_pipeline)
+    loaded_pipeline = store.load()
+    loaded_pipeline.genotypes_dfs["G3"] = stored_pipeline.df.iloc[:1]
+    loaded_pipeline.list_of_good_visitors.add("982.091063520932")
+    store.save(loaded_pipeline)
+    reloaded_pipeline = store.load()
+    assert list(reloaded_pipeline.genotypes_dfs) == ["G1", "G2", "G3"]
+    assert reloaded_pipeline.list_of_good_visitors == {"985.113005100764", "982.091063520932"}
+
+
+def test_state_store_keeps_superseded_blobs_until_they_are_collected(tmp_path, stored_pipeline: Pipeline):
+    store = StateStore(LocalStateBackend(str(tmp_path)))
+    store.save(stored_pipeline)
+    blobs_count = len(list((tmp_path / "blobs").iterdir()))
+    older_pipeline, newer_pipeline = store.load(), store.load()
+    newer_pipeline.df = stored_pipeline.df.iloc[:1]
+    store.save(newer_pipeline)
+    pd.testing.assert_frame_equal(older_pipeline.df, stored_pipeline.df)  # a request still reading the older state
+    assert store.collect_superseded_blobs() == 0
+
+    assert store.collect_superseded_blobs(grace_seconds=-1) == 1
+    assert len(list((tmp_path / "blobs").iterdir())) == blobs_count  # the old df was replaced by the new one
+    pd.testing.assert_frame_equal(store.load().df, stored_pipeline.df.iloc[:1])
+    store.delete()
+    assert not list((tmp_path / "blobs").iterdir())
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from reader_files import (READER_COLUMNS, READER_DTYPES, detect_reader_file_format, parse_reader_file,
+                          parse_reader_rows, parse_scan_timestamps, read_excel_in_chunks, read_reader_file,
+                          read_text_log_from)
+
+
+@pytest.fixture
+def reader_workbook(tmp_path) -> str:
+    """ Reader export with extra columns and more rows than the chunk size used in the tests """
+    path = tmp_path / "reader.xlsx"
+    pd.DataFrame({"Reader ID": ["R1"] * 7,
+                  "Scan Date": ["12/05/2021"] * 4 + ["13/05/2021"] * 3,
+                  "Scan Time": ["10:00:00.100", "10:00:01.900", "10:00:03.000", "11:30:00.499",
+                                "08:00:00.000", "08:00:04.500", "09:10:11.120"],
+                  "Antenna ID": [1, 1, 3, 16, 2, 2, 5],
+                  "DEC Tag ID": ["985.113005100764", "985.113005100764", "982.091063520932", "985.113005100764",
+                                 "982.091063520932", "982.091063520932", "985.113005100764"]}).to_excel(path,
+                                                                                                        index=False)
+    return str(path)
+
+
+def test_read_excel_in_chunks_matches_read_excel(reader_workbook: str):
+    expected = parse_reader_rows(pd.read_excel(reader_workbook, usecols=READER_COLUMNS, dtype=READER_DTYPES))
+    parsed_rows, dates = read_excel_in_chunks(reader_workbook, chunk_rows=3)
+    assert parsed_rows["DEC Tag ID"].dtype == "category"  # the codes of the chunks, never decoded to objects
+    pd.testing.assert_frame_equal(parsed_rows.astype({"DEC Tag ID": object}), expected)
+    assert dates == ["12/05/2021", "13/05/2021"]
+
+
+def test_parse_reader_file_streams_big_workbooks(reader_workbook: str, monkeypatch):
+    parsed_rows, dates = parse_reader_file(reader_workbook)
+    assert parsed_rows["DEC Tag ID"].dtype == object and dates == ["12/05/2021", "13/05/2021"]
+    monkeypatch.setattr("reader_files.STREAMING_MIN_FILE_BYTES", 0)
+    streamed_rows, streamed_dates = parse_reader_file(reader_workbook)
+    assert streamed_rows["DEC Tag ID"].dtype == "category" and streamed_dates == dates
+    pd.testing.assert_frame_equal(streamed_rows.astype({"DEC Tag ID": object}), parsed_rows)
+
+
+def test_read_excel_in_chunks_requires_reader_columns(tmp_path):
+    path = tmp_path / "other.xlsx"
+    pd.DataFrame({"Scan Date": ["12/05/2021"], "Antenna ID": [1]}).to_excel(path, index=False)
+    with pytest.raises(ValueError):
+        read_excel_in_chunks(str(path))
+
+
+@pytest.mark.parametrize("delimiter", [",", ";", "\t"])
+def test_read_reader_file_detects_text_logs(reader_workbook: str, tmp_path, delimiter: str):
+    expected = pd.read_excel(reader_workbook, usecols=READER_COLUMNS, dtype=READER_DTYPES)
+    text_log = tmp_path / "reader.txt"
+    pd.read_excel(reader_workbook, dtype=str).to_csv(text_log, sep=delimiter, index=False)
+    assert detect_reader_file_format(str(text_log)) == "text"
+    assert detect_reader_file_format(reader_workbook) == "excel"
+    pd.testing.assert_frame_equal(read_reader_file(str(text_log)), expected)
+
+
+def test_read_text_log_from_reads_only_complete_new_lines(tmp_path):
+    text_log = tmp_path / "reader.csv"
+    text_log.write_text("Reader ID;Scan Date;Scan Time;Antenna ID;DEC Tag ID\nR1;12/05/2021;10:00:00.100;1;985.1\n"
+                        "R1;12/05/2021;10:00:0")
+    rows, offset = read_text_log_from(str(text_log))
+    assert rows["Scan Time"].tolist() == ["10:00:00.100"]
+    with open(text_log, "a") as file:
+        file.write("1.900;2;985.1\n")
+    rows, offset = read_text_log_from(str(text_log), offset)
+    assert rows.to_dict("list") == {"Scan Date": ["12/05/2021"], "Scan Time": ["10:00:01.900"], "Antenna ID": [2],
+                                    "DEC Tag ID": ["985.1"]}
+    assert read_text_log_from(str(text_log), offset)[0].empty and offset == text_log.stat().st_size
+
+
+def test_parse_scan_timestamps():
+    scan_dates = np.array(["12/05/2021", "13/05/2021", "13/05/2021", "13/05/2021"], dtype=object)
+    scan_times = np.array(["10:00:00.100", "23:59:59.999", "1:02:03.5", "10:00:00.123456"], dtype=object)
+    expected = pd.to_datetime(["2021-05-12 10:00:00.100", "2021-05-13 23:59:59.999", "2021-05-13 01:02:03.500",
+                               "2021-05-13 10:00:00.123"])  # not fixed-format times are parsed by pandas
+    np.testing.assert_array_equal(parse_scan_timestamps(scan_dates, scan_times),
+                                  expected.values.astype("datetime64[ms]").view("int64"))
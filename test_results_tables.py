@@ -0,0 +1,57 @@
+import zipfile
+
+import pandas as pd
+
+from results_tables import export_results_tables, open_results_table, query_results_table, write_results_table
+
+
+def write_table_for_testing(tmp_path) -> str:
+    path = str(tmp_path / "G1_table.arrow")
+    write_results_table(pd.DataFrame({"DEC Tag ID": pd.Categorical(["985.1", "985.2", "985.1", "985.3"]),
+                                      "Tag Alias": pd.Categorical(["1", "2", "1", "3"]),
+                                      "Scan Date and Time": pd.to_datetime(["2021-05-12 10:00:00",
+                                                                            "2021-05-12 11:00:00",
+                                                                            "2021-05-12 12:00:00",
+                                                                            "2021-05-13 10:00:00"]),
+                                      "Visit Duration": [5.0, 3.0, 8.0, None]}, index=[7, 3, 9, 1]), path)
+    return path
+
+
+def test_results_table_pages_are_sorted_and_filtered(tmp_path):
+    path = write_table_for_testing(tmp_path)
+    first_page = query_results_table(path, limit=2)
+    assert first_page["columns"] == ["DEC Tag ID", "Tag Alias", "Scan Date and Time", "Visit Duration"]
+    assert first_page["rows"] == [["985.1", "1", "2021-05-12 10:00:00", 5.0],
+                                  ["985.2", "2", "2021-05-12 11:00:00", 3.0]]
+    assert (first_page["filtered_rows"], first_page["total_rows"]) == (4, 4)
+    sorted_page = query_results_table(path, offset=1, limit=2, sort_by="Visit Duration", descending=True)
+    assert [row[3] for row in sorted_page["rows"]] == [5.0, 3.0]
+    by_alias = query_results_table(path, tag="1", start="2021-05-12 11:00")
+    assert [row[2] for row in by_alias["rows"]] == ["2021-05-12 12:00:00"]
+    assert query_results_table(path, tag="985.3", end="2021-05-13")["filtered_rows"] == 0
+
+
+def test_results_tables_are_mapped_again_when_replaced(tmp_path):
+    path = write_table_for_testing(tmp_path)
+    assert open_results_table(path) is open_results_table(path)
+    write_results_table(pd.DataFrame({"Visit Duration": [1.0]}), path)
+    assert open_results_table(path).num_rows == 1
+
+
+def test_exports_have_every_genotype_table(tmp_path):
+    write_table_for_testing(tmp_path)
+    write_results_table(pd.DataFrame({"DEC Tag ID": ["985.4"], "Tag Alias": ["4"],
+                                      "Scan Date and Time": pd.to_datetime(["2021-05-14 10:00:00"]),
+                                      "Visit Duration": [2.0]}), str(tmp_path / "G2_table.arrow"))
+    for export_format in ["xlsx", "csv", "parquet"]:
+        export_results_tables(str(tmp_path), ["G1", "G2"], export_format, str(tmp_path / f"export.{export_format}"))
+    sheets = pd.read_excel(tmp_path / "export.xlsx", sheet_name=None)
+    with zipfile.ZipFile(tmp_path / "export.csv") as archive:
+        csv_tables = {name[:-4]: pd.read_csv(archive.open(name)) for name in archive.namelist()}
+    for tables in (sheets, csv_tables):
+        assert list(tables) == ["G1", "G2"]
+        assert tables["G1"]["Visit Duration"].tolist()[:3] == [5.0, 3.0, 8.0]
+        assert tables["G2"]["Tag Alias"].tolist() == [4]
+    parquet_table = pd.read_parquet(tmp_path / "export.parquet")
+    assert parquet_table["DEC Tag ID"].tolist() == ["985.1", "985.2", "985.1", "985.3", "985.4"]
+    assert sheets["G1"]["Scan Date and Time"].equals(parquet_table["Scan Date and Time"].iloc[:4])
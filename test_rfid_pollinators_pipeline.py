@@ -1,9 +1,16 @@
-from typing import Dict
+import json
+import shutil
+from typing import Dict, List
 
 import pandas as pd
 import pytest
+from scipy.stats import ttest_ind
 
-from rfid_pollinators_pipeline import Pipeline
+from parsed_files_cache import ParsedFilesCache
+from pipeline_state import LocalStateBackend, StateStore
+from rfid_pollinators_pipeline import Pipeline, Plot, ReaderFilesError
+from synthetic_reads import generate_reader_exports, write_reader_exports
+from visit_statistics import DurationsSummary
 
 
 @pytest.fixture
@@ -59,6 +66,16 @@ def test_truncate_milliseconds(df_round_truncate_ms: pd.DataFrame):
     assert df_round_truncate_ms["time"].tolist() == TRUNCATED_MILLISECONDS
 
 
+def test_round_and_truncate_epoch_milliseconds(df_round_truncate_ms: pd.DataFrame):
+    """ Timestamps are stored as epoch milliseconds, rounding and truncation must give the same results """
+    df_ms = pd.DataFrame({'time': df_round_truncate_ms['time'].values.astype('datetime64[ms]').view('int64')})
+    Pipeline._round_milliseconds("time", df_ms)
+    assert pd.to_datetime(df_ms["time"], unit='ms').tolist() == ROUNDED_MILLISECONDS
+    df_ms = pd.DataFrame({'time': df_round_truncate_ms['time'].values.astype('datetime64[ms]').view('int64')})
+    Pipeline._truncate_milliseconds("time", df_ms)
+    assert pd.to_datetime(df_ms["time"], unit='ms').tolist() == TRUNCATED_MILLISECONDS
+
+
 def test__list_of_tags_with_all_genotypes_visited(dict_of_dataframes):
     pipeline_for_testing = Pipeline("imports/test_csv.csv")
     df = pd.concat(dict_of_dataframes.values())
@@ -66,3 +83,247 @@ def test__list_of_tags_with_all_genotypes_visited(dict_of_dataframes):
     genotypes_required = ["df_1", "df_2", "df_3"]
     pipeline_for_testing.genotypes_dfs = dict_of_dataframes
     assert pipeline_for_testing._obtain_good_visitors(all_tag_ids, genotypes_required) == TAG_IDS_IN_ALL_DATAFRAMES
+
+
+@pytest.fixture
+def reader_files_folder(tmp_path, monkeypatch) -> str:
+    """ Upload folder with two small reader exports, in the format of the Biomark reader software """
+    for count, file_name in enumerate(["exp_b.xlsx", "exp_a.xlsx"]):
+        pd.DataFrame({"Scan Date": ["12/05/2021", "13/05/2021"], "Scan Time": ["10:00:00.100", "11:00:00.600"],
+                      "Antenna ID": [count + 1, count + 4], "Reader ID": ["R1", "R1"],
+                      "DEC Tag ID": ["985.113005100764", "982.091063520932"]}).to_excel(tmp_path / file_name,
+                                                                                        index=False)
+    monkeypatch.setattr("rfid_pollinators_pipeline.UPLOAD_FOLDER", str(tmp_path) + "/")
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_preprocessing_of_data_keeps_files_order(reader_files_folder: str, tmp_path, workers: int):
+    pipeline_for_testing = Pipeline(["exp_b.xlsx", "exp_a.xlsx"])
+    pipeline_for_testing.preprocessing_of_data(ParsedFilesCache(folder=str(tmp_path / "cache")), workers=workers)
+    assert list(pipeline_for_testing.parsed_dataframes) == ["exp_b.xlsx", "exp_a.xlsx"]
+    assert pipeline_for_testing.antennas_info == {"exp_b.xlsx": [1, 4], "exp_a.xlsx": [2, 5]}
+    assert pipeline_for_testing.dates_of_dfs["exp_a.xlsx"] == ["12/05/2021", "13/05/2021"]
+
+
+def test_preprocessing_of_data_reports_every_failed_file(reader_files_folder: str, tmp_path):
+    (tmp_path / "broken.xlsx").write_bytes(b"not an excel file")
+    pipeline_for_testing = Pipeline(["exp_b.xlsx", "broken.xlsx", "missing.xlsx"])
+    with pytest.raises(ReaderFilesError) as error:
+        pipeline_for_testing.preprocessing_of_data(ParsedFilesCache(folder=str(tmp_path / "cache")), workers=2)
+    assert set(error.value.failed_files) == {"broken.xlsx", "missing.xlsx"}
+
+
+def test_assign_aliases_for_pollinators_encodes_text_columns():
+    pipeline_for_testing = Pipeline("imports/test_csv.csv")
+    pipeline_for_testing.df_with_genotypes = pd.DataFrame({"DEC Tag ID": ["0002", "0001", "0002", "0003"],
+                                                           "Genotype": ["B", "A", "A", "B"]})
+    pipeline_for_testing._assign_aliases_for_pollinators()
+    df = pipeline_for_testing.df_with_genotypes
+    assert pipeline_for_testing.pollinators_aliases == {"0002": "1", "0001": "2", "0003": "3"}
+    assert df["DEC Tag ID"].cat.categories.tolist() == ["0001", "0002", "0003"]  # sorted, codes sort like tags
+    assert df["Genotype"].cat.categories.tolist() == ["B", "A"]
+    assert df["Tag Alias"].astype(str).tolist() == ["1", "2", "1", "3"]
+
+
+def test_run_pipeline_only_reruns_stages_downstream_of_changed_parameters(reader_files_folder: str, tmp_path,
+                                                                           monkeypatch):
+    for method in ["_clean_up_cached_files", "_export_results_tables"]:
+        monkeypatch.setattr(Pipeline, method, lambda self: None)
+    pipeline_for_testing = Pipeline(["exp_b.xlsx", "exp_a.xlsx"])
+    pipeline_for_testing.preprocessing_of_data(ParsedFilesCache(folder=str(tmp_path / "cache")))
+    pipeline_for_testing.input_genotypes_data([{1: "G1", 4: "G2"}, {2: "G1", 5: "G2"}])
+    pipeline_for_testing.input_parameters_of_run("60", "round", [], "False")
+    pipeline_for_testing.run_pipeline()
+    first_fingerprints = dict(pipeline_for_testing.stages_fingerprints)
+    pipeline_for_testing.run_pipeline()
+    assert pipeline_for_testing.stages_fingerprints == first_fingerprints
+
+    pipeline_for_testing.input_parameters_of_run("30", "round", [], "False")
+    progress = []
+    pipeline_for_testing.run_pipeline(progress_callback=lambda stage, event: progress.append((stage, event)))
+    assert progress == [("join", "skipped"), ("selection", "skipped"), ("sorting", "skipped"),
+                        ("visits", "started"), ("visits", "finished"), ("statistics", "started"),
+                        ("statistics", "finished"), ("timeline", "started"), ("timeline", "finished"),
+                        ("exports", "started"), ("exports", "finished")]
+    changed_stages = {stage for stage, fingerprint in pipeline_for_testing.stages_fingerprints.items()
+                      if first_fingerprints[stage] != fingerprint}
+    assert changed_stages == {"visits", "statistics", "timeline"}
+    assert pipeline_for_testing.run_fingerprint == pipeline_for_testing.stages_fingerprints["timeline"]
+    assert [step["step"] for step in pipeline_for_testing.run_metrics] == ["pipeline.visits", "pipeline.statistics",
+                                                                           "pipeline.timeline", "pipeline.exports"]
+    assert pipeline_for_testing.ingestion_metrics[0]["rows"] == 4
+
+
+def test_sweep_max_time_between_signals_matches_runs(tmp_path, monkeypatch):
+    for method in ["_clean_up_cached_files", "_export_results_tables"]:
+        monkeypatch.setattr(Pipeline, method, lambda self: None)
+    monkeypatch.setattr("rfid_pollinators_pipeline.UPLOAD_FOLDER", str(tmp_path) + "/")
+    seconds = [0, 2, 3, 8, 9, 30, 31, 35, 60]
+    pd.DataFrame({"Scan Date": ["12/05/2021"] * 18,
+                  "Scan Time": [f"10:00:{second:02d}.000" for second in seconds] * 2,
+                  "Antenna ID": [1] * 9 + [2] * 9,
+                  "DEC Tag ID": ["985.113005100764"] * 9 + ["982.091063520932"] * 9}).to_excel(tmp_path / "exp.xlsx",
+                                                                                             index=False)
+    pipeline_for_testing = Pipeline(["exp.xlsx"])
+    pipeline_for_testing.preprocessing_of_data(ParsedFilesCache(folder=str(tmp_path / "cache")))
+    pipeline_for_testing.input_genotypes_data([{1: "G1", 2: "G2"}])
+    pipeline_for_testing.input_parameters_of_run("5", "round", [], "False")
+    sweep_table = pipeline_for_testing.sweep_max_time_between_signals([1, 5, 30])
+    assert sweep_table["Genotype"].tolist() == ["G1", "G2", "All genotypes"] * 3
+    for max_time in [1, 5, 30]:
+        pipeline_for_testing.input_parameters_of_run(str(max_time), "round", [], "False")
+        pipeline_for_testing.run_pipeline()
+        rows = sweep_table[sweep_table["Max Time Between Signals"] == max_time].set_index("Genotype")
+        assert rows.loc["All genotypes", "Visits Count"] == pipeline_for_testing.statistics["visits_count"]
+        assert rows.loc["G1", "Total Duration"] == pipeline_for_testing.genotypes_dfs["G1"]["Visit Duration"].sum()
+
+
+def test_plot_aggregates_charts_from_visits_cube():
+    visits = pd.DataFrame({"Tag Alias": ["1", "2", "1", "1"], "Genotype": ["A", "A", "B", "A"],
+                           "Visit Duration": [2.0, 4.0, 6.0, 3.0]})
+    plots = Plot({"A": visits[visits["Genotype"] == "A"], "B": visits[visits["Genotype"] == "B"],
+                  "C": visits.iloc[0:0]})
+    assert plots.visits_count_cube.to_dict() == {"A": {"1": 2, "2": 1}, "B": {"1": 1, "2": 0}}
+    assert plots.visits_sum_cube.loc["1"].tolist() == [5.0, 6.0]
+    count_per_genotype = plots._plot_visit_count_per_genotype().renderers[0].data_source.data
+    assert list(count_per_genotype["visits"]) == [3, 1, 0]
+    mean_per_pollinator = plots._plot_average_visit_duration_per_pollinator().renderers[0].data_source.data
+    assert list(mean_per_pollinator["means"]) == [3.67, 4.0]
+
+
+def test_plot_renders_chart_groups_as_json_items():
+    visits = pd.DataFrame({"Tag Alias": ["1", "2"], "Genotype": ["A", "B"], "Visit Duration": [2.0, 4.0],
+                           "Scan Date and Time": pd.to_datetime(["2021-05-12 10:00", "2021-05-13 11:00"])})
+    plots = Plot({"A": visits.iloc[:1], "B": visits.iloc[1:]})
+    for group in ["genotypes", "pollinators", "evolution"]:
+        chart_item = json.loads(plots.chart_group_to_json(group))
+        assert chart_item["root_id"] in json.dumps(chart_item["doc"])
+
+
+def test_t_tests_of_genotypes_match_scipy_and_are_plotted():
+    pipeline_for_testing = Pipeline("imports/test_csv.csv")
+    durations = {"A": [3.0, 5.0, 4.0, 8.0], "B": [9.0, 12.0, 10.0], "C": [7.0], "D": []}
+    pipeline_for_testing.genotypes_dfs = {genotype: pd.DataFrame({"Tag Alias": "1", "Genotype": genotype,
+                                                                  "Visit Duration": pd.Series(values, dtype=float)})
+                                          for genotype, values in durations.items()}
+    genotypes_summaries = {genotype: DurationsSummary(values) for genotype, values in durations.items()}
+    ttest_results = pipeline_for_testing._test_difference_means(genotypes_summaries)
+    assert list(ttest_results) == ["A and B", "A and C", "B and C"]
+    p_values = pipeline_for_testing.genotypes_t_tests["p"]
+    for genotypes in ttest_results:
+        genotype, genotype2 = genotypes.split(" and ")
+        expected = ttest_ind(pipeline_for_testing.genotypes_dfs[genotype]["Visit Duration"],
+                             pipeline_for_testing.genotypes_dfs[genotype2]["Visit Duration"])
+        assert ttest_results[genotypes] == [round(expected[0], 3), round(expected[1], 3)]
+        assert p_values.at[genotype2, genotype] == pytest.approx(expected[1])
+    pipeline_for_testing.ttest_correction = "bonferroni"
+    pipeline_for_testing._test_difference_means(genotypes_summaries)
+    corrected_p_values = pipeline_for_testing.genotypes_t_tests["p"]
+    assert corrected_p_values.at["A", "B"] == pytest.approx(min(1, p_values.at["A", "B"] * 3))
+    heatmap = Plot(pipeline_for_testing.genotypes_dfs,
+                   genotypes_t_tests=pipeline_for_testing.genotypes_t_tests)._plot_t_tests_p_values()
+    assert len(heatmap.renderers[0].data_source.data["p_values"]) == 16
+
+
+APPEND_GENOTYPES = [{1: "G1", 2: "G2"}, {1: "G1", 2: "G2", 3: "G3"}]
+
+
+@pytest.fixture
+def upload_append_workbook(tmp_path):
+    """ Uploads the workbooks of the append tests, written only once as workbooks store when they were created """
+    # The visit of the first tag at 10:00:03 continues in the second file, which also has new tags and a new genotype
+    reads = {"exp_1.xlsx": [("10:00:00.000", 1, "985.113005100764"), ("10:00:03.000", 1, "985.113005100764"),
+                            ("10:00:00.000", 2, "982.091063520932"), ("10:00:04.000", 2, "982.091063520932"),
+                            ("10:01:00.000", 2, "982.091063520932"), ("10:01:02.000", 2, "982.091063520932")],
+             "exp_2.xlsx": [("10:00:06.000", 1, "985.113005100764"), ("10:02:00.000", 3, "900.000000000001"),
+                            ("10:02:05.000", 3, "900.000000000001"), ("10:05:00.000", 2, "982.091063520932"),
+                            ("10:09:00.000", 1, "990.000000000002")]}
+    (tmp_path / "workbooks").mkdir()
+    for file_name, file_reads in reads.items():
+        pd.DataFrame({"Scan Date": "12/05/2021", "Scan Time": [read[0] for read in file_reads],
+                      "Antenna ID": [read[1] for read in file_reads],
+                      "DEC Tag ID": [read[2] for read in file_reads]}).to_excel(tmp_path / "workbooks" / file_name,
+                                                                                index=False)
+
+    def upload_reader_file(file_name: str, upload_folder):
+        upload_folder.mkdir(exist_ok=True)
+        shutil.copy(tmp_path / "workbooks" / file_name, upload_folder / file_name)
+    return upload_reader_file
+
+
+def run_append_pipeline(tmp_path, upload_reader_file, files: List[str], folder: str) -> Pipeline:
+    for file_name in files:
+        upload_reader_file(file_name, tmp_path / f"uploads_{folder}")
+    pipeline = Pipeline(files, upload_folder=str(tmp_path / f"uploads_{folder}"),
+                        exports_folder=str(tmp_path / f"exports_{folder}"))
+    pipeline.preprocessing_of_data(ParsedFilesCache(folder=str(tmp_path / "cache")))
+    pipeline.input_genotypes_data(APPEND_GENOTYPES[:len(files)])
+    pipeline.input_parameters_of_run("5", "round", [], "False")
+    pipeline.run_pipeline()
+    return pipeline
+
+
+def test_append_files_gives_the_results_of_a_run_with_all_the_files(tmp_path, upload_append_workbook):
+    appended = run_append_pipeline(tmp_path, upload_append_workbook, ["exp_1.xlsx"], "appended")
+    full = run_append_pipeline(tmp_path, upload_append_workbook, ["exp_1.xlsx", "exp_2.xlsx"], "full")
+    upload_append_workbook("exp_2.xlsx", tmp_path / "uploads_appended")
+    appended.append_files(["exp_2.xlsx"], APPEND_GENOTYPES[1:], ParsedFilesCache(folder=str(tmp_path / "cache")))
+
+    assert list(appended.genotypes_dfs) == ["G1", "G2", "G3"]
+    assert appended.genotypes_dfs["G1"]["Visit Duration"].tolist() == [6.0]
+    for genotype, visits in full.genotypes_dfs.items():
+        pd.testing.assert_frame_equal(appended.genotypes_dfs[genotype], visits)
+    assert appended.statistics == full.statistics
+    assert appended.pollinators_aliases == full.pollinators_aliases
+    assert appended.run_fingerprint == full.run_fingerprint
+    with pytest.raises(ValueError):
+        appended.append_files(["exp_2.xlsx"])
+
+
+def test_appended_files_are_saved_with_the_state_and_used_by_the_next_runs(tmp_path, upload_append_workbook):
+    store = StateStore(LocalStateBackend(str(tmp_path / "state")))
+    store.save(run_append_pipeline(tmp_path, upload_append_workbook, ["exp_1.xlsx"], "appended"))
+    appended = store.load()
+    upload_append_workbook("exp_2.xlsx", tmp_path / "uploads_appended")
+    appended.append_files(["exp_2.xlsx"], APPEND_GENOTYPES[1:], ParsedFilesCache(folder=str(tmp_path / "cache")))
+    store.save(appended)
+
+    reloaded = store.load()
+    assert list(reloaded.parsed_dataframes) == ["exp_1.xlsx", "exp_2.xlsx"]
+    assert list(reloaded.files_hashes) == list(reloaded.dates_of_dfs) == ["exp_1.xlsx", "exp_2.xlsx"]
+    full = run_append_pipeline(tmp_path, upload_append_workbook, ["exp_1.xlsx", "exp_2.xlsx"], "full")
+    for pipeline in (reloaded, full):  # a new parameter runs the stages again from the joined reads
+        pipeline.input_parameters_of_run("60", "round", [], "False")
+        pipeline.run_pipeline()
+    assert reloaded.statistics == full.statistics
+    assert reloaded.statistics["visits_mode"] == [6.0, 62.0]  # the visit of G1 continues in exp_2.xlsx
+
+
+def test_visits_statistics_match_the_statistics_of_the_joined_visits(tmp_path):
+    exports, genotypes_of_each_experiment = generate_reader_exports(3000, experiments=2, days=3, seed=11)
+    (tmp_path / "uploads").mkdir()
+    file_names = write_reader_exports(exports, str(tmp_path / "uploads"), "csv")
+    pipeline_for_testing = Pipeline(file_names, upload_folder=str(tmp_path / "uploads"),
+                                    exports_folder=str(tmp_path / "exports"))
+    pipeline_for_testing.preprocessing_of_data(ParsedFilesCache(folder=str(tmp_path / "cache")))
+    pipeline_for_testing.input_genotypes_data(genotypes_of_each_experiment)
+    pipeline_for_testing.input_parameters_of_run("7", "round", [], "False")
+    pipeline_for_testing.run_pipeline()
+
+    def durations_statistics(durations: pd.Series) -> dict:
+        return {"visits_count": len(durations), "visits_mean": round(durations.mean(), 2),
+                "visits_median": durations.median(), "visits_mode": durations.mode().tolist(),
+                "visits_std": round(durations.std(), 2)}
+
+    visits = pipeline_for_testing.joined_visits()
+    expected = durations_statistics(visits["Visit Duration"])
+    assert pipeline_for_testing.visits_statistics() == expected
+    assert {key: pipeline_for_testing.statistics[key] for key in expected} == expected
+    genotypes, tags = pipeline_for_testing.genotypes_names[:2], visits["Tag Alias"].unique()[:3].tolist()
+    days = visits["Scan Date and Time"].dt.floor("D")
+    first_day = days.min().strftime("%Y-%m-%d")
+    selected = visits["Genotype"].isin(genotypes) & visits["Tag Alias"].isin(tags) & (days == days.min())
+    assert 0 < selected.sum() < len(visits)
+    assert pipeline_for_testing.visits_statistics(genotypes, tags, first_day, first_day) == durations_statistics(
+        visits.loc[selected, "Visit Duration"])
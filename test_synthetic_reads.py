@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from reader_files import READER_COLUMNS, parse_scan_timestamps, read_reader_file
+from synthetic_reads import generate_reader_exports, write_reader_exports
+
+
+def test_generate_reader_exports_is_deterministic_and_has_every_read():
+    exports, genotypes_of_each_experiment = generate_reader_exports(5000, tags=20, antennas=8, genotypes=3, days=4,
+                                                                    experiments=2, seed=3)
+    assert sum(len(export) for export in exports) == 5000
+    for export in exports:
+        timestamps = parse_scan_timestamps(export["Scan Date"].values, export["Scan Time"].values)
+        assert (np.diff(timestamps) >= 0).all()  # exports are sorted by time, as the reader writes them
+    assert parse_scan_timestamps(exports[0]["Scan Date"].values, exports[0]["Scan Time"].values).max() < \
+        parse_scan_timestamps(exports[1]["Scan Date"].values, exports[1]["Scan Time"].values).min()
+    assert all(len(genotypes) == 8 and set(genotypes.values()) == {"Genotype 1", "Genotype 2", "Genotype 3"}
+               for genotypes in genotypes_of_each_experiment)
+    assert exports[0]["DEC Tag ID"].nunique() <= 20 and set(exports[0]["Antenna ID"]) <= set(range(1, 9))
+    same_exports, _ = generate_reader_exports(5000, tags=20, antennas=8, genotypes=3, days=4, experiments=2, seed=3)
+    for export, same_export in zip(exports, same_exports):
+        pd.testing.assert_frame_equal(export, same_export)
+
+
+@pytest.mark.parametrize("file_format", ["xlsx", "csv"])
+def test_written_reader_exports_are_parsed_as_the_generated_ones(tmp_path, file_format: str):
+    exports, _ = generate_reader_exports(300, seed=1)
+    file_names = write_reader_exports(exports, str(tmp_path), file_format)
+    assert file_names == [f"synthetic_1.{file_format}"]
+    pd.testing.assert_frame_equal(read_reader_file(str(tmp_path / file_names[0])), exports[0][READER_COLUMNS])
+    with pytest.raises(ValueError):
+        write_reader_exports(exports, str(tmp_path), "ods")
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from visit_segmentation import (continue_visits, drop_last_visits_of_genotypes, reads_to_resegment, segment_visits,
+                                sort_reads)
+
+SECOND = 1000  # timestamps are epoch milliseconds
+
+
+def test_sort_reads_removes_duplicates_and_computes_deltas():
+    sorted_reads = sort_reads(genotype_codes=np.array([0, 0, 0, 1, 0]), tag_codes=np.array([1, 0, 0, 0, 0]),
+                              timestamps=np.array([5, 3, 1, 2, 3]) * SECOND, antennas=np.array([1, 1, 1, 2, 1]))
+    assert sorted_reads["Read Position"].tolist() == [2, 1, 0, 3]  # input position 4 is a duplicate of 1
+    np.testing.assert_array_equal(sorted_reads["Time Delta"].values, [np.nan, 2, np.nan, np.nan])
+
+
+def test_segment_visits_matches_original_semantics():
+    # Genotype 0: tag 0 visits [0, 2, 4] (4 sec) and [20] (single signal), tag 1 visits [0, 3] (3 sec, last visit)
+    # Genotype 1: tag 0 visits [0, 1] (1 sec) and [10, 10.6] (the delta is truncated to 0, two separate visits)
+    sorted_reads = sort_reads(genotype_codes=np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 1]),
+                              tag_codes=np.array([0, 0, 0, 0, 1, 1, 0, 0, 0, 0]),
+                              timestamps=np.array([0, 2, 4, 20, 0, 3, 0, 1, 10, 10.6]) * SECOND,
+                              antennas=np.ones(10))
+    visits = segment_visits(sorted_reads, max_time_between_signals=7)
+    assert visits["Read Position"].tolist() == [2, 7]  # the latest signal of each visit
+    assert visits["Visit Duration"].tolist() == [4, 1]
+    assert visits["Genotype Code"].tolist() == [0, 1]
+
+
+def test_segment_visits_without_reads():
+    sorted_reads = sort_reads(*[np.array([], dtype=np.int64)] * 4)
+    assert segment_visits(sorted_reads, 7).empty
+    pd.testing.assert_index_equal(segment_visits(sorted_reads, 7).columns,
+                                  pd.Index(["Read Position", "Genotype Code", "Tag Code", "Timestamp",
+                                            "Visit Duration"]))
+
+
+def test_inserted_reads_only_resegment_the_visits_they_can_continue():
+    # Tag 0 visits [0, 2] and [20, 22] before the new reads at 25 and 26, tag 1 has no new reads
+    genotype_codes, tag_codes = np.zeros(8, dtype=np.int64), np.array([0, 0, 0, 0, 1, 1, 0, 0])
+    timestamps = np.array([0, 2, 20, 22, 0, 3, 25, 26]) * SECOND
+    old_reads = sort_reads(genotype_codes[:6], tag_codes[:6], timestamps[:6], np.ones(6))
+    all_visits = segment_visits(old_reads, 7, include_last_visits=True)
+    pd.testing.assert_frame_equal(drop_last_visits_of_genotypes(old_reads, all_visits, 7), segment_visits(old_reads, 7))
+
+    sorted_reads = sort_reads(genotype_codes, tag_codes, timestamps, np.ones(8), stable=True)
+    resegmented = reads_to_resegment(sorted_reads, sorted_reads["Read Position"].values >= 6, 7)
+    assert sorted_reads["Read Position"].values[resegmented].tolist() == [2, 3, 6, 7]
+    visits = segment_visits(sorted_reads[resegmented], 7, include_last_visits=True)
+    assert visits["Visit Duration"].tolist() == [6]  # the open visit [20, 22] continues with the new reads
+
+
+def test_continued_visits_are_the_visits_of_all_the_reads_at_once():
+    reads = pd.DataFrame({"Genotype": ["A"] * 6 + ["B"] * 2, "DEC Tag ID": ["900"] * 4 + ["901"] * 2 + ["900"] * 2,
+                          "Timestamp": np.array([0, 2, 4, 20, 0, 3, 0, 1]) * SECOND, "Antenna ID": np.ones(8)})
+    chunks = [reads.iloc[[0, 4, 6]], reads.iloc[[1, 5]], reads.iloc[[2, 1, 7]], reads.iloc[[3]]]  # 1 is repeated
+    open_visits = pd.DataFrame(columns=["Genotype", "DEC Tag ID", "Timestamp", "Antenna ID", "Visit Duration"])
+    closed_visits = []
+    for chunk in chunks:
+        visits, open_visits = continue_visits(open_visits, chunk, 7)
+        closed_visits.append(visits)
+    assert pd.concat(closed_visits)["Visit Duration"].tolist() == [4]  # A 900 [0, 2, 4], closed by the read at 20
+    assert open_visits.sort_values(["Genotype", "DEC Tag ID"])["Visit Duration"].tolist() == [0, 3, 1]
+
+    # A read older than the latest one of its genotype and tag is too late to be segmented
+    visits, late_open_visits = continue_visits(open_visits, reads.iloc[[2]], 7)
+    assert visits.empty
+    pd.testing.assert_frame_equal(late_open_visits.sort_values("Genotype", ignore_index=True),
+                                  open_visits.sort_values("Genotype", ignore_index=True), check_dtype=False)
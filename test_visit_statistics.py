@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from visit_statistics import DurationsSummary, merge_visits_summaries, select_durations_summary, summarize_visits
+
+
+def test_merged_summaries_give_the_statistics_of_all_the_durations():
+    durations = np.random.default_rng(0).integers(1, 60, 500).astype(float)
+    merged = DurationsSummary(durations[:120]).merge(DurationsSummary()).merge(DurationsSummary(durations[120:]))
+    series = pd.Series(durations)
+    assert merged.count == len(durations)
+    assert merged.mean == pytest.approx(series.mean())
+    assert merged.std == pytest.approx(series.std())
+    assert merged.median == series.median()
+    assert merged.modes == series.mode().tolist()
+    for q in (0, 0.1, 0.25, 0.75, 1):
+        assert merged.quantile(q) == series.quantile(q)
+    assert np.isnan(DurationsSummary().median) and DurationsSummary().modes == []
+
+
+def test_statistics_of_subsets_of_the_visits_summaries():
+    genotypes_dfs = {"A": pd.DataFrame({"DEC Tag ID": ["1", "1", "2"], "Tag Alias": ["a", "a", "b"],
+                                        "Scan Date and Time": pd.to_datetime(["2021-05-01 10:00", "2021-05-01 11:00",
+                                                                              "2021-05-02 10:00"]),
+                                        "Visit Duration": [4.0, 4.0, 10.0]}),
+                     "B": pd.DataFrame({"DEC Tag ID": ["2"], "Tag Alias": ["b"],
+                                        "Scan Date and Time": pd.to_datetime(["2021-05-02 12:00"]),
+                                        "Visit Duration": [7.0]})}
+    summaries = summarize_visits(genotypes_dfs)
+    assert summaries["Count"].sum() == 4
+    assert select_durations_summary(summaries, genotypes=["A"]).modes == [4.0]
+    assert select_durations_summary(summaries, tags=["b"]).median == 8.5
+    assert select_durations_summary(summaries, start_day="2021-05-02").count == 2
+    assert select_durations_summary(summaries, end_day="2021-05-01 23:00").mean == 4.0
+    doubled = merge_visits_summaries(summaries, summaries)
+    assert len(doubled) == len(summaries) and doubled["Count"].sum() == 8
+    assert merge_visits_summaries().empty
@@ -0,0 +1,47 @@
+import pandas as pd
+
+from visits_timeline import (ALL_GENOTYPES, TIMELINE_RESOLUTIONS, build_visits_timeline, select_timeline_range,
+                             update_visits_timeline)
+
+MINUTE, HOUR = TIMELINE_RESOLUTIONS["minute"], TIMELINE_RESOLUTIONS["hour"]
+
+
+def visits_for_testing() -> pd.DataFrame:
+    return pd.DataFrame({"Genotype": ["A", "B", "A", "A"],
+                         "Scan Date and Time": pd.to_datetime(["2021-05-12 10:00:10", "2021-05-12 10:00:50",
+                                                               "2021-05-12 10:02:00", "2021-05-13 09:30:00"])})
+
+
+def test_rollups_of_each_resolution_add_up_to_the_visits():
+    timeline = build_visits_timeline(visits_for_testing())
+    assert timeline["minute"][ALL_GENOTYPES].tolist() == [2, 1, 1]
+    assert timeline["minute"]["A"].tolist() == [1, 1, 1]
+    assert timeline["hour"][ALL_GENOTYPES].tolist() == [3, 1]
+    assert timeline["day"].to_dict("list") == {"A": [2, 1], "B": [1, 0], ALL_GENOTYPES: [3, 1]}
+    assert timeline["day"].index[0] == pd.Timestamp("2021-05-12").value // 1000000
+
+
+def test_select_timeline_range_fills_empty_buckets_at_the_finest_resolution_that_fits():
+    timeline = build_visits_timeline(visits_for_testing())
+    start = pd.Timestamp("2021-05-12 10:00").value // 1000000
+    selection = select_timeline_range(timeline, start, start + 5 * MINUTE, genotype="A")
+    assert selection["resolution"] == "minute"
+    assert selection["buckets"] == [start + minute * MINUTE for minute in range(6)]
+    assert selection["visits"] == [1, 0, 1, 0, 0, 0]
+    whole_timeline = select_timeline_range(timeline, max_points=30)
+    assert (whole_timeline["resolution"], len(whole_timeline["buckets"])) == ("hour", 24)
+    assert whole_timeline["buckets"][0] == start and sum(whole_timeline["visits"]) == 4
+    assert select_timeline_range(timeline, max_points=1)["resolution"] == "day"
+
+
+def test_empty_timeline():
+    timeline = build_visits_timeline(visits_for_testing().iloc[0:0])
+    assert all(rollup.empty for rollup in timeline.values())
+    assert select_timeline_range(timeline)["buckets"] == []
+
+
+def test_update_timeline_with_added_and_removed_visits():
+    visits = visits_for_testing().astype({"Genotype": pd.CategoricalDtype(["A", "B"])})
+    timeline = update_visits_timeline(build_visits_timeline(visits.iloc[:2]), visits.iloc[1:], visits.iloc[1:2])
+    for resolution, rollup in build_visits_timeline(visits).items():
+        pd.testing.assert_frame_equal(timeline[resolution], rollup)
@@ -0,0 +1,22 @@
+import os
+import time
+
+from workspaces import Workspace, collect_expired_workspaces
+
+
+def test_workspace_ids_are_validated(tmp_path):
+    workspace = Workspace("../../etc", root=str(tmp_path))
+    assert workspace.workspace_id != "../../etc"
+    assert Workspace(workspace.workspace_id, root=str(tmp_path)).folder == workspace.folder
+
+
+def test_collect_expired_workspaces_keeps_recent_ones(tmp_path):
+    old_workspace, recent_workspace = Workspace(root=str(tmp_path)), Workspace(root=str(tmp_path))
+    for workspace in (old_workspace, recent_workspace):
+        workspace.create()
+        open(os.path.join(workspace.uploads_folder, "exp.xlsx"), "w").close()
+    two_hours_ago = time.time() - 2 * 60 * 60
+    os.utime(old_workspace.folder, (two_hours_ago, two_hours_ago))
+    assert collect_expired_workspaces(str(tmp_path), ttl_seconds=60 * 60) == [old_workspace.workspace_id]
+    assert not os.path.exists(old_workspace.folder)
+    assert os.path.exists(recent_workspace.uploads_folder)
@@ -0,0 +1,199 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+MILLISECONDS_PER_SECOND = 1000
+
+
+def sort_reads(genotype_codes: np.ndarray, tag_codes: np.ndarray, timestamps: np.ndarray,
+               antennas: np.ndarray, stable: bool = False) -> pd.DataFrame:
+    """
+    Sorts all the reads of the dataset at once by genotype, tag and time, and removes the duplicated reads
+    (same genotype, tag, time and antenna).
+    Timestamps are epoch milliseconds (int64). Genotypes and tags are integer codes of a categorical.
+    With stable, the first of the duplicated reads is the one kept, and runs of reads already sorted are merged in
+    linear time (timsort), so new reads are inserted into sorted ones by sorting the concatenation of both.
+    Returns a dataframe with the position of each read in the input arrays, its codes, its timestamp and
+    the time delta in whole seconds with the previous read of the same genotype and tag (NaN for the first one).
+    """
+    genotype_codes = np.asarray(genotype_codes, dtype=np.int64)
+    tag_codes = np.asarray(tag_codes, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    antennas = np.asarray(antennas, dtype=np.int64)
+    # A single key for genotype and tag, so the sort only has three keys (lexsort sorts by the last one first)
+    group_keys = genotype_codes * (tag_codes.max(initial=0) + 2) + tag_codes
+    order = _sort_order(group_keys, timestamps, antennas, stable)
+    group_keys, timestamps, antennas = group_keys[order], timestamps[order], antennas[order]
+
+    same_group = np.zeros(len(order), dtype=bool)
+    same_group[1:] = group_keys[1:] == group_keys[:-1]
+    duplicated = np.zeros(len(order), dtype=bool)
+    duplicated[1:] = same_group[1:] & (timestamps[1:] == timestamps[:-1]) & (antennas[1:] == antennas[:-1])
+    if duplicated.any():
+        order, timestamps = order[~duplicated], timestamps[~duplicated]
+        same_group = same_group[~duplicated]
+
+    time_deltas = np.full(len(order), np.nan)
+    time_deltas[1:] = (timestamps[1:] - timestamps[:-1]) // MILLISECONDS_PER_SECOND  # truncated, as astype('m8[s]')
+    time_deltas[~same_group] = np.nan
+    return pd.DataFrame({"Read Position": order,
+                         "Genotype Code": genotype_codes[order],
+                         "Tag Code": tag_codes[order],
+                         "Timestamp": timestamps,
+                         "Time Delta": time_deltas})
+
+
+def _sort_order(group_keys: np.ndarray, timestamps: np.ndarray, antennas: np.ndarray,
+                stable: bool = False) -> np.ndarray:
+    """
+    Returns the indices that sort the reads by group, time and antenna.
+    When the three ranges fit together in an int64, they are packed into one key and sorted with a single argsort,
+    which is several times faster than a lexsort of three keys.
+    """
+    if len(group_keys) == 0:
+        return np.array([], dtype=np.int64)
+    ranges = []
+    for keys in (group_keys, timestamps, antennas):
+        minimum = keys.min()
+        ranges.append((keys - minimum, int(keys.max() - minimum) + 1))
+    if ranges[0][1] * ranges[1][1] * ranges[2][1] >= 2 ** 63:
+        return np.lexsort((antennas, timestamps, group_keys))
+    (group_offsets, _), (time_offsets, time_range), (antenna_offsets, antenna_range) = ranges
+    packed_keys = (group_offsets * time_range + time_offsets) * antenna_range + antenna_offsets
+    return np.argsort(packed_keys, kind='stable' if stable else None)
+
+
+def segment_visits(sorted_reads: pd.DataFrame, max_time_between_signals: float,
+                   include_last_visits: bool = False) -> pd.DataFrame:
+    """
+    Groups the sorted reads into visits and sums their durations, in one pass over the whole dataset.
+    A read continues the visit of the previous one when both have the same genotype and tag and the time between
+    them is more than 0 and at most max_time_between_signals seconds. Otherwise, it starts a new visit.
+    The duration of a visit is the sum of the time deltas of the reads that continued it.
+    Each visit is represented by its latest read, so "Read Position" and "Timestamp" are those of the last signal.
+    As in the original per-genotype calculation, visits with a duration of 0 (a single signal) and the last visit
+    of each genotype (there is no next read to close it) are not returned, unless include_last_visits.
+    """
+    time_deltas = sorted_reads["Time Delta"].values
+    genotype_codes = sorted_reads["Genotype Code"].values
+    valid_deltas = (time_deltas > 0) & (time_deltas <= max_time_between_signals)  # NaN compares as False
+    visit_starts = np.flatnonzero(~valid_deltas)
+    if len(visit_starts) == 0:
+        return _empty_visits()
+    durations = np.add.reduceat(np.where(valid_deltas, time_deltas, 0), visit_starts)
+    visit_ends = np.append(visit_starts[1:] - 1, len(time_deltas) - 1)
+
+    last_of_genotype = np.ones(len(visit_ends), dtype=bool)
+    not_last_read = visit_ends < len(time_deltas) - 1
+    last_of_genotype[not_last_read] = (genotype_codes[visit_ends[not_last_read]]
+                                       != genotype_codes[visit_ends[not_last_read] + 1])
+    kept_visits = (durations != 0) if include_last_visits else (durations != 0) & ~last_of_genotype
+    visit_ends = visit_ends[kept_visits]
+    return pd.DataFrame({"Read Position": sorted_reads["Read Position"].values[visit_ends],
+                         "Genotype Code": genotype_codes[visit_ends],
+                         "Tag Code": sorted_reads["Tag Code"].values[visit_ends],
+                         "Timestamp": sorted_reads["Timestamp"].values[visit_ends],
+                         "Visit Duration": durations[kept_visits]})
+
+
+def drop_last_visits_of_genotypes(sorted_reads: pd.DataFrame, visits: pd.DataFrame,
+                                  max_time_between_signals: float) -> pd.DataFrame:
+    """
+    Removes the last visit of each genotype from the visits of segment_visits with include_last_visits, which gives
+    the same visits as segment_visits without it. The last visit of a genotype is only one of the visits when the
+    last read of the genotype continues a visit (otherwise it is a single signal, with a duration of 0).
+    """
+    genotype_codes = sorted_reads["Genotype Code"].values
+    if len(genotype_codes) == 0:
+        return visits
+    last_reads = np.flatnonzero(np.append(genotype_codes[1:] != genotype_codes[:-1], True))
+    time_deltas = sorted_reads["Time Delta"].values[last_reads]
+    continued = (time_deltas > 0) & (time_deltas <= max_time_between_signals)
+    last_visits = sorted_reads["Read Position"].values[last_reads[continued]]
+    return visits[~np.isin(visits["Read Position"].values, last_visits)]
+
+
+def reads_to_resegment(sorted_reads: pd.DataFrame, inserted_reads: np.ndarray,
+                       max_time_between_signals: float) -> np.ndarray:
+    """
+    Returns which of the sorted reads have to be segmented again after inserting new reads (inserted_reads is True
+    for them), as a mask: for each genotype and tag with new reads, the reads from the start of the visit that the
+    first new read could continue (or from the new read itself) to the last read of the genotype and tag.
+    The visits before are not changed by the new reads, since the reads and time deltas before the first new read
+    are the same, so segment_visits only has to go through the returned reads.
+    """
+    time_deltas = sorted_reads["Time Delta"].values
+    reads_count = len(time_deltas)
+    group_starts = np.isnan(time_deltas)  # only the first read of each genotype and tag has no previous read
+    visit_starts = ~((time_deltas > 0) & (time_deltas <= max_time_between_signals))
+    group_ids = np.cumsum(group_starts) - 1
+    last_visit_starts = np.maximum.accumulate(np.where(visit_starts, np.arange(reads_count), 0))
+    inserted_positions = np.flatnonzero(inserted_reads)
+    affected_groups, first_positions = np.unique(group_ids[inserted_positions], return_index=True)
+    first_inserted = inserted_positions[first_positions]
+    window_starts = np.where(group_starts[first_inserted], first_inserted,
+                             last_visit_starts[np.maximum(first_inserted - 1, 0)])
+    window_ends = np.append(np.flatnonzero(group_starts), reads_count)[affected_groups + 1]
+    boundaries = np.zeros(reads_count + 1, dtype=np.int64)
+    np.add.at(boundaries, window_starts, 1)
+    np.add.at(boundaries, window_ends, -1)
+    return np.cumsum(boundaries[:-1]) > 0
+
+
+def continue_visits(open_visits: pd.DataFrame, reads: pd.DataFrame,
+                    max_time_between_signals: float) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Segments a chunk of a stream of reads, continuing the visits left open by the previous chunks.
+    open_visits has a row for each genotype and tag ("Genotype", "DEC Tag ID") with its latest read ("Timestamp",
+    "Antenna ID") and the duration of its visit so far ("Visit Duration", 0 for a single signal), and reads have
+    the same columns but the duration. The latest read of each genotype and tag is segmented again with the chunk,
+    so a visit continues from one chunk to the next as if all the reads were segmented at once. Reads older than
+    the latest read of their genotype and tag (by time and antenna, the order of the sorted reads) arrive too late to
+    be segmented and are dropped.
+    Returns the visits closed by the chunk (those with a duration, represented by their latest read) and the visits
+    still open after it, which can be continued by the next chunk.
+    """
+    keys = ["Genotype", "DEC Tag ID"]
+    latest_reads = open_visits.set_index(keys)[["Timestamp", "Antenna ID"]].reindex(
+        pd.MultiIndex.from_frame(reads[keys]))
+    with np.errstate(invalid='ignore'):  # NaN (no open visit) compares as False
+        late_reads = ((reads["Timestamp"].values < latest_reads["Timestamp"].values)
+                      | ((reads["Timestamp"].values == latest_reads["Timestamp"].values)
+                         & (reads["Antenna ID"].values < latest_reads["Antenna ID"].values)))
+    reads = reads[~late_reads]
+    chunk = pd.concat([open_visits[keys + ["Timestamp", "Antenna ID"]], reads[keys + ["Timestamp", "Antenna ID"]]],
+                      ignore_index=True)
+    if not len(chunk):
+        return chunk.assign(**{"Visit Duration": np.array([], dtype=np.float64)}), open_visits
+    genotype_codes, genotypes = pd.factorize(chunk["Genotype"])
+    tag_codes, tags = pd.factorize(chunk["DEC Tag ID"])
+    sorted_reads = sort_reads(genotype_codes, tag_codes, chunk["Timestamp"].values, chunk["Antenna ID"].values,
+                              stable=True)  # an open visit goes before a duplicate of its latest read
+    positions = sorted_reads["Read Position"].values
+    time_deltas = sorted_reads["Time Delta"].values
+    valid_deltas = (time_deltas > 0) & (time_deltas <= max_time_between_signals)
+    visit_starts = np.flatnonzero(~valid_deltas)
+    durations = np.add.reduceat(np.where(valid_deltas, time_deltas, 0), visit_starts)
+    continued = positions[visit_starts] < len(open_visits)  # visits that start with the latest read of an open one
+    durations[continued] += open_visits["Visit Duration"].values[positions[visit_starts[continued]]].astype(np.float64)
+    visit_ends = np.append(visit_starts[1:] - 1, len(positions) - 1)
+    still_open = np.append(np.isnan(time_deltas[visit_ends[:-1] + 1]), True)  # the last visit of each genotype and tag
+
+    def visits_of(selected: np.ndarray) -> pd.DataFrame:
+        ends = positions[visit_ends[selected]]
+        return pd.DataFrame({"Genotype": np.asarray(genotypes)[genotype_codes[ends]],
+                             "DEC Tag ID": np.asarray(tags)[tag_codes[ends]],
+                             "Timestamp": chunk["Timestamp"].values[ends].astype(np.int64),
+                             "Antenna ID": chunk["Antenna ID"].values[ends].astype(np.int64),
+                             "Visit Duration": durations[selected]})
+
+    return visits_of(~still_open & (durations != 0)), visits_of(still_open)
+
+
+def _empty_visits() -> pd.DataFrame:
+    return pd.DataFrame({"Read Position": np.array([], dtype=np.int64),
+                         "Genotype Code": np.array([], dtype=np.int64),
+                         "Tag Code": np.array([], dtype=np.int64),
+                         "Timestamp": np.array([], dtype=np.int64),
+                         "Visit Duration": np.array([], dtype=np.float64)})
@@ -0,0 +1,133 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+SUMMARY_KEYS = ['Genotype', 'DEC Tag ID', 'Tag Alias', 'Day']
+
+
+class DurationsSummary:
+    """
+    Mergeable summary of a set of visit durations, from which their descriptive statistics are obtained without the
+    durations themselves: count, mean and sum of squared deviations (M2) for the moments, and the count of each
+    distinct duration for the quantiles and the mode.
+    Visit durations are whole seconds, so the counts of the distinct durations are few (at most the longest visit)
+    and give exact quantiles, unlike an approximate quantile sketch.
+    Two summaries are merged without going back to the visits, as in Chan et al. parallel variance algorithm.
+    """
+
+    def __init__(self, durations: np.ndarray = None, counts: np.ndarray = None):
+        """ Summarizes the durations, or the distinct durations with their counts if counts is given """
+        self.durations, self.counts = _count_durations(np.asarray([] if durations is None else durations),
+                                                       None if counts is None else np.asarray(counts))
+        self.count = int(self.counts.sum())
+        self.mean = float(np.dot(self.durations, self.counts) / self.count) if self.count else np.nan
+        self.m2 = float(np.dot(self.counts, (self.durations - self.mean) ** 2)) if self.count else np.nan
+
+    def merge(self, other: 'DurationsSummary') -> 'DurationsSummary':
+        """ Returns the summary of the durations of both summaries, combining their moments and counts """
+        if not self.count or not other.count:
+            return other if not self.count else self
+        merged = DurationsSummary.__new__(DurationsSummary)
+        merged.durations, merged.counts = _count_durations(np.concatenate([self.durations, other.durations]),
+                                                           np.concatenate([self.counts, other.counts]))
+        merged.count = self.count + other.count
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.count / merged.count
+        merged.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / merged.count
+        return merged
+
+    @staticmethod
+    def merge_all(summaries: Iterable['DurationsSummary']) -> 'DurationsSummary':
+        merged = DurationsSummary()
+        for summary in summaries:
+            merged = merged.merge(summary)
+        return merged
+
+    @property
+    def std(self) -> float:
+        """ Standard deviation with 1 degree of freedom, as pandas """
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+    @property
+    def median(self) -> float:
+        if not self.count:
+            return np.nan
+        return (self._value_at(int(np.floor((self.count - 1) / 2))) + self._value_at(self.count // 2)) / 2
+
+    @property
+    def modes(self) -> List[float]:
+        """ The most frequent durations, sorted """
+        return self.durations[self.counts == self.counts.max()].tolist() if self.count else []
+
+    def quantile(self, q: float) -> float:
+        """ Quantile with linear interpolation between the closest durations, as pandas """
+        if not self.count:
+            return np.nan
+        position = q * (self.count - 1)
+        lower, upper = self._value_at(int(np.floor(position))), self._value_at(int(np.ceil(position)))
+        fraction = position - np.floor(position)
+        difference = upper - lower
+        # Same interpolation as numpy, which is exact at both ends
+        return upper - difference * (1 - fraction) if fraction >= 0.5 else lower + difference * fraction
+
+    def _value_at(self, position: int) -> float:
+        """ Returns the duration at a position of the sorted durations """
+        return float(self.durations[np.searchsorted(np.cumsum(self.counts), position, side='right')])
+
+
+def _count_durations(durations: np.ndarray, counts: np.ndarray = None):
+    """ Returns the sorted distinct durations and how many times each one appears """
+    if counts is None:
+        return np.unique(durations.astype(np.float64), return_counts=True)
+    distinct_durations, inverse = np.unique(durations.astype(np.float64), return_inverse=True)
+    return distinct_durations, np.bincount(inverse, weights=counts, minlength=len(distinct_durations)).astype(np.int64)
+
+
+def summarize_visits(genotypes_dfs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Returns the counts of each distinct visit duration of each genotype, pollinator and day.
+    These counts are the accumulators of the statistics of any subset of the visits: a genotype, some pollinators,
+    a range of days, or the visits of new data once merged with merge_visits_summaries.
+    """
+    summaries = []
+    for genotype, dataframe in genotypes_dfs.items():
+        days = dataframe['Scan Date and Time'].dt.floor('D').rename('Day')
+        summary = dataframe.groupby(['DEC Tag ID', 'Tag Alias', days, 'Visit Duration'], observed=True).size()
+        summary = summary.rename('Count').reset_index()
+        summaries.append(summary.astype({'DEC Tag ID': str, 'Tag Alias': str}).assign(Genotype=genotype))
+    return merge_visits_summaries(*summaries)
+
+
+def merge_visits_summaries(*summaries: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges summaries of visits, adding up the counts of the same genotype, pollinator, day and duration.
+    Summaries of removed visits have negative counts, and the durations whose counts add up to 0 are dropped.
+    """
+    summaries = [summary for summary in summaries if len(summary)]
+    if not summaries:
+        return pd.DataFrame({'Genotype': pd.Series(dtype=str), 'DEC Tag ID': pd.Series(dtype=str),
+                             'Tag Alias': pd.Series(dtype=str), 'Day': pd.Series(dtype='datetime64[ns]'),
+                             'Visit Duration': pd.Series(dtype=np.float64), 'Count': pd.Series(dtype=np.int64)})
+    merged = pd.concat(summaries, ignore_index=True)
+    merged = merged.groupby(SUMMARY_KEYS + ['Visit Duration'], sort=False)['Count'].sum().reset_index()
+    return merged[merged['Count'] != 0].reset_index(drop=True)
+
+
+def select_durations_summary(visits_summaries: pd.DataFrame, genotypes: List[str] = None, tags: List[str] = None,
+                             start_day: str = None, end_day: str = None) -> DurationsSummary:
+    """
+    Returns the DurationsSummary of the visits of some genotypes, pollinators (DEC Tag ID or alias) and days
+    (all of them if None), from the summaries of the visits
+    """
+    selected = np.ones(len(visits_summaries), dtype=bool)
+    if genotypes is not None:
+        selected &= visits_summaries['Genotype'].isin(genotypes).values
+    if tags is not None:
+        selected &= (visits_summaries['DEC Tag ID'].isin(tags) | visits_summaries['Tag Alias'].isin(tags)).values
+    if start_day:
+        selected &= (visits_summaries['Day'] >= pd.Timestamp(start_day).floor('D')).values
+    if end_day:
+        selected &= (visits_summaries['Day'] <= pd.Timestamp(end_day).floor('D')).values
+    return DurationsSummary(visits_summaries['Visit Duration'].values[selected],
+                            visits_summaries['Count'].values[selected])
@@ -0,0 +1,82 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+TIMELINE_RESOLUTIONS = {"minute": 60 * 1000, "hour": 60 * 60 * 1000, "day": 24 * 60 * 60 * 1000}  # milliseconds
+TIMELINE_MAX_POINTS = 1000
+ALL_GENOTYPES = "All genotypes"
+
+
+def build_visits_timeline(visits: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Builds a pyramid of visit counts: one rollup for each resolution of TIMELINE_RESOLUTIONS.
+    Each rollup has the start of its buckets as index (epoch milliseconds) and a column with the number of visits of
+    each genotype, plus the ALL_GENOTYPES column. Only the buckets with visits are kept, so rollups stay small even
+    for season-long experiments. Each level is aggregated from the previous (finer) one, not from the visits.
+    """
+    timestamps = visits['Scan Date and Time'].values.astype('datetime64[ms]').view(np.int64)
+    genotypes = pd.Categorical(visits['Genotype'])
+    resolutions = iter(TIMELINE_RESOLUTIONS.items())
+    resolution, bucket_milliseconds = next(resolutions)
+    buckets, bucket_codes = np.unique(timestamps // bucket_milliseconds * bucket_milliseconds, return_inverse=True)
+    genotypes_count = len(genotypes.categories)
+    counts = np.bincount(bucket_codes * genotypes_count + genotypes.codes,
+                         minlength=len(buckets) * genotypes_count).reshape(len(buckets), genotypes_count)
+    rollup = pd.DataFrame(counts, index=buckets, columns=[str(genotype) for genotype in genotypes.categories])
+    rollup[ALL_GENOTYPES] = counts.sum(axis=1)
+    timeline = {resolution: rollup}
+    for resolution, bucket_milliseconds in resolutions:
+        rollup = rollup.groupby(rollup.index // bucket_milliseconds * bucket_milliseconds).sum()
+        timeline[resolution] = rollup
+    return timeline
+
+
+def update_visits_timeline(timeline: Dict[str, pd.DataFrame], added_visits: pd.DataFrame,
+                           removed_visits: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Returns the timeline with the counts of some visits added and of others removed, building only the rollups of
+    those visits instead of the whole timeline again. Buckets left without visits are dropped.
+    The genotypes of the added and removed visits are the categories of all the visits, so the columns of their
+    rollups include the genotypes of the timeline.
+    """
+    added_timeline = build_visits_timeline(added_visits)
+    removed_timeline = build_visits_timeline(removed_visits)
+    updated_timeline = {}
+    for resolution, rollup in timeline.items():
+        columns = added_timeline[resolution].columns
+        counts = rollup.add(added_timeline[resolution], fill_value=0).sub(removed_timeline[resolution], fill_value=0)
+        counts = counts.reindex(columns=columns, fill_value=0).fillna(0).astype(np.int64)
+        updated_timeline[resolution] = counts[counts[ALL_GENOTYPES] != 0]
+    return updated_timeline
+
+
+def select_timeline_range(timeline: Dict[str, pd.DataFrame], start: int = None, end: int = None,
+                          genotype: str = ALL_GENOTYPES, max_points: int = TIMELINE_MAX_POINTS,
+                          resolution: str = None) -> dict:
+    """
+    Returns the visit counts of a genotype between start and end (epoch milliseconds, the whole timeline if None),
+    at the given resolution or, if None, at the finest one that fits in max_points buckets (or days, the coarsest).
+    Buckets without visits are included with a count of 0. The range is clipped to the buckets with visits.
+    """
+    finest_rollup = timeline[next(iter(TIMELINE_RESOLUTIONS))]
+    if finest_rollup.empty:
+        resolution = resolution or "day"
+        return {"resolution": resolution, "bucket_milliseconds": TIMELINE_RESOLUTIONS[resolution], "buckets": [],
+                "visits": []}
+    first_visit, last_visit = int(finest_rollup.index.min()), int(finest_rollup.index.max())
+    start = first_visit if start is None else min(max(int(start), first_visit), last_visit)
+    end = last_visit if end is None else max(min(int(end), last_visit), start)
+    if resolution is None:
+        for resolution, bucket_milliseconds in TIMELINE_RESOLUTIONS.items():
+            if (end - start) // bucket_milliseconds + 1 <= max_points:
+                break
+    bucket_milliseconds = TIMELINE_RESOLUTIONS[resolution]
+    first_bucket = start // bucket_milliseconds * bucket_milliseconds
+    buckets = np.arange(first_bucket, end + 1, bucket_milliseconds, dtype=np.int64)
+    counts = timeline[resolution][genotype] if genotype in timeline[resolution] else pd.Series(dtype=np.int64)
+    visits_counts = counts.reindex(buckets, fill_value=0)
+    return {"resolution": resolution,
+            "bucket_milliseconds": bucket_milliseconds,
+            "buckets": buckets.tolist(),
+            "visits": visits_counts.astype(np.int64).tolist()}
@@ -0,0 +1,54 @@
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import List
+
+WORKSPACES_FOLDER = '/tmp/workspaces'
+WORKSPACE_TTL_SECONDS = 6 * 60 * 60
+WORKSPACE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Workspace:
+    """
+    Folders of a single user session: uploaded files, exported tables and plots.
+    Each session works in its own workspace, named after a random id, so concurrent users never read, overwrite
+    or delete each other's files. The id is also the key of the stored state of the session's pipeline.
+    Workspaces not used for a while are removed by collect_expired_workspaces.
+    """
+
+    def __init__(self, workspace_id: str = None, root: str = WORKSPACES_FOLDER):
+        # An invalid or missing id (no cookie yet, or a tampered one) gets a brand new workspace
+        self.workspace_id = workspace_id if is_valid_workspace_id(workspace_id) else uuid.uuid4().hex
+        self.folder = os.path.join(root, self.workspace_id)
+        self.uploads_folder = os.path.join(self.folder, 'uploads')
+        self.exports_folder = os.path.join(self.folder, 'exports')
+        self.plots_folder = os.path.join(self.folder, 'plots')
+
+    def create(self):
+        """ Creates the folders of the workspace if needed, and marks it as used """
+        for folder in (self.uploads_folder, self.exports_folder, self.plots_folder):
+            os.makedirs(folder, exist_ok=True)
+        self.touch()
+
+    def touch(self):
+        """ Marks the workspace as used now, delaying its expiration """
+        os.utime(self.folder)
+
+
+def is_valid_workspace_id(workspace_id: str) -> bool:
+    return isinstance(workspace_id, str) and WORKSPACE_ID_PATTERN.match(workspace_id) is not None
+
+
+def collect_expired_workspaces(root: str = WORKSPACES_FOLDER, ttl_seconds: float = WORKSPACE_TTL_SECONDS) -> List[str]:
+    """ Removes the workspaces that have not been used in ttl_seconds, and returns their ids """
+    if not os.path.isdir(root):
+        return []
+    limit = time.time() - ttl_seconds
+    expired_workspaces = []
+    for entry in os.scandir(root):
+        if entry.is_dir() and is_valid_workspace_id(entry.name) and entry.stat().st_mtime < limit:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            expired_workspaces.append(entry.name)
+    return expired_workspaces